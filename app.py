@@ -8,11 +8,15 @@ from fastapi.templating import Jinja2Templates
 from starlette.responses import HTMLResponse, RedirectResponse
 from uvicorn import run as app_run
 
-from typing import Optional
+from pydantic import BaseModel
+from typing import List, Optional
 
 from us_visa.constants import APP_HOST, APP_PORT
+from us_visa.entity.config_entity import ServingExecutorConfig, ServingPreloadConfig, USvisaBatchingConfig
+from us_visa.pipeline.executor_pool import ExecutorPool
+from us_visa.pipeline.micro_batcher import MicroBatcher
 from us_visa.pipeline.prediction_pipeline import USvisaData, USvisaClassifier
-from us_visa.pipeline.training_pipeline import TrainingPipeline
+from us_visa.pipeline.training_jobs import TrainingJobRunner
 
 app = FastAPI()
 
@@ -30,6 +34,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+executor_config = ServingExecutorConfig()
+inference_pool = ExecutorPool.threads(name="inference",
+                                      max_workers=executor_config.inference_pool_size,
+                                      max_queue_size=executor_config.inference_max_queue_size)
+training_pool = ExecutorPool.processes(name="training",
+                                       max_workers=executor_config.training_pool_size,
+                                       max_queue_size=executor_config.training_max_queue_size)
+training_job_runner = TrainingJobRunner(executor_pool=training_pool)
+
+# with gunicorn preload_app this runs once in the master, the forked workers share the loaded model
+preload_config = ServingPreloadConfig()
+if preload_config.enabled:
+    USvisaClassifier().preload()
+
+
+def predict_dataframe(dataframe):
+    return USvisaClassifier().predict(dataframe=dataframe)
+
+
+def predict_record(record):
+    return USvisaClassifier().predict_record(record=record)
+
+
+def predict_batch_labels(dataframe):
+    return USvisaClassifier().predict_batch(dataframe=dataframe)
+
+
+batching_config = USvisaBatchingConfig()
+micro_batcher = None
+if batching_config.enabled:
+    micro_batcher = MicroBatcher(predict_fn=predict_dataframe,
+                                 batching_config=batching_config,
+                                 executor_pool=inference_pool)
+
+
+@app.on_event("shutdown")
+def shutdownExecutorPools():
+    inference_pool.shutdown()
+    training_pool.shutdown()
+
 class DataForm:
     def __init__(self, request: Request):
         self.request: Request = request
@@ -58,6 +102,18 @@ class DataForm:
         self.unit_of_wage = form.get("unit_of_wage")
         self.full_time_position = form.get("full_time_position")
 
+class USvisaRecord(BaseModel):
+    continent: str
+    education_of_employee: str
+    has_job_experience: str
+    requires_job_training: str
+    no_of_employees: int
+    company_age: int
+    region_of_employment: str
+    prevailing_wage: float
+    unit_of_wage: str
+    full_time_position: str
+
 @app.get("/", tags=["authentication"])
 async def index(request: Request):
 
@@ -68,16 +124,22 @@ async def index(request: Request):
 @app.get("/train")
 async def trainRouteClient():
     try:
-        train_pipeline = TrainingPipeline()
+        job = training_job_runner.submit()
 
-        train_pipeline.run_pipeline()
-
-        return Response("Training successful !!")
+        return {"status": True, **job}
 
     except Exception as e:
         return Response(f"Error Occurred! {e}")
 
 
+@app.get("/train/{job_id}")
+async def trainStatusRouteClient(job_id: str):
+    job_status = training_job_runner.get_status(job_id)
+    if job_status is None:
+        return {"status": False, "error": f"Unknown training job {job_id}"}
+    return {"status": True, **job_status}
+
+
 @app.post("/")
 async def predictRouteClient(request: Request):
     try:
@@ -97,11 +159,11 @@ async def predictRouteClient(request: Request):
                                 full_time_position= form.full_time_position,
                                 )
         
-        usvisa_df = usvisa_data.get_usvisa_input_data_frame()
-
-        model_predictor = USvisaClassifier()
-
-        value = model_predictor.predict(dataframe=usvisa_df)[0]
+        if micro_batcher is not None:
+            usvisa_df = usvisa_data.get_usvisa_input_data_frame()
+            value = (await micro_batcher.predict(usvisa_df))[0]
+        else:
+            value = (await inference_pool.run(predict_record, usvisa_data.get_usvisa_data_as_record()))[0]
 
         status = None
         if value == 1:
@@ -118,5 +180,38 @@ async def predictRouteClient(request: Request):
         return {"status": False, "error": f"{e}"}
 
 
+@app.post("/predict/batch")
+async def predictBatchRouteClient(records: List[USvisaRecord]):
+    try:
+        usvisa_df = USvisaData.get_usvisa_batch_data_frame([dict(record) for record in records])
+
+        predictions = await inference_pool.run(predict_batch_labels, usvisa_df)
+
+        return {"status": True, "predictions": predictions}
+
+    except Exception as e:
+        return {"status": False, "error": f"{e}"}
+
+
+@app.get("/health")
+async def healthRouteClient():
+    return {"status": True,
+            "pools": {"inference": inference_pool.get_stats(), "training": training_pool.get_stats()}}
+
+
+@app.get("/predict/cache/stats")
+async def predictionCacheStatsRouteClient():
+    if USvisaClassifier.prediction_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **USvisaClassifier.prediction_cache.get_stats()}
+
+
+@app.get("/predict/batching/stats")
+async def batchingStatsRouteClient():
+    if micro_batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **micro_batcher.get_stats()}
+
+
 if __name__ == "__main__":
     app_run(app, host=APP_HOST, port=APP_PORT)
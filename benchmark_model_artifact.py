@@ -0,0 +1,63 @@
+"""
+Compares loading a trained model from a dill pickle with loading it from the memory mappable
+model artifact format written by save_object.
+
+    python benchmark_model_artifact.py artifact/<timestamp>/model_trainer/trained_model/model.pkl
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import dill
+
+from us_visa.utils.main_utils import load_object, save_object
+
+
+def measure(load_fn, repeats: int) -> tuple:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        load_fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    obj = load_fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return min(timings), peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model_path", help="Trained model, either a dill pickle or a model artifact")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    model = load_object(args.model_path)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dill_path = os.path.join(tmp_dir, "model.dill")
+        artifact_path = os.path.join(tmp_dir, "model.usvisa")
+        with open(dill_path, "wb") as file_obj:
+            dill.dump(model, file_obj)
+        save_object(artifact_path, model)
+        del model
+
+        def load_dill():
+            with open(dill_path, "rb") as file_obj:
+                return dill.load(file_obj)
+
+        results = {
+            "dill": (os.path.getsize(dill_path),) + measure(load_dill, args.repeats),
+            "model artifact (mmap)": (os.path.getsize(artifact_path),) +
+                                     measure(lambda: load_object(artifact_path), args.repeats),
+        }
+
+    print(f"{'format':<24}{'size MB':>10}{'load ms':>10}{'peak MB':>10}")
+    for name, (size, seconds, peak) in results.items():
+        print(f"{name:<24}{size / 2 ** 20:>10.2f}{seconds * 1000:>10.2f}{peak / 2 ** 20:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
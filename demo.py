@@ -1,4 +1,11 @@
+import argparse
+
 from us_visa.pipeline.training_pipeline import TrainingPipeline
 
-pipeline = TrainingPipeline()
-pipeline.run_pipeline()
\ No newline at end of file
+parser = argparse.ArgumentParser(description="Runs the training pipeline")
+parser.add_argument("--force", action="store_true",
+                    help="recompute every stage instead of reusing the artifacts found in the stage cache")
+args = parser.parse_args()
+
+pipeline = TrainingPipeline(force=args.force)
+pipeline.run_pipeline()
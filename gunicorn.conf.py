@@ -0,0 +1,12 @@
+import os
+
+# must be set before us_visa.constants is imported, it makes app.py load the model in the master
+os.environ.setdefault("SERVING_PRELOAD_MODEL", "true")
+
+from us_visa.constants import APP_HOST, APP_PORT, SERVING_WORKERS
+
+bind = f"{APP_HOST}:{APP_PORT}"
+workers = SERVING_WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+# import app.py, and with it the model, once in the master before forking the workers
+preload_app = True
@@ -0,0 +1,130 @@
+import io
+import os
+import threading
+
+import boto3
+import dill
+import pytest
+from boto3.s3.transfer import TransferConfig
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+
+from us_visa.cloud_storage.aws_storage import SimpleStorageService
+from us_visa.cloud_storage.disk_cache import DiskModelCache
+from us_visa.exception import USVisaException
+
+BUCKET_NAME = "model-bucket"
+MODEL_FILE = "model.pkl"
+MODEL = {"weights": [1.0, 2.0, 3.0]}
+MODEL_BYTES = dill.dumps(MODEL)
+
+
+@pytest.fixture
+def s3_client():
+    client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="testing",
+                          aws_secret_access_key="testing")
+    with Stubber(client) as stubber:
+        client.stubber = stubber
+        yield client
+        stubber.assert_no_pending_responses()
+
+
+def make_storage(s3_client, cache_dir: str, max_bytes: int = 10 ** 9) -> SimpleStorageService:
+    # the constructor reads the AWS credentials from the environment
+    storage = object.__new__(SimpleStorageService)
+    storage.s3_client = s3_client
+    storage.transfer_config = TransferConfig(use_threads=False)
+    storage.disk_cache = DiskModelCache(cache_dir, max_bytes=max_bytes)
+    return storage
+
+
+def add_head_object(s3_client, etag: str) -> None:
+    s3_client.stubber.add_response("head_object", {"ETag": etag, "ContentLength": len(MODEL_BYTES)},
+                                   {"Bucket": BUCKET_NAME, "Key": MODEL_FILE})
+
+
+def add_download(s3_client, etag: str) -> None:
+    # download_file sizes the object with a HEAD request before the GET
+    add_head_object(s3_client, etag)
+    s3_client.stubber.add_response("get_object", {
+        "ETag": etag, "ContentLength": len(MODEL_BYTES),
+        "Body": StreamingBody(io.BytesIO(MODEL_BYTES), len(MODEL_BYTES))})
+
+
+def cached_files(cache_dir) -> list:
+    return sorted(name for _, _, names in os.walk(cache_dir) for name in names if name != ".lock")
+
+
+def test_miss_downloads_and_hit_loads_from_disk(s3_client, tmp_path):
+    storage = make_storage(s3_client, str(tmp_path))
+    add_head_object(s3_client, '"v1"')
+    add_download(s3_client, '"v1"')
+    add_head_object(s3_client, '"v1"')
+    assert storage.load_cached_model(MODEL_FILE, BUCKET_NAME) == MODEL
+    assert cached_files(tmp_path) == ["v1.model"]
+
+    # a hit only fetches the ETag
+    add_head_object(s3_client, '"v1"')
+    assert storage.load_cached_model(MODEL_FILE, BUCKET_NAME) == MODEL
+
+
+def test_object_replaced_during_download_is_not_cached(s3_client, tmp_path):
+    storage = make_storage(s3_client, str(tmp_path))
+    add_download(s3_client, '"v2"')
+    add_head_object(s3_client, '"v2"')
+    with pytest.raises(USVisaException, match="changed during the download"):
+        storage.load_cached_model(MODEL_FILE, BUCKET_NAME, etag='"v1"')
+    assert cached_files(tmp_path) == []
+
+
+def test_latest_entry_is_loaded_when_s3_is_unreachable(s3_client, tmp_path):
+    storage = make_storage(s3_client, str(tmp_path))
+    add_download(s3_client, '"v1"')
+    add_head_object(s3_client, '"v1"')
+    storage.load_cached_model(MODEL_FILE, BUCKET_NAME, etag='"v1"')
+
+    s3_client.stubber.add_client_error("head_object", service_error_code="503", http_status_code=503)
+    assert storage.load_cached_model(MODEL_FILE, BUCKET_NAME) == MODEL
+
+
+def write_entry(file_path: str) -> None:
+    with open(file_path, "wb") as file_obj:
+        file_obj.write(MODEL_BYTES)
+
+
+def test_concurrent_misses_fetch_once(tmp_path):
+    disk_cache = DiskModelCache(str(tmp_path), max_bytes=10 ** 9)
+    fetches, results = [], []
+    barrier = threading.Barrier(4)
+
+    def fetch(file_path: str) -> None:
+        fetches.append(file_path)
+        write_entry(file_path)
+
+    def load() -> None:
+        barrier.wait()
+        results.append(disk_cache.get_or_fetch(BUCKET_NAME, MODEL_FILE, '"v1"', fetch=fetch,
+                                               load=lambda file_path: dill.load(open(file_path, "rb"))))
+
+    threads = [threading.Thread(target=load) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(fetches) == 1
+    assert results == [MODEL] * 4
+
+
+def test_evict_skips_keys_being_loaded(tmp_path):
+    disk_cache = DiskModelCache(str(tmp_path), max_bytes=10 ** 9)
+    load = lambda file_path: None
+    for key in ("a.pkl", "b.pkl"):
+        disk_cache.get_or_fetch(BUCKET_NAME, key, '"v1"', fetch=write_entry, load=load)
+    disk_cache.max_bytes = 0
+
+    key_dir = disk_cache.get_key_dir(BUCKET_NAME, "a.pkl")
+    with disk_cache._key_lock(key_dir, exclusive=False):
+        assert disk_cache.evict() == 1
+    assert os.path.exists(disk_cache.get_entry_path(BUCKET_NAME, "a.pkl", '"v1"'))
+    assert not os.path.exists(disk_cache.get_entry_path(BUCKET_NAME, "b.pkl", '"v1"'))
+    assert disk_cache.evict() == 1
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from us_visa.components.data_transformation import DataTransformation
+from us_visa.entity.config_entity import DataTransformationConfig
+from us_visa.entity.fast_encoder import FastFeatureEncoder
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FILE_PATH = os.path.join(ROOT_DIR, "notebook", "EasyVisa.csv")
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    # config/schema.yaml is read relative to the working directory
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(ROOT_DIR)
+        data_transformation = DataTransformation(data_transformation_config=DataTransformationConfig(),
+                                                 data_ingestion_artifact=None,
+                                                 data_validation_artifact=None)
+        input_feature_df, _ = data_transformation.get_features_and_target(pd.read_csv(DATA_FILE_PATH))
+        preprocessor = data_transformation.get_data_transformer_object()
+        preprocessor.fit(input_feature_df)
+    return preprocessor, FastFeatureEncoder.from_preprocessor(preprocessor), input_feature_df
+
+
+def assert_same_features(actual, expected):
+    expected = np.asarray(expected, dtype=np.float64)
+    assert actual.shape == expected.shape
+    np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected))
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-9)
+
+
+def test_typed_records_match_transform(fitted):
+    preprocessor, encoder, input_feature_df = fitted
+    assert_same_features(encoder.encode_many(input_feature_df.to_dict("records")),
+                         preprocessor.transform(input_feature_df))
+
+
+def test_single_record_matches_transform(fitted):
+    preprocessor, encoder, input_feature_df = fitted
+    row = input_feature_df.iloc[[7]]
+    assert_same_features(encoder.encode(row.to_dict("records")[0]).reshape(1, -1), preprocessor.transform(row))
+
+
+def test_string_records_match_transform(fitted):
+    # the prediction form sends every field as a string
+    preprocessor, encoder, input_feature_df = fitted
+    sample = input_feature_df.sample(n=500, random_state=0)
+    records = [{column: str(value) for column, value in record.items()} for record in sample.to_dict("records")]
+    assert_same_features(encoder.encode_many(records), preprocessor.transform(sample))
+
+
+@pytest.mark.parametrize("column, value", [
+    ("continent", "Antarctica"),
+    ("unit_of_wage", "Fortnight"),
+    ("has_job_experience", "maybe"),
+    ("education_of_employee", "Kindergarten"),
+])
+def test_unknown_categories_are_rejected_like_transform(fitted, column, value):
+    preprocessor, encoder, input_feature_df = fitted
+    row = input_feature_df.iloc[[0]].copy()
+    row[column] = value
+    with pytest.raises(ValueError):
+        preprocessor.transform(row)
+    with pytest.raises(ValueError, match=column):
+        encoder.encode(row.to_dict("records")[0])
+
+
+def test_verify_parity(fitted):
+    preprocessor, encoder, input_feature_df = fitted
+    assert encoder.verify_parity(preprocessor, input_feature_df.head(1000)) <= 1e-9
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+import yaml
+from neuro_mf import ModelFactory
+from sklearn.datasets import make_classification
+
+from us_visa.utils.model_factory import ParallelModelFactory
+
+MODEL_CONFIG = {
+    "grid_search": {"class": "GridSearchCV", "module": "sklearn.model_selection", "params": {"cv": 3, "verbose": 0}},
+    "model_selection": {
+        "module_0": {
+            "class": "KNeighborsClassifier", "module": "sklearn.neighbors", "params": {"n_neighbors": 3},
+            "search_param_grid": {"n_neighbors": [3, 7, 11], "weights": ["uniform", "distance"]},
+        },
+        "module_1": {
+            "class": "RandomForestClassifier", "module": "sklearn.ensemble",
+            "params": {"n_estimators": 10, "random_state": 0},
+            "search_param_grid": {"max_depth": [2, 6], "min_samples_leaf": [1, 5]},
+        },
+    },
+}
+
+
+@pytest.fixture(scope="module")
+def data():
+    return make_classification(n_samples=600, n_features=8, weights=[0.7], random_state=0)
+
+
+def write_config(tmp_path, search: dict = None) -> str:
+    config = dict(MODEL_CONFIG)
+    if search is not None:
+        config["search"] = search
+    config_path = tmp_path / "model.yaml"
+    config_path.write_text(yaml.safe_dump(config))
+    return str(config_path)
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_grid_search_matches_model_factory(data, tmp_path, n_jobs):
+    X, y = data
+    config_path = write_config(tmp_path)
+    expected = ModelFactory(config_path).get_best_model(X, y, base_accuracy=0.5)
+    best = ParallelModelFactory(config_path, n_jobs=n_jobs).get_best_model(X, y, base_accuracy=0.5)
+    assert best.model_serial_number == expected.model_serial_number
+    assert best.best_parameters == expected.best_parameters
+    assert best.best_score == pytest.approx(expected.best_score)
+    np.testing.assert_array_equal(best.best_model.predict(X), expected.best_model.predict(X))
+
+
+def test_random_search_samples_n_candidates(data, tmp_path):
+    X, y = data
+    model_factory = ParallelModelFactory(write_config(tmp_path, {"strategy": "random", "n_candidates": 2}), n_jobs=1)
+    model_factory.get_best_model(X, y, base_accuracy=0.5)
+    assert [report["grid_points"] for report in model_factory.search_report.values()] == [2, 2]
+    assert all(report["fits"] == 2 * 3 for report in model_factory.search_report.values())
+
+
+def test_halving_search_keeps_the_best_of_each_round(data, tmp_path):
+    X, y = data
+    model_factory = ParallelModelFactory(
+        write_config(tmp_path, {"strategy": "halving", "factor": 2, "min_resources": 150}), n_jobs=1)
+    best = model_factory.get_best_model(X, y, base_accuracy=0.5)
+    grid_fits = sum(report["grid_points"] for report in model_factory.search_report.values()) * 3
+    # later rounds only refit the survivors
+    assert model_factory.fits < 2 * grid_fits
+    assert best.best_score > 0.5
+
+
+def test_budget_stops_the_search(data, tmp_path):
+    X, y = data
+    model_factory = ParallelModelFactory(write_config(tmp_path, {"strategy": "grid", "max_fits": 6}), n_jobs=1)
+    model_factory.get_best_model(X, y, base_accuracy=0.5)
+    # every model got at least one candidate before the budget ran out
+    assert 6 <= model_factory.fits < 10 * 3
+    assert all(report["fits"] > 0 for report in model_factory.search_report.values())
+
+
+def test_unknown_strategy_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match="Unknown search strategy"):
+        ParallelModelFactory(write_config(tmp_path, {"strategy": "bayes"}))
+
+
+def test_class_weight_is_given_to_supporting_models(tmp_path):
+    model_factory = ParallelModelFactory(write_config(tmp_path), class_weight={0: 1.0, 1: 3.0})
+    models = {type(detail.model).__name__: detail.model for detail in model_factory.get_initialized_model_list()}
+    assert models["RandomForestClassifier"].class_weight == {0: 1.0, 1: 3.0}
+    assert "class_weight" not in models["KNeighborsClassifier"].get_params()
+
+
+def test_folds_are_sliced_once_per_rows(data, tmp_path):
+    X, y = data
+    model_factory = ParallelModelFactory(write_config(tmp_path))
+    folds = model_factory.get_folds(X, y)
+    assert model_factory.get_folds(X.copy(), y.copy()) is folds
+    assert model_factory.get_folds(X[:300], y[:300]) is not folds
+    assert len(folds) == 3
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+from sklearn.preprocessing import StandardScaler
+
+from us_visa.utils.transform_cache import TransformCache, data_hash
+
+
+@pytest.fixture
+def scaler():
+    return StandardScaler().fit(np.random.RandomState(0).rand(100, 10))
+
+
+def make_data(seed: int) -> np.ndarray:
+    return np.random.RandomState(seed).rand(1000, 10)
+
+
+def test_results_are_computed_once(scaler, tmp_path):
+    cache = TransformCache(cache_dir=str(tmp_path))
+    data = make_data(1)
+    first = cache.transform(scaler, data)
+    np.testing.assert_array_equal(first, scaler.transform(data))
+    assert cache.transform(scaler, data.copy()) is first
+    assert cache.stats["misses"] == 1 and cache.stats["memory_hits"] == 1
+
+    # another run finds the array on disk
+    other_run = TransformCache(cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(other_run.transform(scaler, data), first)
+    assert other_run.stats["disk_hits"] == 1
+
+
+def test_key_changes_with_the_fitted_transformer_and_the_data(scaler):
+    cache = TransformCache()
+    refitted = StandardScaler().fit(make_data(2))
+    assert cache.make_key(scaler, make_data(1)) == cache.make_key(scaler, make_data(1))
+    assert cache.make_key(scaler, make_data(1)) != cache.make_key(scaler, make_data(3))
+    assert cache.make_key(scaler, make_data(1)) != cache.make_key(refitted, make_data(1))
+    assert data_hash(make_data(1)) != data_hash(make_data(1).astype(np.float32))
+
+
+def test_memory_is_bounded(scaler):
+    data = [make_data(seed) for seed in range(3)]
+    cache = TransformCache(max_bytes=2 * data[0].nbytes)
+    for item in data:
+        cache.transform(scaler, item)
+    assert len(cache.entries) == 2
+    assert cache.entry_bytes <= cache.max_bytes
+
+
+def test_disk_evicts_least_recently_used(scaler, tmp_path):
+    data = [make_data(seed) for seed in range(5)]
+    entry_bytes = scaler.transform(data[0]).nbytes + 128
+    cache = TransformCache(cache_dir=str(tmp_path), max_bytes=0, disk_max_bytes=3 * entry_bytes)
+    for index, item in enumerate(data[:3]):
+        cache.transform(scaler, item)
+        os.utime(cache._entry_path(cache.make_key(scaler, item)), (index, index))
+    # a disk hit makes the first array the most recently used
+    cache.transform(scaler, data[0])
+    for item in data[3:]:
+        cache.transform(scaler, item)
+
+    kept = {os.path.basename(name)[:-len(".npy")] for _, _, names in os.walk(tmp_path) for name in names}
+    assert kept == {cache.make_key(scaler, data[index]) for index in (0, 3, 4)}
+    assert cache.stats["disk_evictions"] == 2
+
+
+def test_disabled_cache_computes_every_result(scaler, tmp_path):
+    cache = TransformCache(cache_dir=str(tmp_path), enabled=False)
+    cache.transform(scaler, make_data(1))
+    assert cache.stats["misses"] == 0 and os.listdir(tmp_path) == []
@@ -1,22 +1,43 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
 from us_visa.configuration.aws_connection import s3Client
 from io import StringIO
-from typing import Union,List
+from typing import Optional, Union,List
 import os,sys
+import tempfile
+from us_visa.constants import (S3_TRANSFER_MULTIPART_THRESHOLD, S3_TRANSFER_MULTIPART_CHUNKSIZE,
+                               S3_TRANSFER_MAX_CONCURRENCY, S3_TRANSFER_DOWNLOAD_DIR, MODEL_CACHE_DISK_ENABLED,
+                               MODEL_CACHE_DISK_DIR, MODEL_CACHE_DISK_MAX_BYTES)
+from us_visa.cloud_storage.disk_cache import DiskModelCache
 from us_visa.logger import logging
 from mypy_boto3_s3.service_resource import Bucket
 from us_visa.exception import USVisaException
 from botocore.exceptions import ClientError
 from pandas import DataFrame,read_csv
-import pickle
+from us_visa.utils.main_utils import load_object
 
 
 class SimpleStorageService:
 
-    def __init__(self):
+    def __init__(self, transfer_config: Optional[TransferConfig] = None, disk_cache: Optional[DiskModelCache] = None):
+        """
+        :param transfer_config: Multipart settings of the uploads and downloads, from the S3_TRANSFER constants when None
+        :param disk_cache: Local cache of the downloaded models, from the MODEL_CACHE_DISK constants when None
+        """
         s3_client = s3Client()
         self.s3_resource = s3_client.s3_resource
         self.s3_client = s3_client.s3_client
+        self.transfer_config = transfer_config or self.get_transfer_config()
+        if disk_cache is None and MODEL_CACHE_DISK_ENABLED:
+            disk_cache = DiskModelCache(MODEL_CACHE_DISK_DIR, max_bytes=MODEL_CACHE_DISK_MAX_BYTES)
+        self.disk_cache = disk_cache
+
+    @staticmethod
+    def get_transfer_config() -> TransferConfig:
+        return TransferConfig(multipart_threshold=S3_TRANSFER_MULTIPART_THRESHOLD,
+                              multipart_chunksize=S3_TRANSFER_MULTIPART_CHUNKSIZE,
+                              max_concurrency=S3_TRANSFER_MAX_CONCURRENCY,
+                              use_threads=S3_TRANSFER_MAX_CONCURRENCY > 1)
 
     def s3_key_path_available(self,bucket_name,s3_key)->bool:
         try:
@@ -106,15 +127,19 @@ class SimpleStorageService:
         except Exception as e:
             raise USVisaException(e, sys) from e
 
-    def load_model(self, model_name: str, bucket_name: str, model_dir: str = None) -> object:
+    def load_model(self, model_name: str, bucket_name: str, model_dir: str = None, etag: str = None) -> object:
         """
         Method Name :   load_model
-        Description :   This method loads the model_name model from bucket_name bucket with kwargs
+        Description :   This method loads the model_name model from bucket_name bucket with kwargs. The local
+                        disk cache is checked first with the ETag of the object (given or fetched with a HEAD
+                        request), so workers and restarts share one download per model version. Otherwise the
+                        object is downloaded into a local file with parallel ranged requests and loaded from the
+                        file; the arrays of a model artifact stay memory mapped from the file
 
         Output      :   list of objects or object is returned based on filename
         On Failure  :   Write an exception log and then raise an exception
 
-        Version     :   1.2
+        Version     :   1.3
         Revisions   :   moved setup to cloud
         """
         logging.info("Entered the load_model method of S3Operations class")
@@ -126,15 +151,98 @@ class SimpleStorageService:
                 else model_dir + "/" + model_name
             )
             model_file = func()
-            file_object = self.get_file_object(model_file, bucket_name)
-            model_obj = self.read_object(file_object, decode=False)
-            model = pickle.loads(model_obj)
+            if self.disk_cache is not None:
+                model = self.load_cached_model(model_file, bucket_name, etag)
+            else:
+                file_descriptor, file_path = tempfile.mkstemp(suffix=".pkl", dir=S3_TRANSFER_DOWNLOAD_DIR or None)
+                os.close(file_descriptor)
+                try:
+                    self.download_file(model_file, file_path, bucket_name)
+                    model = load_object(file_path)
+                finally:
+                    os.remove(file_path)
             logging.info("Exited the load_model method of S3Operations class")
             return model
 
         except Exception as e:
             raise USVisaException(e, sys) from e
 
+    def load_cached_model(self, model_file: str, bucket_name: str, etag: str = None) -> object:
+        """
+        Method Name :   load_cached_model
+        Description :   This method loads the model_file object of bucket_name bucket from the disk cache,
+                        downloading it on a miss. When the ETag cannot be fetched the latest cached version is
+                        used, so a restart does not depend on s3 being reachable
+
+        Output      :   The loaded model
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            if etag is None:
+                try:
+                    etag = self.get_object_etag(model_file, bucket_name=bucket_name)
+                except Exception as e:
+                    model = self.disk_cache.load_latest(bucket_name, model_file, load=load_object)
+                    if model is None:
+                        raise
+                    logging.warning(f"Could not fetch the ETag of {model_file}, using the cached model: {e}")
+                    return model
+            return self.disk_cache.get_or_fetch(
+                bucket_name, model_file, etag,
+                fetch=lambda file_path: self.download_file(model_file, file_path, bucket_name, etag=etag),
+                load=load_object)
+
+        except Exception as e:
+            raise USVisaException(e, sys) from e
+
+    def download_file(self, from_filename: str, to_filename: str, bucket_name: str, etag: str = None) -> None:
+        """
+        Method Name :   download_file
+        Description :   This method downloads the from_filename object of bucket_name bucket to the to_filename
+                        local file, objects above the multipart threshold in parts fetched concurrently. With
+                        etag the ETag of the object is checked again with a HEAD request once the download is
+                        done, so the download fails instead of returning other bytes when the object was
+                        replaced in between
+
+        Output      :   The object is written to to_filename
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        logging.info("Entered the download_file method of S3Operations class")
+
+        try:
+            self.s3_client.download_file(bucket_name, from_filename, to_filename, Config=self.transfer_config)
+            if etag is not None:
+                # download_file accepts no IfMatch, the parts may come from a newer object
+                current_etag = self.get_object_etag(from_filename, bucket_name=bucket_name)
+                if current_etag != etag:
+                    raise ValueError(f"{from_filename} of {bucket_name} bucket changed during the download, "
+                                     f"ETag {current_etag} instead of {etag}")
+            logging.info(f"Downloaded {from_filename} file of {bucket_name} bucket to {to_filename}")
+            logging.info("Exited the download_file method of S3Operations class")
+
+        except Exception as e:
+            raise USVisaException(e, sys) from e
+
+    def get_object_etag(self, model_name: str, bucket_name: str, model_dir: str = None) -> str:
+        """
+        Method Name :   get_object_etag
+        Description :   This method fetches the ETag of the model_name object with a HEAD request,
+                        without downloading the object body
+
+        Output      :   ETag of the object is returned
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        logging.info("Entered the get_object_etag method of S3Operations class")
+
+        try:
+            model_file = model_name if model_dir is None else model_dir + "/" + model_name
+            response = self.s3_client.head_object(Bucket=bucket_name, Key=model_file)
+            logging.info("Exited the get_object_etag method of S3Operations class")
+            return response["ETag"]
+
+        except Exception as e:
+            raise USVisaException(e, sys) from e
+
     def create_folder(self, folder_name: str, bucket_name: str) -> None:
         """
         Method Name :   create_folder
@@ -178,7 +286,7 @@ class SimpleStorageService:
             )
 
             self.s3_resource.meta.client.upload_file(
-                from_filename, bucket_name, to_filename
+                from_filename, bucket_name, to_filename, Config=self.transfer_config
             )
 
             logging.info(
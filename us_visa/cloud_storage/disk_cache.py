@@ -0,0 +1,166 @@
+import hashlib
+import os
+import re
+import sys
+import tempfile
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+from us_visa.exception import USVisaException
+from us_visa.logger import logging
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - windows has no flock, concurrent misses then download more than once
+    fcntl = None
+
+LOCK_FILE_NAME = ".lock"
+ENTRY_SUFFIX = ".model"
+
+
+class DiskModelCache:
+    """
+    Class Name: DiskModelCache
+    Description: Cache of the model files downloaded from s3 on local disk, shared by the worker processes and
+                 kept across restarts. An entry is the file of one bucket, key and ETag, written to a temporary
+                 file and renamed into place so readers never see a partial file. A lock per key makes
+                 concurrent misses download once, and entries are loaded under it so eviction, which skips the
+                 keys locked by a reader, never removes a file between its lookup and its load. The least
+                 recently used entries are evicted beyond max_bytes.
+    On Failure: Raise Exception
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        :param cache_dir: Directory of the cached model files
+        :param max_bytes: Total size of the entries kept, the entry just used is never evicted
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def get_key_dir(self, bucket_name: str, key: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(f"{bucket_name}/{key}".encode("utf-8")).hexdigest()[:32])
+
+    def get_entry_path(self, bucket_name: str, key: str, etag: str) -> str:
+        # ETags are quoted hex digests, with a -<parts> suffix for multipart uploads
+        return os.path.join(self.get_key_dir(bucket_name, key), re.sub(r"[^0-9A-Za-z-]", "", etag) + ENTRY_SUFFIX)
+
+    @staticmethod
+    @contextmanager
+    def _key_lock(key_dir: str, exclusive: bool, blocking: bool = True) -> Iterator[None]:
+        """
+        Holds the lock of a key, shared by readers and exclusive for downloads and evictions. Raises
+        BlockingIOError when blocking is not set and the lock is held
+        """
+        with open(os.path.join(key_dir, LOCK_FILE_NAME), "a") as lock_file:
+            if fcntl is None:
+                yield
+                return
+            operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            fcntl.flock(lock_file.fileno(), operation if blocking else operation | fcntl.LOCK_NB)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def load_latest(self, bucket_name: str, key: str, load: Callable[[str], object]) -> Optional[object]:
+        """
+        Returns load(file_path) of the most recently downloaded entry of bucket_name/key whatever its ETag,
+        None when there is none
+        """
+        key_dir = self.get_key_dir(bucket_name, key)
+        if not os.path.isdir(key_dir):
+            return None
+        with self._key_lock(key_dir, exclusive=False):
+            entries = [os.path.join(key_dir, name) for name in os.listdir(key_dir) if name.endswith(ENTRY_SUFFIX)]
+            entry_path = max(entries, key=os.path.getmtime, default=None)
+            if entry_path is None:
+                return None
+            logging.info(f"Loading the latest cached model of s3://{bucket_name}/{key} from {entry_path}")
+            return load(entry_path)
+
+    def get_or_fetch(self, bucket_name: str, key: str, etag: str, fetch: Callable[[str], None],
+                     load: Callable[[str], object]) -> object:
+        """
+        Method Name: get_or_fetch
+        Description: Returns load(file_path) of the cached file of bucket_name/key at etag. On a miss
+                     fetch(file_path) downloads it, while the other processes missing the same key wait for the
+                     download. The file is loaded while the lock of the key is held.
+        Output: The loaded model
+        On Failure: Raise Exception, no entry is left behind
+        """
+        try:
+            entry_path = self.get_entry_path(bucket_name, key, etag)
+            key_dir = os.path.dirname(entry_path)
+            os.makedirs(key_dir, exist_ok=True)
+            with self._key_lock(key_dir, exclusive=False):
+                if os.path.exists(entry_path):
+                    self._touch(entry_path)
+                    logging.info(f"Model s3://{bucket_name}/{key} with ETag {etag} found in disk cache")
+                    return load(entry_path)
+
+            with self._key_lock(key_dir, exclusive=True):
+                # another process may have downloaded it while this one waited for the lock
+                if os.path.exists(entry_path):
+                    self._touch(entry_path)
+                    return load(entry_path)
+                file_descriptor, tmp_file_path = tempfile.mkstemp(suffix=".tmp", dir=key_dir)
+                os.close(file_descriptor)
+                try:
+                    fetch(tmp_file_path)
+                    os.replace(tmp_file_path, entry_path)
+                except BaseException:
+                    os.remove(tmp_file_path)
+                    raise
+                logging.info(f"Stored model s3://{bucket_name}/{key} with ETag {etag} in disk cache")
+                model = load(entry_path)
+            self.evict(keep=entry_path)
+            return model
+        except Exception as e:
+            raise USVisaException(e, sys) from e
+
+    @staticmethod
+    def _touch(entry_path: str) -> None:
+        # the modification time orders the entries for eviction
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+    def _list_entries(self) -> List[str]:
+        entries = []
+        for root, _, file_names in os.walk(self.cache_dir):
+            entries.extend(os.path.join(root, name) for name in file_names if name.endswith(ENTRY_SUFFIX))
+        return entries
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """
+        Removes the least recently used entries until the cache holds at most max_bytes, the entries of keys
+        being loaded or downloaded are skipped. Processes still mapping a removed file keep reading it.
+        Returns the number of entries removed
+        """
+        entries = []
+        for entry_path in self._list_entries():
+            try:
+                stat = os.stat(entry_path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry_path == keep:
+                continue
+            try:
+                with self._key_lock(os.path.dirname(entry_path), exclusive=True, blocking=False):
+                    os.remove(entry_path)
+            except BlockingIOError:
+                continue
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            logging.info(f"Evicted {entry_path} from disk model cache")
+        return removed
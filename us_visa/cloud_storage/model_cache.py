@@ -0,0 +1,136 @@
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from us_visa.cloud_storage.aws_storage import SimpleStorageService
+from us_visa.constants import MODEL_CACHE_REFRESH_INTERVAL_SECONDS
+from us_visa.exception import USVisaException
+from us_visa.logger import logging
+
+
+@dataclass
+class CachedModel:
+    model: object
+    etag: str
+    loaded_at: float
+
+
+class ModelCache:
+    """
+    Class Name: ModelCache
+    Description: Process wide cache of the models loaded from s3, keyed by bucket name and model path.
+                 A daemon thread revalidates the ETag of every cached model each refresh_interval seconds
+                 and reloads only the models whose object changed in the bucket.
+    On Failure: Raise Exception
+    """
+
+    entries: Dict[Tuple[str, str], CachedModel] = {}
+    lock = threading.RLock()
+    refresher: Optional[threading.Thread] = None
+    refresh_interval: float = MODEL_CACHE_REFRESH_INTERVAL_SECONDS
+
+    def __init__(self, refresh_interval: Optional[float] = None):
+        """
+        :param refresh_interval: Seconds between two ETag checks, 0 disables the revalidation
+        """
+        if refresh_interval is not None:
+            ModelCache.refresh_interval = refresh_interval
+        self.s3 = SimpleStorageService()
+
+    def _load(self, bucket_name: str, model_path: str) -> CachedModel:
+        # the ETag is read before the body so a concurrent upload is caught by the next refresh
+        etag = self.s3.get_object_etag(model_path, bucket_name=bucket_name)
+        model = self.s3.load_model(model_path, bucket_name=bucket_name, etag=etag)
+        logging.info(f"Loaded model s3://{bucket_name}/{model_path} with ETag {etag} into model cache")
+        return CachedModel(model=model, etag=etag, loaded_at=time.time())
+
+    def get_model(self, bucket_name: str, model_path: str) -> object:
+        """
+        Method Name: get_model
+        Description: Returns the cached model of bucket_name/model_path, loading it from s3 on a miss.
+        Output: Model object
+        On Failure: Raise Exception
+        """
+        try:
+            cache_key = (bucket_name, model_path)
+            entry = ModelCache.entries.get(cache_key)
+            if entry is None:
+                with ModelCache.lock:
+                    entry = ModelCache.entries.get(cache_key)
+                    if entry is None:
+                        entry = self._load(bucket_name=bucket_name, model_path=model_path)
+                        ModelCache.entries[cache_key] = entry
+            self._ensure_refresher()
+            return entry.model
+        except Exception as e:
+            raise USVisaException(e, sys) from e
+
+    def preload(self, bucket_name: str, model_path: str) -> object:
+        """
+        Method Name: preload
+        Description: Loads the model into the cache without starting the refresher thread, for the serving
+                     master process that forks the workers. Every worker starts its own refresher on its
+                     first get_model call.
+        Output: Model object
+        On Failure: Raise Exception
+        """
+        try:
+            with ModelCache.lock:
+                entry = self._load(bucket_name=bucket_name, model_path=model_path)
+                ModelCache.entries[(bucket_name, model_path)] = entry
+            return entry.model
+        except Exception as e:
+            raise USVisaException(e, sys) from e
+
+    def get_etag(self, bucket_name: str, model_path: str) -> Optional[str]:
+        """
+        Returns the ETag of the cached model or None when it is not loaded yet
+        """
+        entry = ModelCache.entries.get((bucket_name, model_path))
+        return None if entry is None else entry.etag
+
+    def invalidate(self, bucket_name: str, model_path: str) -> None:
+        """
+        Drops the cached model so the next get_model call reloads it from s3
+        """
+        with ModelCache.lock:
+            ModelCache.entries.pop((bucket_name, model_path), None)
+
+    def refresh(self) -> None:
+        """
+        Method Name: refresh
+        Description: Compares the ETag of every cached model with s3 and reloads the changed ones.
+                     Serving keeps using the old model until the new one is fully loaded.
+        Output: None
+        On Failure: Write an exception log and keep the cached model
+        """
+        for (bucket_name, model_path), entry in list(ModelCache.entries.items()):
+            try:
+                etag = self.s3.get_object_etag(model_path, bucket_name=bucket_name)
+                if etag == entry.etag:
+                    continue
+                logging.info(f"ETag of s3://{bucket_name}/{model_path} changed from {entry.etag} to {etag}, reloading")
+                new_entry = self._load(bucket_name=bucket_name, model_path=model_path)
+                with ModelCache.lock:
+                    ModelCache.entries[(bucket_name, model_path)] = new_entry
+            except Exception as e:
+                logging.info(f"Model cache refresh of s3://{bucket_name}/{model_path} failed: {e}")
+
+    def _refresh_forever(self) -> None:
+        while ModelCache.refresh_interval > 0:
+            time.sleep(ModelCache.refresh_interval)
+            self.refresh()
+
+    def _ensure_refresher(self) -> None:
+        # threads do not survive a fork, so every worker process starts its own refresher
+        if ModelCache.refresh_interval <= 0:
+            return
+        if ModelCache.refresher is not None and ModelCache.refresher.is_alive():
+            return
+        with ModelCache.lock:
+            if ModelCache.refresher is None or not ModelCache.refresher.is_alive():
+                ModelCache.refresher = threading.Thread(target=self._refresh_forever,
+                                                        name="model-cache-refresher", daemon=True)
+                ModelCache.refresher.start()
@@ -1,14 +1,23 @@
 import os
 import sys
+from datetime import datetime
+from typing import Optional, Tuple
 
+from bson import ObjectId
+
+import pandas as pd
 from pandas import DataFrame
 from sklearn.model_selection import train_test_split
 
+from us_visa.constants import SCHEMA_FILE_PATH
 from us_visa.entity.artifact_entity import DataIngestionArtifact
 from us_visa.entity.config_entity import DataIngestionConfig    
 from us_visa.exception import USVisaException
 from us_visa.logger import logging  
 from us_visa.data_access.usvisa_data import USVisaData
+from us_visa.utils.artifact_writer import ArtifactWriter
+from us_visa.utils.main_utils import (read_yaml_file, write_yaml_file, read_dataframe, write_dataframe,
+                                     iter_dataframe_chunks, DataFrameWriter)
 
 
 class DataIngestion:
@@ -19,36 +28,52 @@ class DataIngestion:
     On Failure: Raise Exception
     """
 
-    def __init__(self, data_ingestion_config: DataIngestionConfig=DataIngestionConfig()):
+    def __init__(self, data_ingestion_config: DataIngestionConfig=DataIngestionConfig(),
+                 artifact_writer: Optional[ArtifactWriter] = None):
         """
         :param data_ingestion_config: Configuration for data ingestion
+        :param artifact_writer: Writer of the files, when set the train and test DataFrames are also handed
+                                to the next stages in memory through the DataIngestionArtifact
         """
         try:
             logging.info(f"{'>>'*20} Data Ingestion {'<<'*20}")
             self.data_ingestion_config = data_ingestion_config
+            self.in_memory_handoff = artifact_writer is not None
+            self.artifact_writer = artifact_writer or ArtifactWriter()
+            self.schema_info = read_yaml_file(SCHEMA_FILE_PATH)
         except Exception as e:
             raise USVisaException(e, sys)
     
-    def export_data_into_feature_store(self) -> DataFrame:
+    def export_data_into_feature_store(self) -> Optional[DataFrame]:
         """
         Method Name: export_data_into_feature_store
         Description: This method exports the data from MongoDB database to feature store.
-        Output: DataFrame
+                     In streaming mode the collection is appended to the feature store batch_size rows at a time.
+        Output: DataFrame, None in streaming mode
         On Failure: Raise Exception
         """
         try:
             logging.info("Exporting data from MongoDB to feature store")
             usvisa_data = USVisaData()
-            df: DataFrame = usvisa_data.get_collection_as_dataframe(
-                collection_name=self.data_ingestion_config.collection_name)            
+            if self.data_ingestion_config.incremental:
+                self.ingest_incrementally(usvisa_data)
+                if self.data_ingestion_config.streaming:
+                    return None
+                return read_dataframe(self.data_ingestion_config.persistent_feature_store_file_path,
+                                      schema_info=self.schema_info)
+            if self.data_ingestion_config.streaming:
+                self.stream_data_into_feature_store(usvisa_data)
+                return None
+
+            if self.data_ingestion_config.read_partitions > 1:
+                df: DataFrame = pd.concat(list(self.iter_collection(usvisa_data)), ignore_index=True)
+            else:
+                df: DataFrame = usvisa_data.get_collection_as_dataframe(
+                    collection_name=self.data_ingestion_config.collection_name, schema_info=self.schema_info)
             logging.info(f"Exported data from collection: {self.data_ingestion_config.collection_name} to feature store")
             logging.info(f"Rows and columns in df: {df.shape}")
-            # create feature store directory
-            feature_store_dir = os.path.dirname(self.data_ingestion_config.feature_store_file_path)
-            os.makedirs(feature_store_dir, exist_ok=True)
-
             # save data to feature store
-            df.to_csv(self.data_ingestion_config.feature_store_file_path, index=False, header=True)
+            self.artifact_writer.write(write_dataframe, df, self.data_ingestion_config.feature_store_file_path)
             logging.info(f"Data saved to feature store at: {self.data_ingestion_config.feature_store_file_path}")   
 
             return df
@@ -56,11 +81,179 @@ class DataIngestion:
         except Exception as e:
             raise USVisaException(e, sys)
 
-    def split_data_as_train_test(self, df: DataFrame) -> None:
+    def iter_collection(self, usvisa_data: USVisaData, filter_query: Optional[dict] = None, keep_id: bool = False):
+        """
+        Method Name: iter_collection
+        Description: This method iterates the collection as concurrently read partitions when read_partitions
+                     is above one, else as batch_size chunks of a single cursor.
+        Output: Iterator of DataFrame
+        On Failure: Raise Exception
+        """
+        if self.data_ingestion_config.read_partitions > 1:
+            return usvisa_data.iter_collection_partitions(
+                collection_name=self.data_ingestion_config.collection_name,
+                partitions=self.data_ingestion_config.read_partitions,
+                reader_threads=self.data_ingestion_config.reader_threads,
+                batch_size=self.data_ingestion_config.batch_size,
+                partition_key=self.data_ingestion_config.partition_key,
+                schema_info=self.schema_info, filter_query=filter_query, keep_id=keep_id)
+        return usvisa_data.iter_collection_chunks(
+            collection_name=self.data_ingestion_config.collection_name,
+            batch_size=self.data_ingestion_config.batch_size,
+            schema_info=self.schema_info, filter_query=filter_query, keep_id=keep_id)
+
+    def get_feature_store_file_path(self) -> str:
+        if self.data_ingestion_config.incremental:
+            return self.data_ingestion_config.persistent_feature_store_file_path
+        return self.data_ingestion_config.feature_store_file_path
+
+    @staticmethod
+    def encode_watermark(value) -> dict:
+        if isinstance(value, ObjectId):
+            return {"type": "ObjectId", "value": str(value)}
+        if hasattr(value, "item"):
+            value = value.item()
+        return {"type": type(value).__name__, "value": value}
+
+    @staticmethod
+    def decode_watermark(watermark: dict):
+        if watermark["type"] == "ObjectId":
+            return ObjectId(watermark["value"])
+        return watermark["value"]
+
+    def read_watermark(self) -> Optional[dict]:
+        if not os.path.exists(self.data_ingestion_config.watermark_file_path):
+            return None
+        return read_yaml_file(self.data_ingestion_config.watermark_file_path)
+
+    def write_watermark(self, watermark: dict) -> None:
+        # replaced in one step so a crash never leaves a half written watermark
+        tmp_file_path = f"{self.data_ingestion_config.watermark_file_path}.tmp"
+        write_yaml_file(tmp_file_path, watermark)
+        os.replace(tmp_file_path, self.data_ingestion_config.watermark_file_path)
+
+    def ingest_incrementally(self, usvisa_data: USVisaData) -> int:
+        """
+        Method Name: ingest_incrementally
+        Description: This method appends the documents whose watermark_key is above the persisted watermark
+                     to the persistent feature store and moves the watermark to the largest key appended.
+                     The watermark also records the size of the feature store, rows appended by a run that
+                     failed before writing its watermark are cut off and fetched again by the next run.
+        Output: Number of rows appended
+        On Failure: Raise Exception
+        """
+        try:
+            feature_store_file_path = self.data_ingestion_config.persistent_feature_store_file_path
+            watermark_key = self.data_ingestion_config.watermark_key
+            os.makedirs(os.path.dirname(feature_store_file_path), exist_ok=True)
+
+            watermark = self.read_watermark()
+            filter_query, max_value = None, None
+            if watermark is not None and os.path.exists(feature_store_file_path):
+                with open(feature_store_file_path, "r+b") as feature_store_file:
+                    feature_store_file.truncate(watermark["feature_store_size"])
+                max_value = self.decode_watermark(watermark["watermark"])
+                filter_query = {watermark_key: {"$gt": max_value}}
+                logging.info(f"Ingesting documents with {watermark_key} above {max_value}")
+            else:
+                logging.info("No watermark found, ingesting the whole collection into the persistent feature store")
+                open(feature_store_file_path, "w").close()
+
+            columns = None
+            if os.path.getsize(feature_store_file_path) > 0:
+                columns = list(pd.read_csv(feature_store_file_path, nrows=0).columns)
+
+            rows = 0
+            for chunk in self.iter_collection(usvisa_data, filter_query=filter_query, keep_id=True):
+                chunk_max = chunk[watermark_key].max()
+                max_value = chunk_max if max_value is None else max(max_value, chunk_max)
+                chunk = chunk.drop(columns=["_id"], errors="ignore")
+                if columns is None:
+                    columns = list(chunk.columns)
+                    chunk.to_csv(feature_store_file_path, index=False, header=True, mode="a")
+                else:
+                    chunk.reindex(columns=columns).to_csv(feature_store_file_path, index=False, header=False, mode="a")
+                rows += len(chunk)
+
+            if max_value is not None:
+                self.write_watermark({
+                    "watermark_key": watermark_key,
+                    "watermark": self.encode_watermark(max_value),
+                    "feature_store_size": os.path.getsize(feature_store_file_path),
+                    "rows_appended": rows,
+                    "updated_at": datetime.now().isoformat(timespec="seconds"),
+                })
+            logging.info(f"Appended {rows} new rows to persistent feature store at: {feature_store_file_path}")
+            return rows
+
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def stream_data_into_feature_store(self, usvisa_data: USVisaData) -> int:
+        """
+        Method Name: stream_data_into_feature_store
+        Description: This method appends the collection to the feature store chunk by chunk, so peak memory
+                     is bounded by batch_size instead of the collection size.
+        Output: Number of rows exported
+        On Failure: Raise Exception
+        """
+        try:
+            feature_store_file_path = self.data_ingestion_config.feature_store_file_path
+
+            rows = 0
+            with DataFrameWriter(feature_store_file_path) as feature_store_writer:
+                for index, chunk in enumerate(self.iter_collection(usvisa_data)):
+                    feature_store_writer.write(chunk)
+                    rows += len(chunk)
+                    logging.info(f"Appended chunk {index} with {len(chunk)} rows to feature store")
+
+            logging.info(f"Streamed {rows} rows from collection: {self.data_ingestion_config.collection_name} "
+                         f"to feature store at: {feature_store_file_path}")
+            return rows
+
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def split_feature_store_as_train_test(self, feature_store_file_path: Optional[str] = None) -> None:
+        """
+        Method Name: split_feature_store_as_train_test
+        Description: This method reads the feature store batch_size rows at a time and splits every chunk into
+                     the training and testing sets with a seed derived from the chunk index, so the split is
+                     reproducible without loading the whole feature store.
+        Output: None
+        On Failure: Raise Exception
+        """
+        try:
+            logging.info("Splitting feature store into train and test sets chunk by chunk")
+            if feature_store_file_path is None:
+                feature_store_file_path = self.data_ingestion_config.feature_store_file_path
+            with DataFrameWriter(self.data_ingestion_config.training_file_path) as train_writer, \
+                    DataFrameWriter(self.data_ingestion_config.testing_file_path) as test_writer:
+                for index, chunk in enumerate(iter_dataframe_chunks(feature_store_file_path,
+                                                                    chunksize=self.data_ingestion_config.batch_size,
+                                                                    schema_info=self.schema_info)):
+                    if len(chunk) > 1:
+                        train_set, test_set = train_test_split(
+                            chunk,
+                            test_size=self.data_ingestion_config.train_test_split_ratio,
+                            random_state=42 + index
+                        )
+                    else:
+                        train_set, test_set = chunk, chunk.iloc[:0]
+                    train_writer.write(train_set)
+                    test_writer.write(test_set)
+
+            logging.info(f"Training data saved at: {self.data_ingestion_config.training_file_path}")
+            logging.info(f"Testing data saved at: {self.data_ingestion_config.testing_file_path}")
+
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def split_data_as_train_test(self, df: DataFrame) -> Tuple[DataFrame, DataFrame]:
         """
         Method Name: split_data_as_train_test
         Description: This method splits the data into training and testing sets.
-        Output: None
+        Output: The training and testing sets, indexed like the files read back
         On Failure: Raise Exception
         """
         try:
@@ -70,18 +263,16 @@ class DataIngestion:
                 test_size=self.data_ingestion_config.train_test_split_ratio,
                 random_state=42
             )
-
-            # create ingested directory
-            ingested_dir = os.path.dirname(self.data_ingestion_config.training_file_path)
-            os.makedirs(ingested_dir, exist_ok=True)
+            train_set, test_set = train_set.reset_index(drop=True), test_set.reset_index(drop=True)
 
             # save train set
-            train_set.to_csv(self.data_ingestion_config.training_file_path, index=False, header=True)
+            self.artifact_writer.write(write_dataframe, train_set, self.data_ingestion_config.training_file_path)
             logging.info(f"Training data saved at: {self.data_ingestion_config.training_file_path}")
 
             # save test set
-            test_set.to_csv(self.data_ingestion_config.testing_file_path, index=False, header=True)
+            self.artifact_writer.write(write_dataframe, test_set, self.data_ingestion_config.testing_file_path)
             logging.info(f"Testing data saved at: {self.data_ingestion_config.testing_file_path}")
+            return train_set, test_set
 
         except Exception as e:
             raise USVisaException(e, sys)
@@ -98,12 +289,19 @@ class DataIngestion:
             logging.info("Initiating data ingestion process")
             df = self.export_data_into_feature_store()
             logging.info("Exported data from MongoDBinto feature store")
-            self.split_data_as_train_test(df=df)
+            # streaming never holds the whole data in memory, the next stages read the files
+            train_df, test_df = None, None
+            if self.data_ingestion_config.streaming:
+                self.split_feature_store_as_train_test(self.get_feature_store_file_path())
+            else:
+                train_df, test_df = self.split_data_as_train_test(df=df)
             logging.info("Split data into train and test sets")
 
             data_ingestion_artifact = DataIngestionArtifact(
                 training_file_path=self.data_ingestion_config.training_file_path,
-                testing_file_path=self.data_ingestion_config.testing_file_path
+                testing_file_path=self.data_ingestion_config.testing_file_path,
+                train_df=train_df if self.in_memory_handoff else None,
+                test_df=test_df if self.in_memory_handoff else None
             )
 
             logging.info(f"Data Ingestion Artifact: {data_ingestion_artifact}")
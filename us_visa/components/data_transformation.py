@@ -1,54 +1,97 @@
 import numpy as np
 import pandas as pd 
 from imblearn.combine import SMOTETomek
+from imblearn.over_sampling import SMOTE
+from imblearn.under_sampling import TomekLinks
+from sklearn.neighbors import NearestNeighbors
 from sklearn.preprocessing import StandardScaler,OneHotEncoder,OrdinalEncoder,PowerTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
 import os
 import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
 from us_visa.entity.config_entity import DataTransformationConfig
 from us_visa.exception import USVisaException
 from us_visa.logger import logging      
-from us_visa.utils.main_utils import save_object,save_numpy_array_data,read_yaml_file,drop_columns
+from us_visa.utils.main_utils import save_object,save_numpy_array_data,read_yaml_file,drop_columns,read_dataframe,get_source_columns
+from us_visa.utils.main_utils import iter_dataframe_chunks, NumpyArrayWriter
 from us_visa.constants import SCHEMA_FILE_PATH,TARGET_COLUMN,CURRENT_YEAR
 from us_visa.entity.artifact_entity import DataIngestionArtifact,DataTransformationArtifact,DataValidationArtifact
 from us_visa.entity.estimator import TargetValueMapping
+from us_visa.utils.artifact_writer import ArtifactWriter
+from us_visa.utils.transform_cache import TransformCache
+
+IMBALANCE_STRATEGIES = ("smote_tomek", "smote", "class_weight", "none")
 
 
 class DataTransformation:
     def __init__(self,data_transformation_config: DataTransformationConfig,
                  data_ingestion_artifact: DataIngestionArtifact,
-                 data_validation_artifact: DataValidationArtifact):
+                 data_validation_artifact: DataValidationArtifact,
+                 artifact_writer: Optional[ArtifactWriter] = None,
+                 transform_cache: Optional[TransformCache] = None):
+        """
+        :param artifact_writer: Writer of the files, when set the transformed arrays and the preprocessing
+                                object are also handed to the model trainer in memory
+        :param transform_cache: Cache of the transformed features shared with the later stages
+        """
         try:
             self.data_transformation_config = data_transformation_config
             self.data_ingestion_artifact = data_ingestion_artifact  
             self.data_validation_artifact = data_validation_artifact
             self.schema_info = read_yaml_file(SCHEMA_FILE_PATH)
+            self.in_memory_handoff = artifact_writer is not None
+            self.artifact_writer = artifact_writer or ArtifactWriter()
+            self.transform_cache = transform_cache or TransformCache()
+            if self.data_transformation_config.imbalance_strategy not in IMBALANCE_STRATEGIES:
+                raise ValueError(f"Unknown imbalance strategy {self.data_transformation_config.imbalance_strategy}, "
+                                 f"expected one of {IMBALANCE_STRATEGIES}")
+            self.imbalance_report = {"strategy": self.data_transformation_config.imbalance_strategy}
+            self.train_class_counts = Counter()
 
         except Exception as e:
             raise USVisaException(e, sys)
         
     @staticmethod
-    def read_data(file_path: str) -> pd.DataFrame:
+    def read_data(file_path: str, columns: Optional[List[str]] = None,
+                  schema_info: Optional[dict] = None) -> pd.DataFrame:
         try:
-            return pd.read_csv(file_path)
+            return read_dataframe(file_path, columns=columns, schema_info=schema_info)
         except Exception as e:
             raise USVisaException(e, sys)
+
+    def get_ingested_data(self, dataframe: Optional[pd.DataFrame], file_path: str,
+                          columns: List[str]) -> pd.DataFrame:
+        """
+        Returns the columns of the DataFrame handed over by data ingestion, or reads them from file_path
+        """
+        if dataframe is not None:
+            return dataframe[columns]
+        return DataTransformation.read_data(file_path=file_path, columns=columns, schema_info=self.schema_info)
     
-    def get_data_transformer_object(self) -> Pipeline:
+    def get_data_transformer_object(self, categories: Optional[Dict[str, list]] = None) -> Pipeline:
+        """
+        :param categories: Categories of the encoded columns, the encoders learn them from the data when None
+        """
         try:
             schema_info = self.schema_info
-            
-            numeric_transformer = StandardScaler()
-            onehot_transformer = OneHotEncoder()
-            ordinal_transformer = OrdinalEncoder()
-
-            logging.info("Initialized StandardScaler, OneHotEncoder and OrdinalEncoder")
 
             oh_columns = schema_info['oh_columns']
             or_columns = schema_info['or_columns'] 
             num_columns = schema_info['num_columns']
             transform_columns = schema_info['transform_columns']
+            
+            numeric_transformer = StandardScaler()
+            if categories is None:
+                onehot_transformer = OneHotEncoder()
+                ordinal_transformer = OrdinalEncoder()
+            else:
+                onehot_transformer = OneHotEncoder(categories=[categories[column] for column in oh_columns])
+                ordinal_transformer = OrdinalEncoder(categories=[categories[column] for column in or_columns])
+
+            logging.info("Initialized StandardScaler, OneHotEncoder and OrdinalEncoder")
 
             logging.info("Initialized PowerTransformer for columns: {transform_columns}")
 
@@ -69,15 +112,209 @@ class DataTransformation:
         except Exception as e:
             raise USVisaException(e, sys)   
     
+    def get_features_and_target(self, dataframe: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
+        """
+        Returns the input features of the preprocessor, with company_age in place of the dropped columns,
+        and the target mapped to integer labels
+        """
+        input_feature_df = dataframe.drop(columns=[TARGET_COLUMN], axis=1)
+        input_feature_df['company_age'] = CURRENT_YEAR - input_feature_df['yr_of_estab']
+        drop_cols = [column for column in self.schema_info['drop_columns'] if column in input_feature_df.columns]
+        input_feature_df = drop_columns(dataframe=input_feature_df, columns=drop_cols)
+        target_feature = dataframe[TARGET_COLUMN].map(TargetValueMapping().to_dict()).astype(int)
+        return input_feature_df, target_feature
+
+    def get_resampler(self):
+        """
+        Returns the imblearn resampler of the imbalance strategy, None for the strategies that do not resample.
+        The nearest neighbour searches run on imbalance_n_jobs workers, which does not change the rows made.
+        """
+        strategy = self.data_transformation_config.imbalance_strategy
+        n_jobs = self.data_transformation_config.imbalance_n_jobs
+        if strategy in ("class_weight", "none"):
+            return None
+        # k_neighbors=5 of SMOTE, the neighbours of a row include the row itself
+        smote = SMOTE(sampling_strategy='minority', k_neighbors=NearestNeighbors(n_neighbors=6, n_jobs=n_jobs),
+                      random_state=42)
+        if strategy == "smote":
+            return smote
+        return SMOTETomek(sampling_strategy='minority', smote=smote,
+                          tomek=TomekLinks(sampling_strategy='all', n_jobs=n_jobs), random_state=42)
+
+    def resample(self, resampler, input_feature_arr: np.ndarray, target_feature: pd.Series, split: str,
+                 chunk: bool = False) -> Tuple[np.ndarray, pd.Series]:
+        """
+        Method Name: resample
+        Description: Resamples the features and target of split ("train" or "test") with resampler, only
+                     smote_tomek resamples the test set. The seconds spent and the rows before and after are
+                     added to the imbalance report, the classes of train are counted for the class weights.
+                     A chunk that cannot be resampled, e.g. with too few minority rows, is kept as it is.
+        Output: Resampled features and target
+        On Failure: Raise Exception
+        """
+        try:
+            start = time.perf_counter()
+            rows_before = len(target_feature)
+            if split == "train":
+                self.train_class_counts.update(np.asarray(target_feature).tolist())
+            if resampler is not None and (split == "train" or self.data_transformation_config.imbalance_strategy == "smote_tomek"):
+                try:
+                    input_feature_arr, target_feature = resampler.fit_resample(input_feature_arr, target_feature)
+                except ValueError as e:
+                    if not chunk:
+                        raise
+                    logging.info(f"Chunk of {rows_before} rows not resampled: {e}")
+            report = self.imbalance_report.setdefault(split, {"seconds": 0.0, "rows_before": 0, "rows_after": 0})
+            report["seconds"] += time.perf_counter() - start
+            report["rows_before"] += rows_before
+            report["rows_after"] += len(target_feature)
+            return input_feature_arr, target_feature
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def get_class_weight(self) -> Optional[dict]:
+        """
+        Returns the balanced weights of the train classes, n_samples / (n_classes * class count), for the
+        class_weight strategy and None for the others
+        """
+        if self.data_transformation_config.imbalance_strategy != "class_weight" or not self.train_class_counts:
+            return None
+        n_samples = sum(self.train_class_counts.values())
+        return {int(label): float(n_samples / (len(self.train_class_counts) * count))
+                for label, count in sorted(self.train_class_counts.items())}
+
+    def get_imbalance_report(self) -> dict:
+        for split in ("train", "test"):
+            if split in self.imbalance_report:
+                self.imbalance_report[split]["seconds"] = round(self.imbalance_report[split]["seconds"], 3)
+        logging.info(f"Imbalance handling: {self.imbalance_report}")
+        return self.imbalance_report
+
+    def iter_ingested_chunks(self, file_path: str):
+        return iter_dataframe_chunks(file_path, chunksize=self.data_transformation_config.chunk_size,
+                                     columns=get_source_columns(self.schema_info), schema_info=self.schema_info)
+
+    def fit_preprocessor_out_of_core(self) -> ColumnTransformer:
+        """
+        Method Name: fit_preprocessor_out_of_core
+        Description: Fits the preprocessor with one pass over the training file: the StandardScaler is fitted
+                     chunk by chunk with partial_fit, the categories of the encoders are collected from every
+                     chunk and a uniform sample of power_transformer_sample_size rows is kept for the
+                     PowerTransformer, which cannot be fitted incrementally. The preprocessor is fitted on the
+                     sample with the collected categories and then gets the scaler statistics of all rows.
+        Output: Fitted ColumnTransformer
+        On Failure: Raise Exception
+        """
+        try:
+            num_columns = self.schema_info['num_columns']
+            encoded_columns = self.schema_info['oh_columns'] + self.schema_info['or_columns']
+            sample_size = self.data_transformation_config.power_transformer_sample_size
+
+            scaler = StandardScaler()
+            categories = {column: set() for column in encoded_columns}
+            sample, sample_keys = None, None
+            random_state = np.random.RandomState(42)
+            for chunk in self.iter_ingested_chunks(self.data_ingestion_artifact.training_file_path):
+                input_feature_df, _ = self.get_features_and_target(chunk)
+                scaler.partial_fit(input_feature_df[num_columns])
+                for column in encoded_columns:
+                    categories[column].update(input_feature_df[column].dropna().unique())
+                # the rows with the smallest random keys seen so far are a uniform sample of them
+                keys = random_state.random_sample(len(input_feature_df))
+                if sample is not None:
+                    input_feature_df = pd.concat([sample, input_feature_df], ignore_index=True)
+                    keys = np.concatenate([sample_keys, keys])
+                keep = np.sort(np.argsort(keys, kind="stable")[:sample_size])
+                sample, sample_keys = input_feature_df.iloc[keep].reset_index(drop=True), keys[keep]
+
+            if sample is None:
+                raise ValueError(f"No rows in {self.data_ingestion_artifact.training_file_path}")
+            categories = {column: sorted(values) for column, values in categories.items()}
+            preprocessor = self.get_data_transformer_object(categories=categories)
+            preprocessor.fit(sample)
+            fitted_scaler = preprocessor.named_transformers_['num_pipeline']
+            for attribute in ('mean_', 'var_', 'scale_', 'n_samples_seen_'):
+                setattr(fitted_scaler, attribute, getattr(scaler, attribute))
+            logging.info(f"Fitted the preprocessor on {scaler.n_samples_seen_} rows out of core, "
+                         f"PowerTransformer on a sample of {len(sample)} rows")
+            return preprocessor
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def transform_out_of_core(self, preprocessor: ColumnTransformer, file_path: str, output_file_path: str,
+                              split: str) -> int:
+        """
+        Method Name: transform_out_of_core
+        Description: Transforms file_path chunk by chunk and appends the chunks, resampled with the imbalance
+                     strategy one chunk at a time, to the .npy at output_file_path.
+        Output: Number of rows written
+        On Failure: Raise Exception
+        """
+        try:
+            resampler = self.get_resampler()
+            with NumpyArrayWriter(output_file_path) as array_writer:
+                for chunk in self.iter_ingested_chunks(file_path):
+                    input_feature_df, target_feature = self.get_features_and_target(chunk)
+                    input_feature_arr = preprocessor.transform(input_feature_df)
+                    input_feature_arr, target_feature = self.resample(resampler, input_feature_arr, target_feature,
+                                                                      split=split, chunk=True)
+                    array_writer.write(np.c_[input_feature_arr, np.array(target_feature)])
+            logging.info(f"Wrote {array_writer.rows} transformed rows to {output_file_path}")
+            return array_writer.rows
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def initiate_out_of_core_transformation(self) -> DataTransformationArtifact:
+        """
+        Method Name: initiate_out_of_core_transformation
+        Description: Fits and applies the preprocessor streaming the ingested files in chunk_size chunks, so
+                     memory is bounded by the chunk size and the PowerTransformer sample. The transformed
+                     arrays only exist as files, the model trainer maps them.
+        Output: DataTransformationArtifact
+        On Failure: Raise Exception
+        """
+        try:
+            # the ingested files may still be in the writer
+            self.artifact_writer.flush()
+            preprocessor_obj = self.fit_preprocessor_out_of_core()
+
+            self.transform_out_of_core(preprocessor_obj, self.data_ingestion_artifact.training_file_path,
+                                       self.data_transformation_config.transformed_train_file_path, split="train")
+            self.transform_out_of_core(preprocessor_obj, self.data_ingestion_artifact.testing_file_path,
+                                       self.data_transformation_config.transformed_test_file_path, split="test")
+            self.artifact_writer.write(
+                save_object,
+                file_path=self.data_transformation_config.transformed_object_file_path,
+                obj=preprocessor_obj
+            )
+
+            data_transformation_artifact = DataTransformationArtifact(
+                transformed_object_file_path=self.data_transformation_config.transformed_object_file_path,
+                transformed_train_file_path=self.data_transformation_config.transformed_train_file_path,
+                transformed_test_file_path=self.data_transformation_config.transformed_test_file_path,
+                transformed_object=preprocessor_obj if self.in_memory_handoff else None,
+                class_weight=self.get_class_weight(),
+                imbalance_report=self.get_imbalance_report()
+            )
+            logging.info("Out-of-core data transformation completed successfully")
+            return data_transformation_artifact
+        except Exception as e:
+            raise USVisaException(e, sys)
+
     def initiate_data_transformation(self) -> DataTransformationArtifact:   
         try:
+            if self.data_validation_artifact.validation_status and self.data_transformation_config.out_of_core:
+                return self.initiate_out_of_core_transformation()
             if self.data_validation_artifact.validation_status:
                 logging.info("Starting data transformation")
                 preprocessor_obj = self.get_data_transformer_object()
                 logging.info("Got the data transformer object")
 
-                train_df = DataTransformation.read_data(file_path=self.data_ingestion_artifact.training_file_path)
-                test_df = DataTransformation.read_data(file_path=self.data_ingestion_artifact.testing_file_path)
+                source_columns = get_source_columns(self.schema_info)
+                train_df = self.get_ingested_data(self.data_ingestion_artifact.train_df,
+                                                  self.data_ingestion_artifact.training_file_path, source_columns)
+                test_df = self.get_ingested_data(self.data_ingestion_artifact.test_df,
+                                                 self.data_ingestion_artifact.testing_file_path, source_columns)
 
                 input_feature_train_df = train_df.drop(columns=[TARGET_COLUMN],axis=1)
                 target_feature_train_df = train_df[TARGET_COLUMN]
@@ -85,10 +322,11 @@ class DataTransformation:
                 logging.info("Got the input and target features from training data")
                 input_feature_train_df['company_age'] = CURRENT_YEAR - input_feature_train_df['yr_of_estab']
                 logging.info("Added company_age feature to training data")
-                drop_cols = self.schema_info['drop_columns']
+                drop_cols = [column for column in self.schema_info['drop_columns'] if column in train_df.columns]
                 logging.info(f"Dropping columns: {drop_cols} from training data")
                 input_feature_train_df = drop_columns(dataframe=input_feature_train_df,columns=drop_cols )
-                target_feature_train_df = target_feature_train_df.replace(TargetValueMapping().to_dict())
+                # the target is a category column, map it to plain integer labels
+                target_feature_train_df = target_feature_train_df.map(TargetValueMapping().to_dict()).astype(int)
                 logging.info("Replaced target feature values with numerical mapping for training data")
 
                 input_feature_test_df = test_df.drop(columns=[TARGET_COLUMN],axis=1)
@@ -99,31 +337,29 @@ class DataTransformation:
                 logging.info("Added company_age feature to testing data")                   
                 logging.info(f"Dropping columns: {drop_cols} from testing data")
                 input_feature_test_df = drop_columns(dataframe=input_feature_test_df,columns=drop_cols )
-                target_feature_test_df = target_feature_test_df.replace(TargetValueMapping().to_dict()) 
+                target_feature_test_df = target_feature_test_df.map(TargetValueMapping().to_dict()).astype(int)
                 logging.info("Replaced target feature values with numerical mapping for testing data")  
 
                 logging.info("Applying preprocessing object on training and testing dataframe")
                 input_feature_train_arr = preprocessor_obj.fit_transform(input_feature_train_df)
+                self.transform_cache.put(preprocessor_obj, input_feature_train_df, input_feature_train_arr)
                 logging.info("Applied preprocessing object on training dataframe")
-                input_feature_test_arr = preprocessor_obj.transform(input_feature_test_df)  
+                # model evaluation finds it there when the production preprocessor is identical
+                input_feature_test_arr = self.transform_cache.transform(preprocessor_obj, input_feature_test_df)
                 logging.info("Applied preprocessing object on testing dataframe")
 
-                logging.info("Applying SMOTETomek on training and testing data")
-                smt = SMOTETomek(sampling_strategy='minority')
-
+                logging.info(f"Handling class imbalance with {self.data_transformation_config.imbalance_strategy}")
+                resampler = self.get_resampler()
 
-                logging.info("Applying SMOTETomek on training")
-               
-                input_feature_train_res, target_feature_train_res = smt.fit_resample(
-                    input_feature_train_arr, target_feature_train_df
+                input_feature_train_res, target_feature_train_res = self.resample(
+                    resampler, input_feature_train_arr, target_feature_train_df, split="train"
                 )
-                logging.info("Applied SMOTETomek on training data")
+                logging.info("Handled class imbalance of training data")
 
-                logging.info("Applying SMOTETomek on testing")
-                input_feature_test_res, target_feature_test_res = smt.fit_resample(
-                    input_feature_test_arr, target_feature_test_df
+                input_feature_test_res, target_feature_test_res = self.resample(
+                    resampler, input_feature_test_arr, target_feature_test_df, split="test"
                 )
-                logging.info("Applied SMOTETomek on testing data")
+                logging.info("Handled class imbalance of testing data")
                 logging.info("Obtained resampled input and target features for training and testing data")  
 
                 logging.info("Created training and testing arrays by concatenating input and target features")
@@ -133,17 +369,20 @@ class DataTransformation:
 
                 logging.info("Saving transformed training and testing arrays and preprocessing object")
 
-                save_numpy_array_data(
+                self.artifact_writer.write(
+                    save_numpy_array_data,
                     file_path=self.data_transformation_config.transformed_train_file_path,
                     array=train_arr
                 )
 
-                save_numpy_array_data(
+                self.artifact_writer.write(
+                    save_numpy_array_data,
                     file_path=self.data_transformation_config.transformed_test_file_path,
                     array=test_arr
                 )
 
-                save_object(
+                self.artifact_writer.write(
+                    save_object,
                     file_path=self.data_transformation_config.transformed_object_file_path,
                     obj=preprocessor_obj
                 )
@@ -151,7 +390,12 @@ class DataTransformation:
                 data_transformation_artifact = DataTransformationArtifact(
                     transformed_object_file_path=self.data_transformation_config.transformed_object_file_path,
                     transformed_train_file_path=self.data_transformation_config.transformed_train_file_path,
-                    transformed_test_file_path=self.data_transformation_config.transformed_test_file_path
+                    transformed_test_file_path=self.data_transformation_config.transformed_test_file_path,
+                    transformed_train_arr=train_arr if self.in_memory_handoff else None,
+                    transformed_test_arr=test_arr if self.in_memory_handoff else None,
+                    transformed_object=preprocessor_obj if self.in_memory_handoff else None,
+                    class_weight=self.get_class_weight(),
+                    imbalance_report=self.get_imbalance_report()
                 )
 
                 logging.info("Data transformation completed successfully")
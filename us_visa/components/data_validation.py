@@ -1,6 +1,8 @@
 import json
 import sys
+from typing import Optional, Tuple
 
+import numpy as np
 import pandas as pd
 from evidently.report import Report
 from evidently.metric_preset import DataDriftPreset
@@ -11,7 +13,8 @@ from us_visa.constants import DATA_VALIDATION_DRIFT_REPORT_FILE_NAME
 from us_visa.entity.artifact_entity import DataIngestionArtifact,DataValidationArtifact
 from us_visa.entity.config_entity import DataValidationConfig
 from us_visa.exception import USVisaException   
-from us_visa.utils.main_utils import read_yaml_file, write_yaml_file
+from us_visa.utils.main_utils import (read_yaml_file, write_yaml_file, read_dataframe, get_unknown_categories,
+                                     iter_dataframe_chunks, apply_schema_dtypes)
 from us_visa.constants import SCHEMA_FILE_PATH
 from us_visa.logger import logging
 
@@ -55,13 +58,60 @@ class DataValidation:
         except Exception as e:
             raise USVisaException(e, sys)
     
+    def validate_categories(self, dataframe: DataFrame) -> dict:
+        """
+        Method Name: validate_categories
+        Description: This method finds the values of the Category columns missing from the categories of the schema.
+        Output: Column name to its unknown values, empty when all values are known"""
+        try:
+            unknown_categories = get_unknown_categories(dataframe, self.schema_info)
+            if unknown_categories:
+                logging.info(f"Values outside the schema categories: {unknown_categories}")
+            return unknown_categories
+        except Exception as e:
+            raise USVisaException(e, sys)
+
     @staticmethod
-    def read_data(file_path: str) -> DataFrame:
+    def read_data(file_path: str, schema_info: Optional[dict] = None) -> DataFrame:
         try:
-            return pd.read_csv(file_path)
+            return read_dataframe(file_path, schema_info=schema_info)
         except Exception as e:
             raise USVisaException(e, sys)
     
+    def sample_out_of_core(self, file_path: str) -> Tuple[DataFrame, dict]:
+        """
+        Method Name: sample_out_of_core
+        Description: This method streams file_path in chunk_size chunks, collecting the values outside the schema
+                     categories of every chunk and a uniform sample of drift_sample_size rows, the rows with the
+                     smallest random keys seen so far. The sample has all the columns of the file for the column
+                     checks and is what the drift report compares, so memory is bounded by the sample size.
+        Output: Sample DataFrame and column name to its unknown values
+        On Failure: Raise Exception
+        """
+        try:
+            sample_size = self.data_validation_config.drift_sample_size
+            sample, sample_keys = None, None
+            unknown_categories = {}
+            random_state = np.random.RandomState(42)
+            for chunk in iter_dataframe_chunks(file_path, chunksize=self.data_validation_config.chunk_size,
+                                               schema_info=self.schema_info):
+                for column, values in get_unknown_categories(chunk, self.schema_info).items():
+                    unknown_categories[column] = sorted(set(unknown_categories.get(column, [])) | set(values))
+                keys = random_state.random_sample(len(chunk))
+                if sample is not None:
+                    chunk = pd.concat([sample, chunk], ignore_index=True)
+                    keys = np.concatenate([sample_keys, keys])
+                keep = np.sort(np.argsort(keys, kind="stable")[:sample_size])
+                sample, sample_keys = chunk.iloc[keep].reset_index(drop=True), keys[keep]
+
+            if sample is None:
+                raise ValueError(f"No rows in {file_path}")
+            logging.info(f"Sampled {len(sample)} rows of {file_path} for data validation")
+            # chunks with unknown values have different categories, the concatenated columns are cast back
+            return apply_schema_dtypes(sample, self.schema_info), unknown_categories
+        except Exception as e:
+            raise USVisaException(e, sys)
+
     def detect_data_drift(self, base_df: DataFrame, current_df: DataFrame) -> bool:
         try:
             data_drift_report = Report(metrics=[DataDriftPreset()])
@@ -85,9 +135,23 @@ class DataValidation:
     def initiate_data_validation(self) -> DataValidationArtifact:
         try:
             validation_error_msg = ""
-            logging.info("Reading training and testing data for data validation")
-            train_df = self.read_data(self.data_ingestion_artifact.training_file_path)
-            test_df = self.read_data(self.data_ingestion_artifact.testing_file_path)
+            if self.data_validation_config.out_of_core:
+                # the checks and the drift report run on samples, the categories are checked on every row
+                logging.info("Sampling training and testing data for data validation")
+                train_df, train_unknown_categories = self.sample_out_of_core(
+                    self.data_ingestion_artifact.training_file_path)
+                test_df, test_unknown_categories = self.sample_out_of_core(
+                    self.data_ingestion_artifact.testing_file_path)
+            else:
+                logging.info("Reading training and testing data for data validation")
+                train_df = self.data_ingestion_artifact.train_df
+                if train_df is None:
+                    train_df = self.read_data(self.data_ingestion_artifact.training_file_path, schema_info=self.schema_info)
+                test_df = self.data_ingestion_artifact.test_df
+                if test_df is None:
+                    test_df = self.read_data(self.data_ingestion_artifact.testing_file_path, schema_info=self.schema_info)
+                train_unknown_categories = self.validate_categories(train_df)
+                test_unknown_categories = self.validate_categories(test_df)
             
             logging.info("Validating number of columns in training data")
             train_column_status = self.validate_number_of_columns(train_df)
@@ -116,6 +180,12 @@ class DataValidation:
             
             if not test_columns_exist:
                 validation_error_msg += f"Testing data is missing some columns"
+
+            logging.info("Validating the values of the category columns")
+            for name, unknown_categories in (("Training", train_unknown_categories),
+                                             ("Testing", test_unknown_categories)):
+                for column, values in unknown_categories.items():
+                    validation_error_msg += f"{name} data column {column} has values not in schema.yaml categories: {values}. "
             
             validation_status = len(validation_error_msg)== 0
 
@@ -3,15 +3,18 @@ from us_visa.entity.config_entity import ModelEvaluationConfig
 from us_visa.entity.artifact_entity import ModelTrainerArtifact, DataIngestionArtifact, ModelEvaluationArtifact
 from sklearn.metrics import f1_score
 from us_visa.exception import USVisaException
-from us_visa.constants import TARGET_COLUMN, CURRENT_YEAR
+from us_visa.constants import TARGET_COLUMN, CURRENT_YEAR, SCHEMA_FILE_PATH
 from us_visa.logger import logging
 import sys
+import numpy as np
 import pandas as pd
-from typing import Optional
+from typing import Optional, Tuple
 from us_visa.entity.s3_estimator import USvisaEstimator
 from dataclasses import dataclass
 from us_visa.entity.estimator import USvisaModel
 from us_visa.entity.estimator import TargetValueMapping
+from us_visa.utils.main_utils import read_dataframe, read_yaml_file, get_source_columns, iter_dataframe_chunks
+from us_visa.utils.transform_cache import TransformCache
 
 @dataclass
 class EvaluateModelResponse:
@@ -24,11 +27,15 @@ class EvaluateModelResponse:
 class ModelEvaluation:
 
     def __init__(self, model_eval_config: ModelEvaluationConfig, data_ingestion_artifact: DataIngestionArtifact,
-                 model_trainer_artifact: ModelTrainerArtifact):
+                 model_trainer_artifact: ModelTrainerArtifact, transform_cache: Optional[TransformCache] = None):
+        """
+        :param transform_cache: Cache of the transformed test features, shared with data transformation
+        """
         try:
             self.model_eval_config = model_eval_config
             self.data_ingestion_artifact = data_ingestion_artifact
             self.model_trainer_artifact = model_trainer_artifact
+            self.transform_cache = transform_cache or TransformCache()
         except Exception as e:
             raise USVisaException(e, sys) from e
 
@@ -52,6 +59,40 @@ class ModelEvaluation:
         except Exception as e:
             raise  USVisaException(e,sys)
 
+    @staticmethod
+    def get_features_and_target(test_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
+        test_df['company_age'] = CURRENT_YEAR-test_df['yr_of_estab']
+        x, y = test_df.drop(TARGET_COLUMN, axis=1), test_df[TARGET_COLUMN]
+        y = y.map(
+            TargetValueMapping().to_dict()
+        ).astype(int)
+        return x, y
+
+    def get_f1_score_out_of_core(self, model: USvisaEstimator, schema_info: dict) -> float:
+        """
+        Method Name :   get_f1_score_out_of_core
+        Description :   This function scores model on the test file chunk_size rows at a time, only the
+                        confusion counts of the chunks are kept, so memory is bounded by the chunk size.
+                        The transformed chunks are not cached.
+
+        Output      :   Returns the f1 score of model on the test file, 0 when nothing is positive
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            true_positives = false_positives = false_negatives = 0
+            for test_df in iter_dataframe_chunks(self.data_ingestion_artifact.testing_file_path,
+                                                 chunksize=self.model_eval_config.chunk_size,
+                                                 columns=get_source_columns(schema_info), schema_info=schema_info):
+                x, y = self.get_features_and_target(test_df)
+                y, y_hat = y.to_numpy(), np.asarray(model.predict(x))
+                true_positives += int(np.sum((y_hat == 1) & (y == 1)))
+                false_positives += int(np.sum((y_hat == 1) & (y != 1)))
+                false_negatives += int(np.sum((y_hat != 1) & (y == 1)))
+            denominator = 2 * true_positives + false_positives + false_negatives
+            return 2 * true_positives / denominator if denominator else 0.0
+        except Exception as e:
+            raise USVisaException(e, sys)
+
     def evaluate_model(self) -> EvaluateModelResponse:
         """
         Method Name :   evaluate_model
@@ -62,21 +103,23 @@ class ModelEvaluation:
         On Failure  :   Write an exception log and then raise an exception
         """
         try:
-            test_df = pd.read_csv(self.data_ingestion_artifact.testing_file_path)
-            test_df['company_age'] = CURRENT_YEAR-test_df['yr_of_estab']
-
-            x, y = test_df.drop(TARGET_COLUMN, axis=1), test_df[TARGET_COLUMN]
-            y = y.replace(
-                TargetValueMapping().to_dict()
-            )
+            schema_info = read_yaml_file(SCHEMA_FILE_PATH)
 
             # trained_model = load_object(file_path=self.model_trainer_artifact.trained_model_file_path)
             trained_model_f1_score = self.model_trainer_artifact.metric_artifact.f1_score
 
             best_model_f1_score=None
             best_model = self.get_best_model()
-            if best_model is not None:
-                y_hat_best_model = best_model.predict(x)
+            if best_model is not None and self.model_eval_config.out_of_core:
+                best_model_f1_score = self.get_f1_score_out_of_core(best_model, schema_info)
+            elif best_model is not None:
+                if self.data_ingestion_artifact.test_df is not None:
+                    test_df = self.data_ingestion_artifact.test_df[get_source_columns(schema_info)].copy()
+                else:
+                    test_df = read_dataframe(self.data_ingestion_artifact.testing_file_path,
+                                             columns=get_source_columns(schema_info), schema_info=schema_info)
+                x, y = self.get_features_and_target(test_df)
+                y_hat_best_model = best_model.predict(x, transform_cache=self.transform_cache)
                 best_model_f1_score = f1_score(y, y_hat_best_model)
             
             tmp_best_model_score = 0 if best_model_f1_score is None else best_model_f1_score
@@ -1,10 +1,15 @@
+import pickle
 import sys
-from typing import Tuple
+import time
+from typing import Optional, Tuple
 
 import numpy as np
 import pandas as pd
 from pandas import DataFrame
 from sklearn.pipeline import Pipeline
+from sklearn.base import clone
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.neighbors import KNeighborsClassifier
 from sklearn.metrics import accuracy_score,f1_score,recall_score,precision_score
 from neuro_mf import ModelFactory
 
@@ -13,7 +18,10 @@ from us_visa.logger import logging
 from us_visa.utils.main_utils import load_numpy_array_data,load_object,read_yaml_file,save_object
 from us_visa.entity.config_entity import ModelTrainerConfig
 from us_visa.entity.artifact_entity import DataTransformationArtifact,DataValidationArtifact,ModelTrainerArtifact,ClassificationMetricArtifact
-from us_visa.entity.estimator import USvisaModel
+from us_visa.entity.estimator import USvisaModel, TargetValueMapping
+from us_visa.constants import MODEL_TRAINER_INCREMENTAL_MODEL_KEY
+from us_visa.entity.compiled_forest import CompiledForest
+from us_visa.utils.model_factory import ParallelModelFactory
 
 
 class ModelTrainer:
@@ -31,14 +39,15 @@ class ModelTrainer:
     def get_model_and_report(self, train :np.array, test: np.array) -> Tuple[object,object]:
         """
         Method Name: get_model_and_report
-        Description: uses neuro_mf to get the best model and report
-        Output: Returns metric artifact object and best model object
+        Description: searches the model.yaml candidates in a process pool to get the best model and report
+        Output: Returns best model object, metric artifact object and the search report of every candidate
         Onfailure: Write an excpetion log and raise an exception 
         """
         try:
 
             logging.info("Using neuro_mf to get the best model and report")
-            model_factory = ModelFactory(model_config_path = self.model_trainer_config.model_config_file_path)
+            model_factory = ParallelModelFactory(model_config_path = self.model_trainer_config.model_config_file_path,
+                                                 class_weight=self.data_transformation_artifact.class_weight)
             x_train,y_train,x_test,y_test = train[:, :-1],train[:, -1],test[:, :-1],test[:, -1]
             
             best_model_detail = model_factory.get_best_model(X= x_train, y= y_train,
@@ -54,7 +63,114 @@ class ModelTrainer:
 
             metric_artifact = ClassificationMetricArtifact(f1_score=f1, precision_score=precision,
                                                            recall_score= recall)
-            return best_model_detail,metric_artifact
+            return best_model_detail,metric_artifact,model_factory.search_report
+        except Exception as e:
+            raise USVisaException(e,sys) from e
+
+    def train_incrementally(self, train: np.ndarray, test: np.ndarray) -> Tuple[object, float, ClassificationMetricArtifact]:
+        """
+        Method Name: train_incrementally
+        Description: trains the incremental_model of model.yaml with partial_fit on chunk_size rows of train at
+                     a time, shuffled within the chunk, for the configured number of epochs, and scores it on test
+                     chunk by chunk, so train and test can be memory mapped arrays larger than memory
+        Output: Returns the model, its accuracy on test and its metric artifact
+        Onfailure: Write an excpetion log and raise an exception
+        """
+        try:
+            model_config = read_yaml_file(self.model_trainer_config.model_config_file_path)[MODEL_TRAINER_INCREMENTAL_MODEL_KEY]
+            model_class = ModelFactory.class_for_name(module_name=model_config["module"], class_name=model_config["class"])
+            model_obj = model_class(**dict(model_config.get("params") or {}))
+            class_weight = self.data_transformation_artifact.class_weight
+            if class_weight is not None and "class_weight" in model_obj.get_params():
+                model_obj.set_params(class_weight=class_weight)
+            logging.info(f"Training {model_config['class']} incrementally on {len(train)} rows")
+
+            chunk_size = self.model_trainer_config.chunk_size
+            classes = np.array(sorted(TargetValueMapping().to_dict().values()))
+            random_state = np.random.RandomState(42)
+            for epoch in range(int(model_config.get("epochs", 1))):
+                for start in range(0, len(train), chunk_size):
+                    chunk = np.asarray(train[start:start + chunk_size])
+                    chunk = chunk[random_state.permutation(len(chunk))]
+                    model_obj.partial_fit(chunk[:, :-1], chunk[:, -1], classes=classes)
+                logging.info(f"Finished epoch {epoch + 1}")
+
+            y_test = np.asarray(test[:, -1])
+            y_pred = np.concatenate([model_obj.predict(np.asarray(test[start:start + chunk_size, :-1]))
+                                     for start in range(0, len(test), chunk_size)])
+            accuracy = accuracy_score(y_test, y_pred)
+            metric_artifact = ClassificationMetricArtifact(f1_score=f1_score(y_test, y_pred),
+                                                           precision_score=precision_score(y_test, y_pred),
+                                                           recall_score=recall_score(y_test, y_pred))
+            return model_obj, accuracy, metric_artifact
+        except Exception as e:
+            raise USVisaException(e,sys) from e
+
+    def reduce_knn_model(self, model: object, train: np.ndarray, test: np.ndarray) -> Tuple[object, Optional[dict]]:
+        """
+        Method Name: reduce_knn_model
+        Description: refits a KNeighborsClassifier on knn_prototypes prototypes instead of the whole training
+                     matrix: the MiniBatchKMeans centroids of every class, in proportion to its rows. Prediction
+                     cost and model size then depend on the number of prototypes, not on the training data. The
+                     reduced model replaces the exact one only when its test accuracy is at most
+                     knn_max_accuracy_drop lower.
+        Output: Returns the model to serve and the reduction report, None when the model is not a KNN to reduce
+        Onfailure: Write an excpetion log and raise an exception
+        """
+        try:
+            n_prototypes = self.model_trainer_config.knn_prototypes
+            if not isinstance(model, KNeighborsClassifier) or n_prototypes <= 0 or len(train) <= n_prototypes:
+                return model, None
+
+            x_train, y_train = np.asarray(train[:, :-1]), np.asarray(train[:, -1])
+            prototypes, prototype_labels = [], []
+            for label, count in zip(*np.unique(y_train, return_counts=True)):
+                n_clusters = int(min(count, max(1, round(n_prototypes * count / len(y_train)))))
+                kmeans = MiniBatchKMeans(n_clusters=n_clusters, n_init=3, random_state=42)
+                kmeans.fit(x_train[y_train == label])
+                prototypes.append(kmeans.cluster_centers_)
+                prototype_labels.append(np.full(n_clusters, label))
+            prototypes, prototype_labels = np.vstack(prototypes), np.concatenate(prototype_labels)
+            reduced_model = clone(model).set_params(n_neighbors=min(model.n_neighbors, len(prototypes)))
+            reduced_model.fit(prototypes, prototype_labels)
+
+            x_test, y_test = test[:, :-1], test[:, -1]
+            report = {"prototypes": len(prototypes), "training_rows": len(x_train)}
+            for name, candidate in (("exact", model), ("reduced", reduced_model)):
+                start = time.perf_counter()
+                y_pred = candidate.predict(x_test)
+                report[f"{name}_accuracy"] = float(accuracy_score(y_test, y_pred))
+                report[f"{name}_predict_seconds"] = round(time.perf_counter() - start, 4)
+                report[f"{name}_model_bytes"] = len(pickle.dumps(candidate))
+            report["accuracy_delta"] = report["reduced_accuracy"] - report["exact_accuracy"]
+            report["applied"] = -report["accuracy_delta"] <= self.model_trainer_config.knn_max_accuracy_drop
+            logging.info(f"KNN prototype reduction: {report}")
+            return (reduced_model if report["applied"] else model), report
+        except Exception as e:
+            raise USVisaException(e,sys) from e
+
+    def export_compiled_model(self, model: object, test: np.array) -> Optional[CompiledForest]:
+        """
+        Method Name: export_compiled_model
+        Description: flattens a RandomForestClassifier into numpy node arrays for serving, the compiled model
+                     is pickled inside model.pkl and other models keep serving through sklearn
+        Output: Returns the compiled model or None when the model cannot be compiled
+        Onfailure: Write an excpetion log and raise an exception
+        """
+        try:
+            try:
+                compiled_model = CompiledForest.from_forest(model)
+            except NotImplementedError as e:
+                logging.info(f"Serving {type(model).__name__} through sklearn: {e}")
+                return None
+
+            agreement = compiled_model.agreement(model, test[:, :-1])
+            if agreement < 1.0:
+                logging.info(f"Compiled model agrees with sklearn on {agreement:.4%} of test rows, not exported")
+                return None
+
+            logging.info(f"Serving {type(model).__name__} through the compiled model")
+            return compiled_model
         except Exception as e:
             raise USVisaException(e,sys) from e
     
@@ -64,18 +180,45 @@ class ModelTrainer:
         On Failure: Raises exception
         """
         try:
-            train_arr = load_numpy_array_data(self.data_transformation_artifact.transformed_train_file_path)
-            test_arr = load_numpy_array_data(self.data_transformation_artifact.transformed_test_file_path)
-
-            best_model_detail, metric_Artifact = self.get_model_and_report(train=train_arr,test=test_arr)
-
-            preprocessing_obj = load_object(self.data_transformation_artifact.transformed_object_file_path)
-
-            if best_model_detail.best_score < self.model_trainer_config.expected_score:
+            # out of core the arrays are mapped and paged in chunk by chunk while training
+            mmap_mode = "r" if self.model_trainer_config.out_of_core else None
+            # the arrays handed over in memory by data transformation spare reloading the files
+            train_arr = self.data_transformation_artifact.transformed_train_arr
+            if train_arr is None:
+                train_arr = load_numpy_array_data(self.data_transformation_artifact.transformed_train_file_path,
+                                                  mmap_mode=mmap_mode)
+            test_arr = self.data_transformation_artifact.transformed_test_arr
+            if test_arr is None:
+                test_arr = load_numpy_array_data(self.data_transformation_artifact.transformed_test_file_path,
+                                                 mmap_mode=mmap_mode)
+
+            if self.model_trainer_config.out_of_core:
+                best_model, best_score, metric_Artifact = self.train_incrementally(train=train_arr, test=test_arr)
+                model_selection_report = None
+            else:
+                best_model_detail, metric_Artifact, model_selection_report = self.get_model_and_report(train=train_arr,test=test_arr)
+                best_model, best_score = best_model_detail.best_model, best_model_detail.best_score
+
+            preprocessing_obj = self.data_transformation_artifact.transformed_object
+            if preprocessing_obj is None:
+                preprocessing_obj = load_object(self.data_transformation_artifact.transformed_object_file_path)
+
+            if best_score < self.model_trainer_config.expected_score:
                 logging.info("No best model found with score better than base model")
                 raise USVisaException("No best model found with score better than base model")
 
-            usvisaModel = USvisaModel(preprocessiong_object=preprocessing_obj,trained_model_object=best_model_detail.best_model)
+            best_model, knn_reduction_report = self.reduce_knn_model(model=best_model, train=train_arr, test=test_arr)
+            if knn_reduction_report is not None and knn_reduction_report["applied"]:
+                # the metrics are those of the model served
+                y_test, y_pred = test_arr[:, -1], best_model.predict(test_arr[:, :-1])
+                metric_Artifact = ClassificationMetricArtifact(f1_score=f1_score(y_test, y_pred),
+                                                               precision_score=precision_score(y_test, y_pred),
+                                                               recall_score=recall_score(y_test, y_pred))
+
+            compiled_model = self.export_compiled_model(model=best_model, test=test_arr)
+
+            usvisaModel = USvisaModel(preprocessiong_object=preprocessing_obj,trained_model_object=best_model,
+                                      compiled_model_object=compiled_model)
 
             logging.info("Created best model with preprocessing object")
             logging.info("Created path of best model")
@@ -83,7 +226,9 @@ class ModelTrainer:
             save_object(self.model_trainer_config.trained_model_file_path,usvisaModel)
 
             model_trainer_artifact = ModelTrainerArtifact(trained_model_file_path=self.model_trainer_config.trained_model_file_path,
-                                                        metric_artifact=metric_Artifact)
+                                                        metric_artifact=metric_Artifact,
+                                                        model_selection_report=model_selection_report,
+                                                        knn_reduction_report=knn_reduction_report)
             logging.info(f"Model trainer Artifact:{model_trainer_artifact}")
             return model_trainer_artifact
         
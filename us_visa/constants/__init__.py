@@ -25,12 +25,34 @@ AWS_ACCESS_ID_ENV_KEY = "AWS_ACCESS_KEY_ID"
 AWS_SECRET_ACCESS_KEY_ENV_KEY = "AWS_ACCESS_SECRET_KEY"
 REGION_NAME ="us-east-1"
 
+"""S3 transfer related constant start with S3_TRANSFER_VAR_NAME"""
+# objects above the threshold are moved in parts of the chunk size, up to max concurrency parts at a time
+S3_TRANSFER_MULTIPART_THRESHOLD: int = int(os.getenv("S3_TRANSFER_MULTIPART_THRESHOLD", 8 * 1024 * 1024))
+S3_TRANSFER_MULTIPART_CHUNKSIZE: int = int(os.getenv("S3_TRANSFER_MULTIPART_CHUNKSIZE", 16 * 1024 * 1024))
+S3_TRANSFER_MAX_CONCURRENCY: int = int(os.getenv("S3_TRANSFER_MAX_CONCURRENCY", 10))
+# models are downloaded into this directory and loaded from the file, the system temp dir when empty
+S3_TRANSFER_DOWNLOAD_DIR: str = os.getenv("S3_TRANSFER_DOWNLOAD_DIR", "")
+
 """Data Ingestion related constant start with DATA_INGESTION_VAR_NAME"""
 DATA_INGESTION_COLLECTION_NAME: str = "visa_data"
 DATA_INGESTION_COLLECTION_DIR_NAME: str = "data_ingestion"
 DATA_INGESTION_FEATURE_STORE_DIR: str = "feature_store"     
 DATA_INGESTION_INGESTED_DIR: str = "ingested"
 DATA_INGESTION_TRAIN_TEST_SPLIT_RATIO: float = 0.2
+# "csv" or "parquet", the format of the feature store and of the ingested train and test files
+DATA_INGESTION_FILE_FORMAT: str = os.getenv("DATA_INGESTION_FILE_FORMAT", "csv").lower()
+DATA_INGESTION_FILE_FORMATS: tuple = ("csv", "parquet")
+DATA_INGESTION_STREAMING: bool = os.getenv("DATA_INGESTION_STREAMING", "false").lower() == "true"
+DATA_INGESTION_BATCH_SIZE: int = int(os.getenv("DATA_INGESTION_BATCH_SIZE", 10000))
+# more than one partition reads the collection as _id ranges on DATA_INGESTION_READER_THREADS threads
+DATA_INGESTION_READ_PARTITIONS: int = int(os.getenv("DATA_INGESTION_READ_PARTITIONS", 1))
+DATA_INGESTION_READER_THREADS: int = int(os.getenv("DATA_INGESTION_READER_THREADS", 4))
+DATA_INGESTION_PARTITION_KEY: str = os.getenv("DATA_INGESTION_PARTITION_KEY", "_id")
+# incremental runs append the documents above the watermark to a feature store kept across runs
+DATA_INGESTION_INCREMENTAL: bool = os.getenv("DATA_INGESTION_INCREMENTAL", "false").lower() == "true"
+DATA_INGESTION_PERSISTENT_FEATURE_STORE_DIR: str = os.path.join(ARTIFACT_DIR, "feature_store")
+DATA_INGESTION_WATERMARK_FILE_NAME: str = "watermark.yaml"
+DATA_INGESTION_WATERMARK_KEY: str = os.getenv("DATA_INGESTION_WATERMARK_KEY", "_id")
 
 
 """Data Validation related constant start with DATA_VALIDATION_VAR_NAME"""
@@ -38,12 +60,21 @@ DATA_INGESTION_TRAIN_TEST_SPLIT_RATIO: float = 0.2
 DATA_VALIDATION_DIR_NAME: str = "data_validation"
 DATA_VALIDATION_DRIFT_REPORT_DIR: str = "drift_report"
 DATA_VALIDATION_DRIFT_REPORT_FILE_NAME: str = "report.yaml"
+# rows of train and of test sampled for the drift report in out-of-core mode
+DATA_VALIDATION_DRIFT_SAMPLE_SIZE: int = int(os.getenv("DATA_VALIDATION_DRIFT_SAMPLE_SIZE", 100000))
 
 
 """Data Transformation related constant start with DATA_TRANSFORMATION_VAR_NAME"""
 DATA_TRANSFORMATION_DIR_NAME: str = "data_transformation"
 DATA_TRANSFORMATION_OBJECT_DIR: str = "transformed_object"
 DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR: str = "transformed_data"
+# rows sampled to fit the PowerTransformer in out-of-core mode, it has no partial_fit
+DATA_TRANSFORMATION_POWER_TRANSFORMER_SAMPLE_SIZE: int = int(os.getenv("DATA_TRANSFORMATION_POWER_TRANSFORMER_SAMPLE_SIZE", 100000))
+# smote_tomek resamples train and test, smote resamples train only, class_weight leaves the data as it is and
+# weights the classes in the estimators supporting it, none does neither
+DATA_TRANSFORMATION_IMBALANCE_STRATEGY: str = os.getenv("DATA_TRANSFORMATION_IMBALANCE_STRATEGY", "smote_tomek")
+# workers of the nearest neighbour searches of the resamplers, -1 for all cores
+DATA_TRANSFORMATION_IMBALANCE_N_JOBS: int = int(os.getenv("DATA_TRANSFORMATION_IMBALANCE_N_JOBS", -1))
 
 """Model Trainer related constant start with MODEL_TRAINER_VAR_NAME"""
 
@@ -52,6 +83,14 @@ MODEL_TRAINER_TRAINED_MODEL_DIR: str = "trained_model"
 MODEL_TRAINER_MODEL_FILE_NAME: str = "model.pkl"
 MODEL_TRAINER_EXPECTED_SCORE: float = 0.6
 MODEL_TRAINER_MODEL_CONFIG_FILE_PATH: str = os.path.join("config","model.yaml")
+# section of model.yaml with the partial_fit estimator trained in out-of-core mode
+MODEL_TRAINER_INCREMENTAL_MODEL_KEY: str = "incremental_model"
+# section of model.yaml with the search strategy of model selection and its budget
+MODEL_TRAINER_SEARCH_KEY: str = "search"
+# a winning KNeighborsClassifier is refitted on this many class prototypes instead of the whole training matrix,
+# kept when its test accuracy drops by at most MODEL_TRAINER_KNN_MAX_ACCURACY_DROP, 0 keeps the exact classifier
+MODEL_TRAINER_KNN_PROTOTYPES: int = int(os.getenv("MODEL_TRAINER_KNN_PROTOTYPES", 0))
+MODEL_TRAINER_KNN_MAX_ACCURACY_DROP: float = float(os.getenv("MODEL_TRAINER_KNN_MAX_ACCURACY_DROP", 0.01))
 
 """Model Evaluation related constant start with MODEL_EVALUATION_VAR_NAME"""
 
@@ -62,5 +101,57 @@ MODEL_EVALUATION_REPORT_FILE_NAME: str = "report.yaml"
 MODEL_BUCKET_NAME = "usvisamodel20"
 MODEL_PUSHER_S3_KEY ="model-registry"
 
+"""Model cache related constant start with MODEL_CACHE_VAR_NAME"""
+MODEL_CACHE_REFRESH_INTERVAL_SECONDS: int = int(os.getenv("MODEL_CACHE_REFRESH_INTERVAL_SECONDS", 60))
+# models downloaded from s3 are kept on local disk keyed by bucket, key and ETag, shared by all workers
+MODEL_CACHE_DISK_ENABLED: bool = os.getenv("MODEL_CACHE_DISK_ENABLED", "true").lower() == "true"
+MODEL_CACHE_DISK_DIR: str = os.getenv("MODEL_CACHE_DISK_DIR", os.path.join(ARTIFACT_DIR, "model_cache"))
+MODEL_CACHE_DISK_MAX_BYTES: int = int(os.getenv("MODEL_CACHE_DISK_MAX_BYTES", 2 * 1024 ** 3))
+
+"""Prediction micro batching related constant start with PREDICTION_BATCHING_VAR_NAME"""
+PREDICTION_BATCHING_ENABLED: bool = os.getenv("PREDICTION_BATCHING_ENABLED", "false").lower() == "true"
+PREDICTION_BATCHING_MAX_BATCH_SIZE: int = int(os.getenv("PREDICTION_BATCHING_MAX_BATCH_SIZE", 64))
+PREDICTION_BATCHING_MAX_WAIT_MS: float = float(os.getenv("PREDICTION_BATCHING_MAX_WAIT_MS", 5))
+
+"""Prediction cache related constant start with PREDICTION_CACHE_VAR_NAME"""
+PREDICTION_CACHE_ENABLED: bool = os.getenv("PREDICTION_CACHE_ENABLED", "false").lower() == "true"
+PREDICTION_CACHE_MAX_SIZE: int = int(os.getenv("PREDICTION_CACHE_MAX_SIZE", 10000))
+# e.g. "prevailing_wage=100,no_of_employees=10", empty keeps numeric fields exact
+PREDICTION_CACHE_QUANTIZATION: str = os.getenv("PREDICTION_CACHE_QUANTIZATION", "")
+
+"""Model artifact related constant start with MODEL_ARTIFACT_VAR_NAME"""
+# arrays of at least this many bytes are stored as memory mappable segments instead of being pickled
+MODEL_ARTIFACT_MIN_SEGMENT_BYTES: int = int(os.getenv("MODEL_ARTIFACT_MIN_SEGMENT_BYTES", 4096))
+
+"""Serving executor related constant start with SERVING_VAR_NAME"""
+SERVING_INFERENCE_POOL_SIZE: int = int(os.getenv("SERVING_INFERENCE_POOL_SIZE", 4))
+SERVING_INFERENCE_MAX_QUEUE_SIZE: int = int(os.getenv("SERVING_INFERENCE_MAX_QUEUE_SIZE", 64))
+SERVING_TRAINING_POOL_SIZE: int = int(os.getenv("SERVING_TRAINING_POOL_SIZE", 1))
+SERVING_TRAINING_MAX_QUEUE_SIZE: int = int(os.getenv("SERVING_TRAINING_MAX_QUEUE_SIZE", 1))
+SERVING_WORKERS: int = int(os.getenv("SERVING_WORKERS", 4))
+SERVING_PRELOAD_MODEL: bool = os.getenv("SERVING_PRELOAD_MODEL", "false").lower() == "true"
+
+"""Training job related constant start with TRAINING_JOB_VAR_NAME"""
+TRAINING_JOB_DIR: str = os.path.join(ARTIFACT_DIR, "training_jobs")
+TRAINING_JOB_LOCK_FILE_NAME: str = ".lock"
+TRAINING_JOB_NICENESS: int = int(os.getenv("TRAINING_JOB_NICENESS", 10))
+
+"""Training pipeline related constant start with TRAINING_PIPELINE_VAR_NAME"""
+# stages hand their DataFrames and arrays to the next stage in memory, the files are written in the background
+TRAINING_PIPELINE_IN_MEMORY_HANDOFF: bool = os.getenv("TRAINING_PIPELINE_IN_MEMORY_HANDOFF", "true").lower() == "true"
+TRAINING_PIPELINE_ARTIFACT_WRITER_THREADS: int = int(os.getenv("TRAINING_PIPELINE_ARTIFACT_WRITER_THREADS", 2))
+# transformation and training stream the data in DATA_INGESTION_BATCH_SIZE chunks, ingestion streams too
+TRAINING_PIPELINE_OUT_OF_CORE: bool = os.getenv("TRAINING_PIPELINE_OUT_OF_CORE", "false").lower() == "true"
+# stages whose inputs and config did not change reuse the artifact of an earlier run
+TRAINING_PIPELINE_STAGE_CACHE: bool = os.getenv("TRAINING_PIPELINE_STAGE_CACHE", "true").lower() == "true"
+TRAINING_PIPELINE_STAGE_CACHE_DIR: str = os.path.join(ARTIFACT_DIR, "stage_cache")
+TRAINING_PIPELINE_STAGE_CACHE_REPORT_FILE_NAME: str = "stage_cache_report.yaml"
+# results of fitted transformers applied to the same data are computed once, kept in memory and on disk
+TRAINING_PIPELINE_TRANSFORM_CACHE: bool = os.getenv("TRAINING_PIPELINE_TRANSFORM_CACHE", "true").lower() == "true"
+TRAINING_PIPELINE_TRANSFORM_CACHE_DIR: str = os.path.join(ARTIFACT_DIR, "transform_cache")
+TRAINING_PIPELINE_TRANSFORM_CACHE_MAX_BYTES: int = int(os.getenv("TRAINING_PIPELINE_TRANSFORM_CACHE_MAX_BYTES", 512 * 1024 ** 2))
+# the least recently used arrays of the transform cache directory are removed above this size
+TRAINING_PIPELINE_TRANSFORM_CACHE_DISK_MAX_BYTES: int = int(os.getenv("TRAINING_PIPELINE_TRANSFORM_CACHE_DISK_MAX_BYTES", 2 * 1024 ** 3))
+
 APP_HOST = "0.0.0.0"
 APP_PORT = 8080
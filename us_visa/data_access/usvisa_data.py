@@ -1,11 +1,20 @@
 from us_visa.configuration.mongo_db_connection import MongoDBClient     
-from us_visa.constants import DATABASE_NAME
+from us_visa.constants import DATABASE_NAME, SCHEMA_FILE_PATH
 from us_visa.exception import USVisaException
+from us_visa.utils.main_utils import read_yaml_file, apply_schema_dtypes
 import sys
 import pandas as pd 
-from typing import Optional
+from collections import deque
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple
 import numpy as np  
+from pymongo.errors import OperationFailure
 
+# chunks a partition reader keeps ready ahead of the consumer
+PARTITION_READ_AHEAD_CHUNKS = 2
 
 
 class USVisaData:
@@ -29,24 +38,224 @@ class USVisaData:
         except Exception as e:
             raise USVisaException(e, sys)
 
-    def get_collection_as_dataframe(self, collection_name: str,database_name: Optional[str] = None) -> pd.DataFrame:
+    def get_collection(self, collection_name: str, database_name: Optional[str] = None):
+        if database_name is None:
+            return self.mongo_client.database[collection_name]
+        return self.mongo_client.client[database_name][collection_name]
+
+    def get_collection_fingerprint(self, collection_name: str, database_name: Optional[str] = None) -> dict:
+        """
+        Method Name: get_collection_fingerprint
+        Description: This method returns a value that changes when the documents of the collection change: the
+                     md5 of the collection computed by the server with dbHash, or the document count and the
+                     _id bounds when the user may not run dbHash. The latter catches inserted and deleted
+                     documents but not documents updated in place.
+        Output: dict
+        On Failure: Raise Exception
+        """
+        try:
+            collection = self.get_collection(collection_name, database_name=database_name)
+            try:
+                result = collection.database.command("dbHash", collections=[collection.name])
+                return {"md5": result["collections"].get(collection.name)}
+            except OperationFailure:
+                first = collection.find_one({}, projection={"_id": 1}, sort=[("_id", 1)])
+                last = collection.find_one({}, projection={"_id": 1}, sort=[("_id", -1)])
+                return {"count": collection.count_documents({}),
+                        "min_id": None if first is None else str(first["_id"]),
+                        "max_id": None if last is None else str(last["_id"])}
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def get_collection_as_dataframe(self, collection_name: str,database_name: Optional[str] = None,
+                                    schema_info: Optional[dict] = None) -> pd.DataFrame:
         """
         Method Name: get_collection_as_dataframe
-        Description: This method fetches the data from MongoDB collection and converts it into a pandas DataFrame.
+        Description: This method fetches the data from MongoDB collection and converts it into a pandas DataFrame
+                     with the compact dtypes of the schema.
         Output: DataFrame
         On Failure: Raise Exception
         """
         try:
-            if database_name is None:
-                collection = self.mongo_client.database[collection_name]
-            else:
-                collection = self.mongo_client.client[database_name][collection_name]
+            collection = self.get_collection(collection_name, database_name=database_name)
             
             df = pd.DataFrame(list(collection.find()))
             
             if '_id' in df.columns:
                 df.drop(columns=['_id'], inplace=True)
-            df.replace({"na": np.nan}, inplace=True)
-            return df
+            if schema_info is None:
+                schema_info = read_yaml_file(SCHEMA_FILE_PATH)
+            return apply_schema_dtypes(df, schema_info)
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def iter_collection_chunks(self, collection_name: str, batch_size: int, database_name: Optional[str] = None,
+                               schema_info: Optional[dict] = None, filter_query: Optional[dict] = None,
+                               keep_id: bool = False) -> Iterator[pd.DataFrame]:
+        """
+        Method Name: iter_collection_chunks
+        Description: This method iterates the MongoDB collection with a cursor and yields it as DataFrames of at
+                     most batch_size rows, so only one batch of documents is held in memory at a time. Every chunk
+                     gets the columns of the first chunk in the same order and the dtypes of the schema, the na
+                     values of the schema becoming NaN. filter_query restricts the documents read and
+                     keep_id keeps the _id column.
+        Output: Iterator of DataFrame
+        On Failure: Raise Exception
+        """
+        try:
+            if schema_info is None:
+                schema_info = read_yaml_file(SCHEMA_FILE_PATH)
+            collection = self.get_collection(collection_name, database_name=database_name)
+            cursor = collection.find(filter_query or {}, projection=None if keep_id else {"_id": 0},
+                                     batch_size=batch_size)
+
+            columns = None
+            while True:
+                documents = list(islice(cursor, batch_size))
+                if len(documents) == 0:
+                    break
+                chunk = pd.DataFrame.from_records(documents)
+                del documents
+                if columns is None:
+                    columns = list(chunk.columns)
+                yield self.normalize_chunk(chunk, columns=columns, schema_info=schema_info)
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    @staticmethod
+    def normalize_chunk(chunk: pd.DataFrame, columns: List[str], schema_info: dict) -> pd.DataFrame:
+        """
+        Gives a chunk the given columns in their order and the dtypes of the schema, ints are not downcast so
+        every chunk appended to the feature store has the same dtypes
+        """
+        chunk = chunk.reindex(columns=columns)
+        return apply_schema_dtypes(chunk, schema_info, downcast=False)
+
+    def get_partition_bounds(self, collection_name: str, partitions: int, partition_key: str = "_id",
+                             database_name: Optional[str] = None,
+                             filter_query: Optional[dict] = None) -> List[Tuple[object, object]]:
+        """
+        Method Name: get_partition_bounds
+        Description: This method splits the collection into at most partitions ranges of partition_key holding
+                     about the same number of documents, with the $bucketAuto stage of the server.
+        Output: List of (min, max) bounds, max is exclusive except for the last range
+        On Failure: Raise Exception
+        """
+        try:
+            collection = self.get_collection(collection_name, database_name=database_name)
+            pipeline = [{"$bucketAuto": {"groupBy": f"${partition_key}", "buckets": partitions}}]
+            if filter_query:
+                pipeline.insert(0, {"$match": filter_query})
+            buckets = collection.aggregate(pipeline, allowDiskUse=True)
+            return [(bucket["_id"]["min"], bucket["_id"]["max"]) for bucket in buckets]
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def iter_partition_chunks(self, collection_name: str, bounds: Tuple[object, object], last: bool,
+                              partition_key: str, batch_size: int, database_name: Optional[str] = None,
+                              filter_query: Optional[dict] = None, keep_id: bool = False) -> Iterator[pd.DataFrame]:
+        """
+        Method Name: iter_partition_chunks
+        Description: This method iterates the documents of one partition_key range with a cursor sorted by
+                     partition_key, so every run returns them in the same order, and yields them as DataFrames
+                     of at most batch_size rows. The server sorts with the index of partition_key, _id always
+                     has one: on a key without an index it sorts the whole range in memory and fails once the
+                     range exceeds its in-memory sort limit (100MB by default).
+        Output: Iterator of DataFrame
+        On Failure: Raise Exception
+        """
+        try:
+            collection = self.get_collection(collection_name, database_name=database_name)
+            lower, upper = bounds
+            query = {partition_key: {"$gte": lower, "$lte" if last else "$lt": upper}}
+            if filter_query:
+                query = {"$and": [query, filter_query]}
+            projection = None if partition_key == "_id" or keep_id else {"_id": 0}
+            cursor = collection.find(query, projection=projection, batch_size=batch_size).sort(partition_key, 1)
+            while True:
+                documents = list(islice(cursor, batch_size))
+                if len(documents) == 0:
+                    break
+                df = pd.DataFrame.from_records(documents)
+                del documents
+                if '_id' in df.columns and not keep_id:
+                    df.drop(columns=['_id'], inplace=True)
+                yield df
         except Exception as e:
-            raise USVisaException(e, sys)
\ No newline at end of file
+            raise USVisaException(e, sys)
+
+    def iter_collection_partitions(self, collection_name: str, partitions: int, reader_threads: int,
+                                   batch_size: int, partition_key: str = "_id", database_name: Optional[str] = None,
+                                   schema_info: Optional[dict] = None, filter_query: Optional[dict] = None,
+                                   keep_id: bool = False) -> Iterator[pd.DataFrame]:
+        """
+        Method Name: iter_collection_partitions
+        Description: This method reads the partitions of the collection concurrently on reader_threads threads
+                     sharing the connection pool of the MongoDBClient, and yields their batch_size chunks in
+                     partition_key order so the result does not depend on which thread finishes first. At most
+                     reader_threads partitions are read ahead of the consumer, each holding at most
+                     PARTITION_READ_AHEAD_CHUNKS chunks not yet consumed.
+        Output: Iterator of DataFrame of at most batch_size rows
+        On Failure: Raise Exception
+        """
+        stop = threading.Event()
+        try:
+            if schema_info is None:
+                schema_info = read_yaml_file(SCHEMA_FILE_PATH)
+            bounds = self.get_partition_bounds(collection_name, partitions=partitions, partition_key=partition_key,
+                                               database_name=database_name, filter_query=filter_query)
+
+            def put(chunks: queue.Queue, item) -> bool:
+                # gives up once the consumer is gone, so no reader is left blocked on a full queue
+                while not stop.is_set():
+                    try:
+                        chunks.put(item, timeout=0.1)
+                        return True
+                    except queue.Full:
+                        continue
+                return False
+
+            def read(index: int, chunks: queue.Queue) -> None:
+                try:
+                    for chunk in self.iter_partition_chunks(collection_name, bounds[index],
+                                                            last=index == len(bounds) - 1,
+                                                            partition_key=partition_key, batch_size=batch_size,
+                                                            database_name=database_name,
+                                                            filter_query=filter_query, keep_id=keep_id):
+                        if not put(chunks, chunk):
+                            return
+                finally:
+                    put(chunks, None)
+
+            columns = None
+            with ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix="mongo-reader") as executor:
+                pending = deque()
+
+                def submit(index: int) -> None:
+                    chunks = queue.Queue(maxsize=PARTITION_READ_AHEAD_CHUNKS)
+                    pending.append((executor.submit(read, index, chunks), chunks))
+
+                for index in range(min(reader_threads, len(bounds))):
+                    submit(index)
+                next_index = len(pending)
+                try:
+                    while pending:
+                        future, chunks = pending[0]
+                        chunk = chunks.get()
+                        if chunk is None:
+                            pending.popleft()
+                            # raises the exception of the reader
+                            future.result()
+                            if next_index < len(bounds):
+                                submit(next_index)
+                                next_index += 1
+                            continue
+                        if len(chunk) == 0:
+                            continue
+                        if columns is None:
+                            columns = list(chunk.columns)
+                        yield self.normalize_chunk(chunk, columns=columns, schema_info=schema_info)
+                finally:
+                    stop.set()
+        except Exception as e:
+            raise USVisaException(e, sys)
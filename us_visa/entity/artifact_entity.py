@@ -1,10 +1,17 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+from pandas import DataFrame
 
 
 @dataclass
 class DataIngestionArtifact:
     training_file_path: str
     testing_file_path: str
+    # in memory copies of the files handed to the next stages, None when they have to read the files
+    train_df: Optional[DataFrame] = field(default=None, repr=False, compare=False)
+    test_df: Optional[DataFrame] = field(default=None, repr=False, compare=False)
 
 @dataclass
 class DataValidationArtifact:
@@ -17,6 +24,14 @@ class DataTransformationArtifact:
     transformed_train_file_path: str
     transformed_test_file_path: str
     transformed_object_file_path: str
+    # in memory copies of the files handed to the model trainer, None when it has to read the files
+    transformed_train_arr: Optional[np.ndarray] = field(default=None, repr=False, compare=False)
+    transformed_test_arr: Optional[np.ndarray] = field(default=None, repr=False, compare=False)
+    transformed_object: Optional[object] = field(default=None, repr=False, compare=False)
+    # weights of the target classes for the estimators, set by the class_weight imbalance strategy
+    class_weight: Optional[dict] = None
+    # imbalance strategy with its seconds and row counts on train and test
+    imbalance_report: Optional[dict] = None
 
 @dataclass
 class ClassificationMetricArtifact:
@@ -29,6 +44,10 @@ class ClassificationMetricArtifact:
 class ModelTrainerArtifact:
     trained_model_file_path: str
     metric_artifact: ClassificationMetricArtifact
+    # fits, seconds and best grid point of every model.yaml candidate searched
+    model_selection_report: Optional[dict] = None
+    # accuracy, latency and size of the exact and the prototype reduced KNeighborsClassifier
+    knn_reduction_report: Optional[dict] = None
 
 @dataclass
 class ModelEvaluationArtifact:
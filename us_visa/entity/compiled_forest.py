@@ -0,0 +1,129 @@
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from us_visa.logger import logging
+
+
+class CompiledForest:
+    """
+    Class Name: CompiledForest
+    Description: Fitted RandomForestClassifier flattened into contiguous node arrays (feature, threshold,
+                 children and leaf class probabilities) and evaluated with a vectorized numpy traversal,
+                 avoiding the per call validation overhead of sklearn predict on tiny batches.
+    On Failure: Raise Exception
+    """
+
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, left: np.ndarray, right: np.ndarray,
+                 leaf_value: np.ndarray, roots: np.ndarray, classes: np.ndarray, max_depth: int):
+        """
+        :param feature: Split feature of every node, 0 for leaves
+        :param threshold: Split threshold of every node, +inf for leaves so they always go left
+        :param left: Left child of every node, leaves point to themselves
+        :param right: Right child of every node, leaves point to themselves
+        :param leaf_value: Class probabilities of every node, shape (n_nodes, n_classes)
+        :param roots: Index of the root node of every tree
+        :param classes: Class labels of the forest
+        :param max_depth: Depth of the deepest tree, the number of traversal steps
+        """
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.leaf_value = leaf_value
+        self.roots = roots
+        self.classes = classes
+        self.max_depth = int(max_depth)
+        self.node_lists = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["node_lists"] = None
+        return state
+
+    @classmethod
+    def from_forest(cls, forest: RandomForestClassifier) -> "CompiledForest":
+        """
+        Method Name: from_forest
+        Description: Flattens the trees of a fitted single output RandomForestClassifier.
+        Output: CompiledForest
+        On Failure: Raise NotImplementedError for forests that cannot be compiled
+        """
+        if not isinstance(forest, RandomForestClassifier) or forest.n_outputs_ != 1:
+            raise NotImplementedError("Only single output RandomForestClassifier models can be compiled")
+
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            node_ids = np.arange(n_nodes, dtype=np.int64) + offset
+            is_leaf = tree.children_left == -1
+
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int64))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold).astype(np.float64))
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left + offset).astype(np.int64))
+            rights.append(np.where(is_leaf, node_ids, tree.children_right + offset).astype(np.int64))
+
+            # same normalisation as DecisionTreeClassifier.predict_proba
+            value = tree.value[:, 0, :].astype(np.float64)
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            values.append(value / normalizer)
+
+            roots.append(offset)
+            offset += n_nodes
+            max_depth = max(max_depth, tree.max_depth)
+
+        compiled_forest = cls(feature=np.concatenate(features), threshold=np.concatenate(thresholds),
+                              left=np.concatenate(lefts), right=np.concatenate(rights),
+                              leaf_value=np.concatenate(values), roots=np.asarray(roots, dtype=np.int64),
+                              classes=np.asarray(forest.classes_), max_depth=max_depth)
+        logging.info(f"Compiled {len(roots)} trees with {offset} nodes and max depth {max_depth}")
+        return compiled_forest
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """
+        Returns the class probabilities averaged over the trees, like RandomForestClassifier.predict_proba
+        """
+        if hasattr(X, "toarray"):
+            X = X.toarray()
+        # sklearn trees compare float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.repeat(self.roots[None, :], X.shape[0], axis=0)
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.leaf_value[nodes].sum(axis=1) / len(self.roots)
+
+    def _predict_proba_row(self, x: np.ndarray) -> np.ndarray:
+        # for a single row a plain python walk over lists beats the per step numpy overhead
+        if self.node_lists is None:
+            self.node_lists = (self.feature.tolist(), self.threshold.tolist(), self.left.tolist(),
+                               self.right.tolist(), self.roots.tolist())
+        feature, threshold, left, right, roots = self.node_lists
+        x = np.asarray(x, dtype=np.float32).ravel().tolist()
+        leaves = []
+        for node in roots:
+            while left[node] != node:
+                node = left[node] if x[feature[node]] <= threshold[node] else right[node]
+            leaves.append(node)
+        return self.leaf_value[leaves].sum(axis=0, keepdims=True) / len(roots)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        if hasattr(X, "toarray"):
+            X = X.toarray()
+        if len(X) == 1:
+            proba = self._predict_proba_row(X[0])
+        else:
+            proba = self.predict_proba(X)
+        return self.classes.take(np.argmax(proba, axis=1), axis=0)
+
+    def agreement(self, forest: RandomForestClassifier, X: np.ndarray) -> float:
+        """
+        Returns the share of rows of X on which the compiled forest predicts the same label as forest
+        """
+        if len(X) == 0:
+            return 1.0
+        return float(np.mean(self.predict(X) == forest.predict(X)))
@@ -1,5 +1,5 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, fields, replace
 from datetime import datetime
 from us_visa.constants import *
 
@@ -11,24 +11,68 @@ class TrainingPipelineConfig:
     pipeline_name: str = PIPELINE_NAME
     artifact_dir: str = os.path.join(ARTIFACT_DIR,TIMESTAMP)
     timestamp: str = TIMESTAMP
+    in_memory_handoff: bool = TRAINING_PIPELINE_IN_MEMORY_HANDOFF
+    artifact_writer_threads: int = TRAINING_PIPELINE_ARTIFACT_WRITER_THREADS
+    stage_cache: bool = TRAINING_PIPELINE_STAGE_CACHE
+    stage_cache_dir: str = TRAINING_PIPELINE_STAGE_CACHE_DIR
+    transform_cache: bool = TRAINING_PIPELINE_TRANSFORM_CACHE
+    transform_cache_dir: str = TRAINING_PIPELINE_TRANSFORM_CACHE_DIR
+    transform_cache_max_bytes: int = TRAINING_PIPELINE_TRANSFORM_CACHE_MAX_BYTES
+    transform_cache_disk_max_bytes: int = TRAINING_PIPELINE_TRANSFORM_CACHE_DISK_MAX_BYTES
 
 
 trainingpipelineconfig: TrainingPipelineConfig = TrainingPipelineConfig()
 
+
+def with_artifact_dir(config, artifact_dir: str):
+    """
+    Returns a copy of a stage config whose artifact paths live under artifact_dir instead of
+    the artifact dir of the process wide trainingpipelineconfig
+    """
+    changes = {}
+    for config_field in fields(config):
+        value = getattr(config, config_field.name)
+        if isinstance(value, str) and value.startswith(trainingpipelineconfig.artifact_dir):
+            changes[config_field.name] = artifact_dir + value[len(trainingpipelineconfig.artifact_dir):]
+    return replace(config, **changes)
+
+def with_file_format(file_name: str, file_format: str = DATA_INGESTION_FILE_FORMAT) -> str:
+    """
+    Returns file_name with the extension of file_format, e.g. train.csv -> train.parquet
+    """
+    file_format = file_format.lower()
+    if file_format not in DATA_INGESTION_FILE_FORMATS:
+        raise ValueError(f"Unknown DATA_INGESTION_FILE_FORMAT {file_format!r}, expected one of "
+                         f"{DATA_INGESTION_FILE_FORMATS}")
+    return f"{os.path.splitext(file_name)[0]}.{file_format}"
+
 @dataclass
 class DataIngestionConfig:
     data_ingestion_dir: str = os.path.join(trainingpipelineconfig.artifact_dir, DATA_INGESTION_COLLECTION_DIR_NAME) 
-    feature_store_file_path: str = os.path.join(data_ingestion_dir, DATA_INGESTION_FEATURE_STORE_DIR, FILENAME)
-    training_file_path: str = os.path.join(data_ingestion_dir, DATA_INGESTION_INGESTED_DIR, TRAIN_FILE_NAME)
-    testing_file_path: str = os.path.join(data_ingestion_dir, DATA_INGESTION_INGESTED_DIR, TEST_FILE_NAME)
+    feature_store_file_path: str = os.path.join(data_ingestion_dir, DATA_INGESTION_FEATURE_STORE_DIR, with_file_format(FILENAME))
+    training_file_path: str = os.path.join(data_ingestion_dir, DATA_INGESTION_INGESTED_DIR, with_file_format(TRAIN_FILE_NAME))
+    testing_file_path: str = os.path.join(data_ingestion_dir, DATA_INGESTION_INGESTED_DIR, with_file_format(TEST_FILE_NAME))
     train_test_split_ratio: float = DATA_INGESTION_TRAIN_TEST_SPLIT_RATIO
     collection_name: str = DATA_INGESTION_COLLECTION_NAME
+    streaming: bool = DATA_INGESTION_STREAMING or TRAINING_PIPELINE_OUT_OF_CORE
+    batch_size: int = DATA_INGESTION_BATCH_SIZE
+    read_partitions: int = DATA_INGESTION_READ_PARTITIONS
+    reader_threads: int = DATA_INGESTION_READER_THREADS
+    partition_key: str = DATA_INGESTION_PARTITION_KEY
+    incremental: bool = DATA_INGESTION_INCREMENTAL
+    persistent_feature_store_file_path: str = os.path.join(DATA_INGESTION_PERSISTENT_FEATURE_STORE_DIR, FILENAME)
+    watermark_file_path: str = os.path.join(DATA_INGESTION_PERSISTENT_FEATURE_STORE_DIR,
+                                            DATA_INGESTION_WATERMARK_FILE_NAME)
+    watermark_key: str = DATA_INGESTION_WATERMARK_KEY
 
 @dataclass
 class DataValidationConfig:
     data_validation_dir: str = os.path.join(trainingpipelineconfig.artifact_dir, DATA_VALIDATION_DIR_NAME)
     drift_report_dir: str = os.path.join(data_validation_dir, DATA_VALIDATION_DRIFT_REPORT_DIR)
     drift_report_file_path: str = os.path.join(drift_report_dir, DATA_VALIDATION_DRIFT_REPORT_FILE_NAME)
+    out_of_core: bool = TRAINING_PIPELINE_OUT_OF_CORE
+    chunk_size: int = DATA_INGESTION_BATCH_SIZE
+    drift_sample_size: int = DATA_VALIDATION_DRIFT_SAMPLE_SIZE
 
 @dataclass
 class DataTransformationConfig:
@@ -38,6 +82,11 @@ class DataTransformationConfig:
 
     transformed_train_file_path: str = os.path.join(data_transformation_dir, DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR, TRAIN_FILE_NAME.replace(".csv",".npy"))
     transformed_test_file_path: str = os.path.join(data_transformation_dir, DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR, TEST_FILE_NAME.replace(".csv",".npy"))
+    out_of_core: bool = TRAINING_PIPELINE_OUT_OF_CORE
+    chunk_size: int = DATA_INGESTION_BATCH_SIZE
+    power_transformer_sample_size: int = DATA_TRANSFORMATION_POWER_TRANSFORMER_SAMPLE_SIZE
+    imbalance_strategy: str = DATA_TRANSFORMATION_IMBALANCE_STRATEGY
+    imbalance_n_jobs: int = DATA_TRANSFORMATION_IMBALANCE_N_JOBS
 
 @dataclass
 class ModelTrainerConfig:
@@ -46,12 +95,18 @@ class ModelTrainerConfig:
     trained_model_file_path: str = os.path.join(trained_model_dir, MODEL_TRAINER_MODEL_FILE_NAME)
     expected_score: float = MODEL_TRAINER_EXPECTED_SCORE
     model_config_file_path: str = MODEL_TRAINER_MODEL_CONFIG_FILE_PATH
+    out_of_core: bool = TRAINING_PIPELINE_OUT_OF_CORE
+    chunk_size: int = DATA_INGESTION_BATCH_SIZE
+    knn_prototypes: int = MODEL_TRAINER_KNN_PROTOTYPES
+    knn_max_accuracy_drop: float = MODEL_TRAINER_KNN_MAX_ACCURACY_DROP
 
 @dataclass
 class ModelEvaluationConfig:
     changed_threshold_score: float = MODEL_EVALUATION_CHANGED_SCORE
     bucket_name: str = MODEL_BUCKET_NAME
     s3_model_key_path: str = MODEL_EVALUATION_FILE_NAME
+    out_of_core: bool = TRAINING_PIPELINE_OUT_OF_CORE
+    chunk_size: int = DATA_INGESTION_BATCH_SIZE
 
 @dataclass
 class ModelPusherConfig:
@@ -62,7 +117,24 @@ class ModelPusherConfig:
 class USvisaPredictorConfig:
     model_file_path :str = MODEL_TRAINER_MODEL_FILE_NAME
     model_bucket_name : str = MODEL_BUCKET_NAME
-    
-    
+    model_cache_refresh_interval: int = MODEL_CACHE_REFRESH_INTERVAL_SECONDS
+    prediction_cache_enabled: bool = PREDICTION_CACHE_ENABLED
+    prediction_cache_max_size: int = PREDICTION_CACHE_MAX_SIZE
+    prediction_cache_quantization: str = PREDICTION_CACHE_QUANTIZATION
 
+@dataclass
+class USvisaBatchingConfig:
+    enabled: bool = PREDICTION_BATCHING_ENABLED
+    max_batch_size: int = PREDICTION_BATCHING_MAX_BATCH_SIZE
+    max_wait_ms: float = PREDICTION_BATCHING_MAX_WAIT_MS
 
+@dataclass
+class ServingExecutorConfig:
+    inference_pool_size: int = SERVING_INFERENCE_POOL_SIZE
+    inference_max_queue_size: int = SERVING_INFERENCE_MAX_QUEUE_SIZE
+    training_pool_size: int = SERVING_TRAINING_POOL_SIZE
+    training_max_queue_size: int = SERVING_TRAINING_MAX_QUEUE_SIZE
+
+@dataclass
+class ServingPreloadConfig:
+    enabled: bool = SERVING_PRELOAD_MODEL
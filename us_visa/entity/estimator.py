@@ -4,6 +4,9 @@ from us_visa.logger import logging
 
 from pandas import DataFrame
 from sklearn.pipeline import Pipeline
+from typing import Optional
+from us_visa.entity.compiled_forest import CompiledForest
+from us_visa.entity.fast_encoder import FastFeatureEncoder
 
 class TargetValueMapping:
     def __init__(self):
@@ -16,31 +19,76 @@ class TargetValueMapping:
         return dict(zip(mapping_response.values(), mapping_response.keys()))
     
 class USvisaModel:
-    def __init__(self,preprocessiong_object: Pipeline,trained_model_object: object):
+    def __init__(self,preprocessiong_object: Pipeline,trained_model_object: object,
+                 compiled_model_object: Optional[CompiledForest] = None):
         """
 
         :param preprocessiong_object: Input object of processor
         :param trained_model_object:  Output object of processor
+        :param compiled_model_object: Numpy export of the trained model used for serving when present
     
         """
         self.preprocessing_object = preprocessiong_object
         self.trained_model_object = trained_model_object
+        self.compiled_model_object = compiled_model_object
 
-    def predict(self, dataframe :DataFrame) -> DataFrame:
+    def predict_features(self, transformed_features):
+        """
+        Predicts already transformed features with the compiled model when present, else with sklearn
+        """
+        compiled_model = getattr(self, "compiled_model_object", None)
+        if compiled_model is not None:
+            return compiled_model.predict(transformed_features)
+        return self.trained_model_object.predict(transformed_features)
+
+    def predict(self, dataframe :DataFrame, transform_cache=None) -> DataFrame:
         """
         Functions accepts raw data and transforms uisng the preprocessiong object ensuring its the format
-        as training data.
+        as training data, looked up in transform_cache when given.
         Performs predictions on transformed fetures
         """
         logging.info ("Entered Predict Method of USvisaModel class:")
         try:
             logging.info("using trained model to get predictions")
-            transformed_features = self.preprocessing_object.transform(dataframe)
+            if transform_cache is not None:
+                transformed_features = transform_cache.transform(self.preprocessing_object, dataframe)
+            else:
+                transformed_features = self.preprocessing_object.transform(dataframe)
             logging.info("Used the rained model to get predictions")
-            return self.trained_model_object.predict(transformed_features)
+            return self.predict_features(transformed_features)
         
         except Exception as e:
             raise USVisaException(e,sys) from e
+
+    def get_fast_encoder(self) -> Optional[FastFeatureEncoder]:
+        """
+        Compiles the preprocessing object into a FastFeatureEncoder on first use,
+        returns None when the preprocessing object cannot be compiled
+        """
+        encoder = getattr(self, "fast_encoder", None)
+        if encoder is None:
+            try:
+                encoder = FastFeatureEncoder.from_preprocessor(self.preprocessing_object)
+            except NotImplementedError as e:
+                logging.info(f"FastFeatureEncoder unavailable, falling back to the preprocessing object: {e}")
+                encoder = False
+            self.fast_encoder = encoder
+        return encoder if encoder is not False else None
+
+    def predict_record(self, record: dict):
+        """
+        Predicts a single raw record, encoding it with the FastFeatureEncoder instead of
+        building a one row DataFrame for the preprocessing object
+        """
+        try:
+            encoder = self.get_fast_encoder()
+            if encoder is None:
+                return self.predict(DataFrame([record]))
+            features = encoder.encode(record).reshape(1, -1)
+            return self.predict_features(features)
+
+        except Exception as e:
+            raise USVisaException(e,sys) from e
     
 
     def __repr__(self):
@@ -0,0 +1,205 @@
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pandas import DataFrame
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, PowerTransformer, StandardScaler
+
+from us_visa.exception import USVisaException
+from us_visa.logger import logging
+
+
+def _category_key(value):
+    # None and NaN are both "missing" and have to hit the same table entry
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value
+
+
+class FastFeatureEncoder:
+    """
+    Class Name: FastFeatureEncoder
+    Description: Encoder compiled from a fitted ColumnTransformer that writes the features of raw records
+                 directly into a preallocated numpy row, without building a DataFrame. It holds the
+                 category -> output column tables of the one-hot and ordinal encoders and the means, scales
+                 and yeo-johnson lambdas of the numeric transformers.
+    On Failure: from_preprocessor raises NotImplementedError for transformers it cannot compile
+    """
+
+    def __init__(self, n_features: int, numeric_blocks: List[tuple], onehot_blocks: List[tuple],
+                 ordinal_blocks: List[tuple]):
+        """
+        :param n_features: Width of the transformed row
+        :param numeric_blocks: (columns, output slice, steps) of the numeric transformers
+        :param onehot_blocks: (column, output slice, category -> output index, handle_unknown)
+        :param ordinal_blocks: (column, output index, category -> code, unknown_value)
+        """
+        self.n_features = n_features
+        self.numeric_blocks = numeric_blocks
+        self.onehot_blocks = onehot_blocks
+        self.ordinal_blocks = ordinal_blocks
+
+    @staticmethod
+    def _compile_numeric_steps(transformer) -> List[tuple]:
+        if isinstance(transformer, Pipeline):
+            steps = []
+            for _, step in transformer.steps:
+                steps.extend(FastFeatureEncoder._compile_numeric_steps(step))
+            return steps
+        if isinstance(transformer, StandardScaler):
+            mean = transformer.mean_ if transformer.with_mean else 0.0
+            scale = transformer.scale_ if transformer.with_std else 1.0
+            return [("affine", np.asarray(mean, dtype=np.float64), np.asarray(scale, dtype=np.float64))]
+        if isinstance(transformer, PowerTransformer):
+            steps = [(transformer.method, np.asarray(transformer.lambdas_, dtype=np.float64))]
+            if transformer.standardize:
+                steps.extend(FastFeatureEncoder._compile_numeric_steps(transformer._scaler))
+            return steps
+        raise NotImplementedError(f"{type(transformer).__name__} is not supported by FastFeatureEncoder")
+
+    @classmethod
+    def from_preprocessor(cls, preprocessor: ColumnTransformer) -> "FastFeatureEncoder":
+        """
+        Method Name: from_preprocessor
+        Description: Compiles the fitted preprocessor of the USvisaModel into lookup tables and numeric steps.
+        Output: FastFeatureEncoder
+        On Failure: Raise NotImplementedError when a transformer cannot be compiled
+        """
+        if not isinstance(preprocessor, ColumnTransformer):
+            raise NotImplementedError(f"{type(preprocessor).__name__} is not supported by FastFeatureEncoder")
+
+        numeric_blocks, onehot_blocks, ordinal_blocks = [], [], []
+        n_features = 0
+        for name, transformer, columns in preprocessor.transformers_:
+            if transformer == "drop" or len(columns) == 0:
+                continue
+            if name == "remainder" or transformer == "passthrough":
+                raise NotImplementedError("Passthrough columns are not supported by FastFeatureEncoder")
+            output_slice = preprocessor.output_indices_[name]
+            n_features = max(n_features, output_slice.stop)
+            columns = list(columns)
+
+            if isinstance(transformer, OneHotEncoder):
+                if transformer.drop_idx_ is not None or getattr(transformer, "infrequent_categories_", None):
+                    raise NotImplementedError("OneHotEncoder with drop or infrequent categories is not supported")
+                offset = output_slice.start
+                for column, categories in zip(columns, transformer.categories_):
+                    table = {_category_key(category): offset + index for index, category in enumerate(categories)}
+                    onehot_blocks.append((column, slice(offset, offset + len(categories)), table,
+                                          transformer.handle_unknown))
+                    offset += len(categories)
+            elif isinstance(transformer, OrdinalEncoder):
+                unknown_value = transformer.unknown_value if transformer.handle_unknown == "use_encoded_value" else None
+                for index, (column, categories) in enumerate(zip(columns, transformer.categories_)):
+                    table = {_category_key(category): float(code) for code, category in enumerate(categories)}
+                    if None in table:
+                        table[None] = float(getattr(transformer, "encoded_missing_value", np.nan))
+                    ordinal_blocks.append((column, output_slice.start + index, table, unknown_value))
+            else:
+                steps = cls._compile_numeric_steps(transformer)
+                numeric_blocks.append((columns, output_slice, steps))
+
+        logging.info(f"Compiled FastFeatureEncoder with {n_features} output features")
+        return cls(n_features=n_features, numeric_blocks=numeric_blocks, onehot_blocks=onehot_blocks,
+                   ordinal_blocks=ordinal_blocks)
+
+    @staticmethod
+    def _apply_step(step: tuple, x: np.ndarray) -> np.ndarray:
+        kind = step[0]
+        if kind == "affine":
+            return (x - step[1]) / step[2]
+        lambdas = step[1]
+        out = np.zeros_like(x)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for i, lmbda in enumerate(lambdas):
+                value = x[i]
+                if kind == "box-cox":
+                    out[i] = np.log(value) if lmbda == 0 else (np.power(value, lmbda) - 1) / lmbda
+                elif value >= 0:
+                    if abs(lmbda) < np.spacing(1.0):
+                        out[i] = np.log1p(value)
+                    else:
+                        out[i] = (np.power(value + 1, lmbda) - 1) / lmbda
+                elif abs(lmbda - 2) > np.spacing(1.0):
+                    out[i] = -(np.power(-value + 1, 2 - lmbda) - 1) / (2 - lmbda)
+                else:
+                    out[i] = -np.log1p(-value)
+        return out
+
+    def encode(self, record: dict, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Method Name: encode
+        Description: Writes the transformed features of one raw record into out, a row of n_features floats.
+        Output: The encoded row
+        On Failure: Raise ValueError for categories the fitted encoders would reject
+        """
+        if out is None:
+            out = np.empty(self.n_features, dtype=np.float64)
+
+        for columns, output_slice, steps in self.numeric_blocks:
+            x = np.array([np.nan if record[column] is None else float(record[column]) for column in columns],
+                         dtype=np.float64)
+            for step in steps:
+                x = self._apply_step(step, x)
+            out[output_slice] = x
+
+        for column, output_slice, table, handle_unknown in self.onehot_blocks:
+            out[output_slice] = 0.0
+            index = table.get(_category_key(record[column]))
+            if index is not None:
+                out[index] = 1.0
+            elif handle_unknown == "error":
+                raise ValueError(f"Found unknown category {record[column]!r} in column {column}")
+
+        for column, index, table, unknown_value in self.ordinal_blocks:
+            code = table.get(_category_key(record[column]))
+            if code is None:
+                if unknown_value is None:
+                    raise ValueError(f"Found unknown category {record[column]!r} in column {column}")
+                code = unknown_value
+            out[index] = code
+
+        return out
+
+    def encode_many(self, records: List[dict]) -> np.ndarray:
+        """
+        Encodes a list of raw records into one preallocated (n_records, n_features) matrix
+        """
+        matrix = np.empty((len(records), self.n_features), dtype=np.float64)
+        for row, record in enumerate(records):
+            self.encode(record, out=matrix[row])
+        return matrix
+
+    def verify_parity(self, preprocessor: ColumnTransformer, dataframe: DataFrame, atol: float = 1e-9,
+                      expected: Optional[np.ndarray] = None) -> float:
+        """
+        Method Name: verify_parity
+        Description: Encodes every row of dataframe and compares it with preprocessor.transform, or with
+                     expected when the caller already transformed dataframe.
+        Output: Largest absolute difference found
+        On Failure: Raise USVisaException when the difference exceeds atol
+        """
+        try:
+            if expected is None:
+                expected = preprocessor.transform(dataframe)
+            if hasattr(expected, "toarray"):
+                expected = expected.toarray()
+            expected = np.asarray(expected, dtype=np.float64)
+            actual = self.encode_many(dataframe.to_dict("records"))
+
+            if expected.shape != actual.shape:
+                raise ValueError(f"FastFeatureEncoder shape {actual.shape} does not match {expected.shape}")
+            same_nan = np.isnan(expected) == np.isnan(actual)
+            if not same_nan.all():
+                raise ValueError("FastFeatureEncoder missing values do not match preprocessor.transform")
+            max_difference = float(np.nanmax(np.abs(expected - actual))) if expected.size else 0.0
+            if max_difference > atol:
+                raise ValueError(f"FastFeatureEncoder differs from preprocessor.transform by {max_difference}")
+
+            logging.info(f"FastFeatureEncoder matches preprocessor.transform on {len(dataframe)} rows, "
+                         f"max difference {max_difference}")
+            return max_difference
+        except Exception as e:
+            raise USVisaException(e, sys) from e
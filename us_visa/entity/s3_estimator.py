@@ -1,7 +1,9 @@
 from us_visa.cloud_storage.aws_storage import SimpleStorageService
+from us_visa.cloud_storage.model_cache import ModelCache
 from us_visa.exception import USVisaException
 from us_visa.entity.estimator import USvisaModel
 import sys
+from typing import Optional
 from pandas import DataFrame
 
 
@@ -10,14 +12,16 @@ class USvisaEstimator:
     This class is used to save and retrieve us_visas model in s3 bucket and to do prediction
     """
 
-    def __init__(self,bucket_name,model_path,):
+    def __init__(self,bucket_name,model_path,model_cache: Optional[ModelCache]=None):
         """
         :param bucket_name: Name of your model bucket
         :param model_path: Location of your model in bucket
+        :param model_cache: Process wide model cache, when None the model is downloaded by this instance
         """
         self.bucket_name = bucket_name
         self.s3 = SimpleStorageService()
         self.model_path = model_path
+        self.model_cache = model_cache
         self.loaded_model:USvisaModel=None
 
 
@@ -33,7 +37,8 @@ class USvisaEstimator:
         Load the model from the model_path
         :return:
         """
-
+        if self.model_cache is not None:
+            return self.model_cache.get_model(bucket_name=self.bucket_name, model_path=self.model_path)
         return self.s3.load_model(self.model_path,bucket_name=self.bucket_name)
 
     def save_model(self,from_file,remove:bool=False)->None:
@@ -49,18 +54,34 @@ class USvisaEstimator:
                                 bucket_name=self.bucket_name,
                                 remove=remove
                                 )
+            if self.model_cache is not None:
+                self.model_cache.invalidate(bucket_name=self.bucket_name, model_path=self.model_path)
         except Exception as e:
             raise USVisaException(e, sys)
 
 
-    def predict(self,dataframe:DataFrame):
+    def predict(self,dataframe:DataFrame,transform_cache=None):
         """
         :param dataframe:
+        :param transform_cache: TransformCache of the preprocessed features, they are recomputed when None
+        :return:
+        """
+        try:
+            # with a model cache the lookup is a dict hit and picks up models reloaded on ETag change
+            if self.loaded_model is None or self.model_cache is not None:
+                self.loaded_model = self.load_model()
+            return self.loaded_model.predict(dataframe=dataframe, transform_cache=transform_cache)
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def predict_record(self,record:dict):
+        """
+        :param record: raw feature values of one row
         :return:
         """
         try:
-            if self.loaded_model is None:
+            if self.loaded_model is None or self.model_cache is not None:
                 self.loaded_model = self.load_model()
-            return self.loaded_model.predict(dataframe=dataframe)
+            return self.loaded_model.predict_record(record=record)
         except Exception as e:
             raise USVisaException(e, sys)
@@ -1,4 +1,8 @@
 class USVisaException(Exception):
     def __init__(self, error_message, error_detail):
         super().__init__(error_message)
-        self.error_detail = error_detail
\ No newline at end of file
+        self.error_detail = error_detail
+
+    def __reduce__(self):
+        # error_detail is usually the sys module, which cannot be sent back from a worker process
+        return (self.__class__, (str(self), None))
@@ -0,0 +1,84 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from us_visa.logger import logging
+
+
+class ExecutorPool:
+    """
+    Class Name: ExecutorPool
+    Description: Runs blocking work of the async request handlers on a thread or process pool so the
+                 event loop keeps serving other requests. At most max_workers + max_queue_size jobs are
+                 handed to the pool, further callers wait on the event loop without blocking it.
+    On Failure: The exception of the job is raised to its caller
+    """
+
+    def __init__(self, name: str, executor: Executor, max_workers: int, max_queue_size: int):
+        """
+        :param name: Name of the pool in the reported stats
+        :param executor: Thread or process pool running the jobs
+        :param max_workers: Number of workers of the executor
+        :param max_queue_size: Number of jobs allowed to queue behind the busy workers
+        """
+        self.name = name
+        self.executor = executor
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight: int = 0
+        self.waiting: int = 0
+        self.completed: int = 0
+
+    @classmethod
+    def threads(cls, name: str, max_workers: int, max_queue_size: int) -> "ExecutorPool":
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        return cls(name=name, executor=executor, max_workers=max_workers, max_queue_size=max_queue_size)
+
+    @classmethod
+    def processes(cls, name: str, max_workers: int, max_queue_size: int) -> "ExecutorPool":
+        # spawn keeps the worker processes free of the threads and locks of the serving process
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return cls(name=name, executor=executor, max_workers=max_workers, max_queue_size=max_queue_size)
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """
+        Method Name: run
+        Description: Runs fn(*args, **kwargs) on the pool and waits for it without blocking the event loop.
+        Output: Return value of fn
+        On Failure: Raise the exception of fn
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_workers + self.max_queue_size)
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.semaphore.release()
+
+    def get_stats(self) -> dict:
+        """
+        Returns the queue depth of the pool, waiting counts callers held back by the bound
+        """
+        return {
+            "max_workers": self.max_workers,
+            "max_queue_size": self.max_queue_size,
+            "running": min(self.in_flight, self.max_workers),
+            "queued": max(self.in_flight - self.max_workers, 0),
+            "waiting": self.waiting,
+            "completed": self.completed,
+        }
+
+    def shutdown(self) -> None:
+        logging.info(f"Shutting down {self.name} executor pool")
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,118 @@
+import asyncio
+import sys
+from collections import Counter
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from us_visa.entity.config_entity import USvisaBatchingConfig
+from us_visa.exception import USVisaException
+from us_visa.logger import logging
+from us_visa.pipeline.executor_pool import ExecutorPool
+
+
+class MicroBatcher:
+    """
+    Class Name: MicroBatcher
+    Description: Collects concurrent prediction requests for up to max_batch_size rows or max_wait_ms
+                 milliseconds, scores them with one vectorized predict call and hands every caller
+                 back its own rows of the result.
+    On Failure: The exception of the batch is raised to every caller of that batch
+    """
+
+    def __init__(self, predict_fn: Callable[[DataFrame], np.ndarray],
+                 batching_config: USvisaBatchingConfig = USvisaBatchingConfig(),
+                 executor_pool: Optional[ExecutorPool] = None):
+        """
+        :param predict_fn: Vectorized predict function, e.g. USvisaClassifier.predict
+        :param batching_config: Batch size and wait time limits
+        :param executor_pool: Pool running predict_fn off the event loop, when None it runs inline
+        """
+        self.predict_fn = predict_fn
+        self.executor_pool = executor_pool
+        self.batching_config = batching_config
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.batch_size_counts: Counter = Counter()
+        self.total_batches: int = 0
+        self.total_rows: int = 0
+
+    def _ensure_worker(self) -> None:
+        # the queue and the task are bound to the running event loop, so they are created lazily
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.ensure_future(self._run())
+
+    async def predict(self, dataframe: DataFrame) -> np.ndarray:
+        """
+        Method Name: predict
+        Description: Queues the rows of dataframe for the next batch and waits for their predictions.
+        Output: Predictions of the rows of dataframe
+        On Failure: Raise Exception
+        """
+        self._ensure_worker()
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((dataframe, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[DataFrame, asyncio.Future]]:
+        loop = asyncio.get_event_loop()
+        items = [await self.queue.get()]
+        rows = len(items[0][0])
+        deadline = loop.time() + self.batching_config.max_wait_ms / 1000
+        while rows < self.batching_config.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+            items.append(item)
+            rows += len(item[0])
+        return items
+
+    async def _score(self, items: List[Tuple[DataFrame, asyncio.Future]]) -> None:
+        items = [(dataframe, future) for dataframe, future in items if not future.cancelled()]
+        if len(items) == 0:
+            return
+        try:
+            batch = pd.concat([dataframe for dataframe, _ in items], ignore_index=True)
+            if self.executor_pool is not None:
+                predictions = await self.executor_pool.run(self.predict_fn, batch)
+            else:
+                predictions = self.predict_fn(batch)
+            self.batch_size_counts[len(batch)] += 1
+            self.total_batches += 1
+            self.total_rows += len(batch)
+
+            offset = 0
+            for dataframe, future in items:
+                if not future.done():
+                    future.set_result(predictions[offset:offset + len(dataframe)])
+                offset += len(dataframe)
+        except Exception as e:
+            logging.info(f"Micro batch of {len(items)} requests failed: {e}")
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(USVisaException(e, sys))
+
+    async def _run(self) -> None:
+        while True:
+            items = await self._collect()
+            await self._score(items)
+
+    def get_stats(self) -> dict:
+        """
+        Returns the batch size histogram and the limits in use, to tune max_batch_size and max_wait_ms
+        """
+        return {
+            "max_batch_size": self.batching_config.max_batch_size,
+            "max_wait_ms": self.batching_config.max_wait_ms,
+            "total_batches": self.total_batches,
+            "total_rows": self.total_rows,
+            "mean_batch_size": self.total_rows / self.total_batches if self.total_batches else 0.0,
+            "batch_size_histogram": dict(sorted(self.batch_size_counts.items())),
+        }
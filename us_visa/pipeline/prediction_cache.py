@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from us_visa.logger import logging
+
+
+class PredictionCache:
+    """
+    Class Name: PredictionCache
+    Description: Bounded LRU cache of predictions keyed on the normalized tuple of the USvisaData fields.
+                 Numeric fields can be quantized to a step so close values share an entry. The whole cache
+                 is dropped when the ETag of the model it was filled with changes.
+    """
+
+    def __init__(self, feature_columns: list, numeric_columns: list, max_size: int, quantization: str = ""):
+        """
+        :param feature_columns: Fields of the record forming the key, in key order
+        :param numeric_columns: Fields normalized to floats and optionally quantized
+        :param max_size: Number of predictions kept before the least recently used is evicted
+        :param quantization: Steps of the numeric fields as "column=step,column=step", empty for exact keys
+        """
+        self.feature_columns = feature_columns
+        self.numeric_columns = set(numeric_columns)
+        self.max_size = max_size
+        self.quantization = self.parse_quantization(quantization)
+        self.entries: "OrderedDict[Tuple, object]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.model_etag: Optional[str] = None
+        self.hits: int = 0
+        self.misses: int = 0
+        self.invalidations: int = 0
+
+    @staticmethod
+    def parse_quantization(quantization: str) -> Dict[str, float]:
+        steps = {}
+        for item in quantization.split(","):
+            if item.strip():
+                column, step = item.split("=")
+                steps[column.strip()] = float(step)
+        return steps
+
+    def normalize_record(self, record: dict) -> dict:
+        """
+        Returns a copy of record with stripped strings for categories and floats for numbers rounded
+        to their quantization step, the record that is both keyed and predicted
+        """
+        normalized = dict(record)
+        for column in self.feature_columns:
+            value = record[column]
+            if column in self.numeric_columns:
+                value = float(value)
+                step = self.quantization.get(column)
+                if step:
+                    value = round(value / step) * step
+            elif isinstance(value, str):
+                value = value.strip()
+            normalized[column] = value
+        return normalized
+
+    def make_key(self, normalized_record: dict) -> Tuple[Hashable, ...]:
+        """
+        Returns the key of a record returned by normalize_record
+        """
+        return tuple(normalized_record[column] for column in self.feature_columns)
+
+    def _check_model(self, model_etag: Optional[str]) -> None:
+        if model_etag != self.model_etag:
+            if self.model_etag is not None:
+                logging.info(f"Model ETag changed from {self.model_etag} to {model_etag}, clearing prediction cache")
+                self.invalidations += 1
+            self.entries.clear()
+            self.model_etag = model_etag
+
+    def get_or_predict(self, record: dict, model_etag: Optional[str], predict_fn: Callable[[dict], object]):
+        """
+        Method Name: get_or_predict
+        Description: Returns the cached prediction of record, calling predict_fn and caching its result on a miss.
+                     predict_fn gets the normalized record, so a cached prediction is the prediction of its key.
+        Output: Prediction of the record
+        On Failure: The exception of predict_fn is raised and nothing is cached
+        """
+        record = self.normalize_record(record)
+        key = self.make_key(record)
+        with self.lock:
+            self._check_model(model_etag)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        prediction = predict_fn(record)
+
+        with self.lock:
+            if model_etag == self.model_etag:
+                self.entries[key] = prediction
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return prediction
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "max_size": self.max_size,
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "quantization": self.quantization,
+            "model_etag": self.model_etag,
+        }
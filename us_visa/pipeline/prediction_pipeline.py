@@ -1,17 +1,27 @@
+import gc
 import os
 import sys
 
 import numpy as np
 import pandas as pd
+from us_visa.cloud_storage.model_cache import ModelCache
 from us_visa.entity.config_entity import USvisaPredictorConfig
+from us_visa.entity.estimator import TargetValueMapping
 from us_visa.entity.s3_estimator import USvisaEstimator
 from us_visa.exception import USVisaException
 from us_visa.logger import logging
+from us_visa.pipeline.prediction_cache import PredictionCache
 from us_visa.utils.main_utils import read_yaml_file
 from pandas import DataFrame
+from typing import List, Optional
 
 
 class USvisaData:
+    numeric_columns = ["no_of_employees", "prevailing_wage", "company_age"]
+    feature_columns = ["continent", "education_of_employee", "has_job_experience", "requires_job_training",
+                       "no_of_employees", "region_of_employment", "prevailing_wage", "unit_of_wage",
+                       "full_time_position", "company_age"]
+
     def __init__(self,
                 continent,
                 education_of_employee,
@@ -57,6 +67,24 @@ class USvisaData:
             raise USVisaException(e, sys) from e
 
 
+    @staticmethod
+    def get_usvisa_batch_data_frame(records: List[dict]) -> DataFrame:
+        """
+        This function returns a single DataFrame holding every record of a batch,
+        so the whole batch is transformed and predicted in one vectorized call
+        """
+        try:
+            return DataFrame.from_records(records, columns=USvisaData.feature_columns)
+
+        except Exception as e:
+            raise USVisaException(e, sys) from e
+
+    def get_usvisa_data_as_record(self) -> dict:
+        """
+        This function returns the USvisaData class input as a flat record for the fast single row path
+        """
+        return {column: getattr(self, column) for column in USvisaData.feature_columns}
+
     def get_usvisa_data_as_dict(self):
         """
         This function returns a dictionary from USvisaData class input 
@@ -87,6 +115,8 @@ class USvisaData:
             raise USVisaException(e, sys) from e
 
 class USvisaClassifier:
+    prediction_cache: Optional[PredictionCache] = None
+
     def __init__(self,prediction_pipeline_config: USvisaPredictorConfig = USvisaPredictorConfig(),) -> None:
         """
         :param prediction_pipeline_config: Configuration for prediction the value
@@ -94,6 +124,33 @@ class USvisaClassifier:
         try:
             # self.schema_config = read_yaml_file(SCHEMA_FILE_PATH)
             self.prediction_pipeline_config = prediction_pipeline_config
+            self.model_cache = ModelCache(refresh_interval=prediction_pipeline_config.model_cache_refresh_interval)
+            if prediction_pipeline_config.prediction_cache_enabled and USvisaClassifier.prediction_cache is None:
+                USvisaClassifier.prediction_cache = PredictionCache(
+                    feature_columns=USvisaData.feature_columns,
+                    numeric_columns=USvisaData.numeric_columns,
+                    max_size=prediction_pipeline_config.prediction_cache_max_size,
+                    quantization=prediction_pipeline_config.prediction_cache_quantization)
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def preload(self) -> None:
+        """
+        This is the method of USvisaClassifier
+        Loads the model in the serving master before the workers are forked. The arrays of a model artifact
+        are memory mapped read only from the model file, so the workers share them through the page cache,
+        and the loaded objects are frozen out of the garbage collector, so the workers do not copy the pages
+        of their headers on write when it runs.
+        """
+        try:
+            model = self.model_cache.preload(bucket_name=self.prediction_pipeline_config.model_bucket_name,
+                                             model_path=self.prediction_pipeline_config.model_file_path)
+            # compiled here so the encoder tables are shared too instead of built in every worker
+            if hasattr(model, "get_fast_encoder"):
+                model.get_fast_encoder()
+            gc.collect()
+            gc.freeze()
+
         except Exception as e:
             raise USVisaException(e, sys)
 
@@ -107,10 +164,51 @@ class USvisaClassifier:
             model = USvisaEstimator(
                 bucket_name=self.prediction_pipeline_config.model_bucket_name,
                 model_path=self.prediction_pipeline_config.model_file_path,
+                model_cache=self.model_cache,
             )
             result =  model.predict(dataframe)
             
             return result
         
         except Exception as e:
-            raise USVisaException(e, sys)
\ No newline at end of file
+            raise USVisaException(e, sys)
+
+    def predict_record(self, record: dict):
+        """
+        This is the method of USvisaClassifier
+        Returns: Prediction of a single raw record, encoded without a DataFrame
+        """
+        try:
+            model = USvisaEstimator(
+                bucket_name=self.prediction_pipeline_config.model_bucket_name,
+                model_path=self.prediction_pipeline_config.model_file_path,
+                model_cache=self.model_cache,
+            )
+            if USvisaClassifier.prediction_cache is None:
+                return model.predict_record(record)
+
+            # loading first makes sure the ETag belongs to the model that fills the cache
+            model.load_model()
+            model_etag = self.model_cache.get_etag(bucket_name=model.bucket_name, model_path=model.model_path)
+            return USvisaClassifier.prediction_cache.get_or_predict(record, model_etag=model_etag,
+                                                                    predict_fn=model.predict_record)
+
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def predict_batch(self, dataframe: DataFrame) -> List[str]:
+        """
+        This is the method of USvisaClassifier
+        Returns: Prediction of every row of the dataframe mapped back to its case_status label
+        """
+        try:
+            logging.info(f"Entered predict_batch method of USvisaClassifier class with {len(dataframe)} rows")
+            if len(dataframe) == 0:
+                return []
+            predictions = self.predict(dataframe)
+            reverse_mapping = TargetValueMapping().reverse_mapping()
+
+            return [reverse_mapping[int(value)] for value in predictions]
+
+        except Exception as e:
+            raise USVisaException(e, sys)
@@ -0,0 +1,236 @@
+import ast
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+from dataclasses import fields, is_dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Type
+
+try:
+    from importlib.metadata import PackageNotFoundError, version
+except ImportError:  # pragma: no cover
+    PackageNotFoundError, version = Exception, None
+
+from us_visa.exception import USVisaException
+from us_visa.logger import logging
+from us_visa.utils.main_utils import read_yaml_file, write_yaml_file
+
+
+def _file_digest(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file_obj:
+        for block in iter(lambda: file_obj.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _package_version() -> Optional[str]:
+    try:
+        return version("us_visa") if version is not None else None
+    except PackageNotFoundError:
+        return None
+
+
+def _module_file(module_name: str) -> Optional[str]:
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        return None
+    return spec.origin if spec is not None and spec.origin and spec.origin.endswith(".py") else None
+
+
+def _imported_modules(module_name: str, file_path: str) -> List[str]:
+    # the modules and the submodules named by the import statements of a source file
+    with open(file_path, "rb") as file_obj:
+        tree = ast.parse(file_obj.read(), filename=file_path)
+    is_package = os.path.basename(file_path) == "__init__.py"
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                parent = module_name.split(".")
+                parent = parent[:len(parent) - node.level + (1 if is_package else 0)]
+                base = ".".join(parent + ([base] if base else []))
+            names.append(base)
+            names.extend(f"{base}.{alias.name}" for alias in node.names if alias.name != "*")
+    return names
+
+
+@lru_cache(maxsize=None)
+def code_fingerprint(module_name: str) -> dict:
+    """
+    Returns the version of the us_visa package and the digest of the source of module_name and of every
+    us_visa module it imports, directly or through the modules it imports, so editing any of them changes
+    the fingerprint
+    """
+    package = module_name.split(".")[0]
+    sources, pending = {}, [module_name]
+    while pending:
+        name = pending.pop()
+        if name in sources or not (name == package or name.startswith(f"{package}.")):
+            continue
+        file_path = _module_file(name)
+        if file_path is None:
+            continue
+        sources[name] = _file_digest(file_path)
+        pending.extend(_imported_modules(name, file_path))
+    return {"version": _package_version(), "sources": dict(sorted(sources.items()))}
+
+
+def config_fingerprint(config, artifact_dir: str) -> dict:
+    """
+    Returns the fields of a stage config with artifact_dir cut off the paths under it, so two runs with the
+    same settings get the same fingerprint whatever their artifact dir
+    """
+    fingerprint = {}
+    for config_field in fields(config):
+        value = getattr(config, config_field.name)
+        if isinstance(value, str) and value.startswith(artifact_dir):
+            value = os.path.relpath(value, artifact_dir)
+        fingerprint[config_field.name] = value
+    return fingerprint
+
+
+class StageCache:
+    """
+    Class Name: StageCache
+    Description: Content addressed cache of the artifacts of the training pipeline stages. The key of a stage
+                 hashes the keys of the stages it depends on, the files it reads (schema.yaml, model.yaml), its
+                 config and the fingerprint of its code, so a stage is recomputed after its code changes. An entry records the artifact of the run that computed it and is a hit as long as
+                 the files of that artifact still exist. Entries are only committed once the files of the
+                 run are on disk.
+    """
+
+    def __init__(self, cache_dir: str, enabled: bool = True, force: bool = False):
+        """
+        :param cache_dir: Directory of the cache entries
+        :param enabled: False never looks up nor records entries
+        :param force: True recomputes every stage and replaces its entry
+        """
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.force = force
+        self.pending: List[tuple] = []
+        self.report: Dict[str, dict] = {}
+
+    @staticmethod
+    def make_key(stage: str, parent_keys: List[Optional[str]], file_paths: List[str], config: dict,
+                 code: Optional[dict] = None) -> Optional[str]:
+        """
+        Returns the key of a stage, None when one of its parents has no key. code is the code_fingerprint
+        of the module running the stage.
+        """
+        if any(parent_key is None for parent_key in parent_keys):
+            return None
+        content = {
+            "stage": stage,
+            "parents": parent_keys,
+            "files": {file_path: _file_digest(file_path) for file_path in file_paths},
+            "config": config,
+            "code": code,
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, stage: str, key: str) -> str:
+        return os.path.join(self.cache_dir, stage, f"{key}.yaml")
+
+    @staticmethod
+    def _to_dict(artifact) -> dict:
+        # the in memory fields (repr=False) are not part of the entry
+        content = {}
+        for artifact_field in fields(artifact):
+            if artifact_field.repr:
+                value = getattr(artifact, artifact_field.name)
+                if is_dataclass(value):
+                    value = StageCache._to_dict(value)
+                elif hasattr(value, "item"):
+                    # numpy scalars, e.g. the scores of the metric artifact
+                    value = value.item()
+                content[artifact_field.name] = value
+        return content
+
+    @staticmethod
+    def _from_dict(artifact_cls: Type, content: dict):
+        values = {}
+        for artifact_field in fields(artifact_cls):
+            if artifact_field.name in content:
+                value = content[artifact_field.name]
+                if is_dataclass(artifact_field.type) and isinstance(value, dict):
+                    value = StageCache._from_dict(artifact_field.type, value)
+                values[artifact_field.name] = value
+        return artifact_cls(**values)
+
+    @staticmethod
+    def _files_exist(content: dict) -> bool:
+        for name, value in content.items():
+            if isinstance(value, dict) and not StageCache._files_exist(value):
+                return False
+            if name.endswith("_path") and isinstance(value, str) and not os.path.exists(value):
+                return False
+        return True
+
+    def get(self, stage: str, key: Optional[str], artifact_cls: Type):
+        """
+        Method Name: get
+        Description: Looks up the artifact of stage for key and records the outcome in the report.
+        Output: The cached artifact, None on a miss
+        On Failure: Raise Exception
+        """
+        try:
+            if not self.enabled:
+                return None
+            if key is None:
+                self.report[stage] = {"status": "uncacheable"}
+                return None
+            if self.force:
+                self.report[stage] = {"status": "forced", "key": key}
+                return None
+            entry_path = self._entry_path(stage, key)
+            if os.path.exists(entry_path):
+                entry = read_yaml_file(entry_path)
+                if self._files_exist(entry["artifact"]):
+                    self.report[stage] = {"status": "hit", "key": key, "reused_from": entry["artifact_dir"]}
+                    logging.info(f"Stage cache hit for {stage}, reusing the artifact of {entry['artifact_dir']}")
+                    return self._from_dict(artifact_cls, entry["artifact"])
+                logging.info(f"Stage cache entry of {stage} points to deleted files, recomputing")
+            self.report[stage] = {"status": "miss", "key": key}
+            return None
+        except Exception as e:
+            raise USVisaException(e, sys) from e
+
+    def put(self, stage: str, key: Optional[str], artifact, artifact_dir: str) -> None:
+        """
+        Records the artifact computed for key, written to the cache by commit
+        """
+        if self.enabled and key is not None and artifact is not None:
+            self.pending.append((stage, key, artifact, artifact_dir))
+
+    def commit(self) -> None:
+        """
+        Method Name: commit
+        Description: Writes the entries recorded by put, must only be called once their files are on disk.
+        Output: None
+        On Failure: Raise Exception
+        """
+        try:
+            pending, self.pending = self.pending, []
+            for stage, key, artifact, artifact_dir in pending:
+                entry_path = self._entry_path(stage, key)
+                os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+                # replaced in one step so a concurrent run never reads a half written entry
+                tmp_file_path = f"{entry_path}.{os.getpid()}.tmp"
+                write_yaml_file(tmp_file_path, {"stage": stage, "key": key, "artifact_dir": artifact_dir,
+                                                "artifact": self._to_dict(artifact)})
+                os.replace(tmp_file_path, entry_path)
+        except Exception as e:
+            raise USVisaException(e, sys) from e
+
+    def write_report(self, file_path: str) -> None:
+        if self.report:
+            write_yaml_file(file_path, self.report, replace=True)
+            logging.info(f"Stage cache report: { {stage: info['status'] for stage, info in self.report.items()} }")
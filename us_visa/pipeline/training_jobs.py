@@ -0,0 +1,184 @@
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from us_visa.constants import TRAINING_JOB_DIR, TRAINING_JOB_LOCK_FILE_NAME, TRAINING_JOB_NICENESS, ARTIFACT_DIR
+from us_visa.entity.config_entity import TrainingPipelineConfig
+from us_visa.exception import USVisaException
+from us_visa.logger import logging
+from us_visa.pipeline.executor_pool import ExecutorPool
+from us_visa.utils.main_utils import read_yaml_file, write_yaml_file
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - windows has no flock, single flight then only holds per process
+    fcntl = None
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class TrainingJobStatus:
+    """
+    Class Name: TrainingJobStatus
+    Description: Status of one training job kept in a yaml file under TRAINING_JOB_DIR, so the serving
+                 process and the training worker process can both read and update it.
+    """
+
+    def __init__(self, job_id: str, job_dir: str = TRAINING_JOB_DIR):
+        """
+        :param job_id: Id of the training job
+        :param job_dir: Directory of the status files
+        """
+        self.job_id = job_id
+        self.file_path = os.path.join(job_dir, f"{job_id}.yaml")
+
+    def read(self) -> Optional[dict]:
+        if not os.path.exists(self.file_path):
+            return None
+        return read_yaml_file(self.file_path)
+
+    def write(self, status: dict) -> None:
+        # written to a temporary file first so readers never see a half written status
+        tmp_file_path = f"{self.file_path}.tmp"
+        write_yaml_file(tmp_file_path, status)
+        os.replace(tmp_file_path, self.file_path)
+
+    def update(self, **changes) -> dict:
+        status = self.read() or {"job_id": self.job_id, "stages": {}}
+        status.update(changes)
+        self.write(status)
+        return status
+
+    def update_stage(self, stage: str, stage_status: str) -> None:
+        status = self.read() or {"job_id": self.job_id, "stages": {}}
+        stage_info = status["stages"].setdefault(stage, {})
+        stage_info["status"] = stage_status
+        if stage_status == "running":
+            stage_info["started_at"] = _now()
+        else:
+            stage_info["finished_at"] = _now()
+        status["current_stage"] = stage
+        self.write(status)
+
+
+def run_training_job(job_id: str, job_dir: str = TRAINING_JOB_DIR) -> None:
+    """
+    Method Name: run_training_job
+    Description: Runs one training pipeline for job_id in a worker process. The pipeline writes into its
+                 own artifact dir and reports every stage to the status file of the job. A file lock makes
+                 the jobs of all serving workers sharing job_dir run one after the other.
+    Output: None
+    On Failure: The job is marked failed and the exception is raised
+    """
+    from us_visa.pipeline.training_pipeline import TrainingPipeline
+
+    job_status = TrainingJobStatus(job_id, job_dir=job_dir)
+    os.makedirs(job_dir, exist_ok=True)
+    # training is batch work, give the cpu to the serving workers first. The worker process is reused
+    # across jobs, so the niceness is set absolutely instead of added to on every job
+    if TRAINING_JOB_NICENESS and hasattr(os, "setpriority"):
+        if os.getpriority(os.PRIO_PROCESS, 0) < TRAINING_JOB_NICENESS:
+            os.setpriority(os.PRIO_PROCESS, 0, TRAINING_JOB_NICENESS)
+
+    with open(os.path.join(job_dir, TRAINING_JOB_LOCK_FILE_NAME), "a") as lock_file:
+        try:
+            if fcntl is not None:
+                job_status.update(status="waiting_for_lock")
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+
+            timestamp = datetime.now().strftime('%m_%d_%Y_%H_%M_%S')
+            training_pipeline_config = TrainingPipelineConfig(
+                artifact_dir=os.path.join(ARTIFACT_DIR, f"{timestamp}_{job_id[:8]}"), timestamp=timestamp)
+            job_status.update(status="running", started_at=_now(),
+                              artifact_dir=training_pipeline_config.artifact_dir)
+            logging.info(f"Training job {job_id} started in {training_pipeline_config.artifact_dir}")
+
+            training_pipeline = TrainingPipeline(training_pipeline_config=training_pipeline_config,
+                                                 stage_listener=job_status.update_stage)
+            training_pipeline.run_pipeline()
+
+            job_status.update(status="completed", finished_at=_now())
+            logging.info(f"Training job {job_id} completed")
+        except Exception as e:
+            status = job_status.read() or {}
+            current_stage = status.get("current_stage")
+            if current_stage and status["stages"][current_stage].get("status") == "running":
+                job_status.update_stage(current_stage, "failed")
+            job_status.update(status="failed", finished_at=_now(), error=str(e))
+            logging.info(f"Training job {job_id} failed: {e}")
+            raise USVisaException(e, sys) from e
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class TrainingJobRunner:
+    """
+    Class Name: TrainingJobRunner
+    Description: Schedules training jobs on a process pool and returns their ids right away. Only one job
+                 runs at a time, one more is kept pending and further submissions are coalesced into the
+                 pending job, since it will train on the same data anyway.
+    On Failure: Failures of a job are recorded in its status, the runner keeps serving submissions
+    """
+
+    def __init__(self, executor_pool: ExecutorPool, job_dir: str = TRAINING_JOB_DIR):
+        """
+        :param executor_pool: Process pool running the training jobs
+        :param job_dir: Directory of the job status files and of the cross process lock
+        """
+        self.executor_pool = executor_pool
+        self.job_dir = job_dir
+        self.running_job_id: Optional[str] = None
+        self.pending_job_id: Optional[str] = None
+        self.worker: Optional[asyncio.Task] = None
+
+    def _new_job(self) -> str:
+        job_id = uuid.uuid4().hex
+        TrainingJobStatus(job_id, job_dir=self.job_dir).write(
+            {"job_id": job_id, "status": "queued", "submitted_at": _now(), "stages": {}})
+        return job_id
+
+    def submit(self) -> dict:
+        """
+        Method Name: submit
+        Description: Queues a training job unless one is already pending, must be called on the event loop.
+        Output: Id of the job that will run the training and whether the request was coalesced into it
+        On Failure: Raise Exception
+        """
+        try:
+            if self.running_job_id is None:
+                self.running_job_id = self._new_job()
+                self.worker = asyncio.ensure_future(self._run())
+                return {"job_id": self.running_job_id, "coalesced": False}
+            if self.pending_job_id is None:
+                self.pending_job_id = self._new_job()
+                return {"job_id": self.pending_job_id, "coalesced": False}
+            logging.info(f"Training job {self.pending_job_id} is already pending, coalescing the request")
+            return {"job_id": self.pending_job_id, "coalesced": True}
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    async def _run(self) -> None:
+        while self.running_job_id is not None:
+            job_id = self.running_job_id
+            try:
+                await self.executor_pool.run(run_training_job, job_id, self.job_dir)
+            except Exception as e:
+                job_status = TrainingJobStatus(job_id, job_dir=self.job_dir)
+                # the worker process may have died before it could record the failure
+                if (job_status.read() or {}).get("status") not in ("failed", "completed"):
+                    job_status.update(status="failed", finished_at=_now(), error=str(e))
+            self.running_job_id, self.pending_job_id = self.pending_job_id, None
+
+    def get_status(self, job_id: str) -> Optional[dict]:
+        """
+        Returns the status of job_id with its stages, None for unknown jobs
+        """
+        if not job_id.isalnum():
+            return None
+        return TrainingJobStatus(job_id, job_dir=self.job_dir).read()
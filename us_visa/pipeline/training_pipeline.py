@@ -1,4 +1,6 @@
+import os
 import sys
+from typing import Callable, List, Optional
 
 from us_visa.exception import USVisaException
 from us_visa.logger import logging
@@ -12,12 +14,15 @@ from us_visa.components.model_trainer import ModelTrainer
 from us_visa.components.model_evaluation import ModelEvaluation
 from us_visa.components.model_pusher import ModelPusher
 
-from us_visa.entity.config_entity import (DataIngestionConfig,
+from us_visa.entity.config_entity import (TrainingPipelineConfig,
+                                          DataIngestionConfig,
                                           DataValidationConfig,
                                           DataTransformationConfig,
                                           ModelTrainerConfig, 
                                           ModelEvaluationConfig,
-                                          ModelPusherConfig)
+                                          ModelPusherConfig,
+                                          trainingpipelineconfig,
+                                          with_artifact_dir)
 
 from us_visa.entity.artifact_entity import (DataIngestionArtifact,
                                             DataValidationArtifact,
@@ -25,6 +30,19 @@ from us_visa.entity.artifact_entity import (DataIngestionArtifact,
                                             ModelTrainerArtifact, 
                                             ModelEvaluationArtifact,
                                             ModelPusherArtifact)
+from us_visa.constants import SCHEMA_FILE_PATH, TRAINING_PIPELINE_STAGE_CACHE_REPORT_FILE_NAME
+from us_visa.data_access.usvisa_data import USVisaData
+from us_visa.pipeline.stage_cache import StageCache, code_fingerprint, config_fingerprint
+from us_visa.utils.artifact_writer import ArtifactWriter
+from us_visa.utils.transform_cache import TransformCache
+
+# the component running each cached stage, the stage key hashes its code
+STAGE_COMPONENTS = {
+    "data_ingestion": DataIngestion,
+    "data_validation": DataValidation,
+    "data_transformation": DataTransformation,
+    "model_trainer": ModelTrainer,
+}
 
 
 
@@ -38,19 +56,34 @@ class TrainingPipeline:
     On Failure: Raise Exception
     """
 
-    def __init__(self):
+    def __init__(self, training_pipeline_config: TrainingPipelineConfig = trainingpipelineconfig,
+                 stage_listener: Optional[Callable[[str, str], None]] = None, force: bool = False):
         """
         Method Name: __init__
         Description: This method initializes the TrainingPipeline object.
+                     training_pipeline_config gives every run its own artifact dir,
+                     stage_listener(stage, status) is called when a stage starts and ends,
+                     force recomputes the stages found in the stage cache.
         Output: None
         On Failure: Raise Exception
         """
-        self.data_ingestion_config = DataIngestionConfig()
-        self.data_validation_config = DataValidationConfig()
-        self.data_transformation_config = DataTransformationConfig()  
-        self.model_trainer_config = ModelTrainerConfig()
+        artifact_dir = training_pipeline_config.artifact_dir
+        self.training_pipeline_config = training_pipeline_config
+        self.stage_listener = stage_listener
+        self.data_ingestion_config = with_artifact_dir(DataIngestionConfig(), artifact_dir)
+        self.data_validation_config = with_artifact_dir(DataValidationConfig(), artifact_dir)
+        self.data_transformation_config = with_artifact_dir(DataTransformationConfig(), artifact_dir)
+        self.model_trainer_config = with_artifact_dir(ModelTrainerConfig(), artifact_dir)
         self.model_evaluation_config = ModelEvaluationConfig()
         self.model_pusher_config = ModelPusherConfig()
+        # set by run_pipeline when the stages hand their data over in memory
+        self.artifact_writer: Optional[ArtifactWriter] = None
+        self.stage_cache = StageCache(cache_dir=training_pipeline_config.stage_cache_dir,
+                                      enabled=training_pipeline_config.stage_cache, force=force)
+        self.transform_cache = TransformCache(cache_dir=training_pipeline_config.transform_cache_dir,
+                                              max_bytes=training_pipeline_config.transform_cache_max_bytes,
+                                              disk_max_bytes=training_pipeline_config.transform_cache_disk_max_bytes,
+                                              enabled=training_pipeline_config.transform_cache)
         
 
     def start_data_ingestion(self) -> DataIngestionArtifact:
@@ -63,7 +96,8 @@ class TrainingPipeline:
         try:
             logging.info("Starting data ingestion component of training pipeline")
             logging.info("Getting the data from MongoDB")
-            data_ingestion = DataIngestion(data_ingestion_config =self.data_ingestion_config)
+            data_ingestion = DataIngestion(data_ingestion_config =self.data_ingestion_config,
+                                           artifact_writer=self.artifact_writer)
             data_ingestion_artifact = data_ingestion.initiate_data_ingestion()
             logging.info("Got the train_set and test_set from MongoDB data")
             logging.info("Exited  data ingestion component of training pipeline")
@@ -96,7 +130,9 @@ class TrainingPipeline:
             logging.info("Starting data transformation component of training pipeline")
             data_transformation = DataTransformation(data_transformation_config=self.data_transformation_config,
                                                      data_ingestion_artifact=data_ingestion_artifact,
-                                                     data_validation_artifact=data_validation_artifact)
+                                                     data_validation_artifact=data_validation_artifact,
+                                                     artifact_writer=self.artifact_writer,
+                                                     transform_cache=self.transform_cache)
             data_transformation_artifact = data_transformation.initiate_data_transformation()
             logging.info("Data transformation completed")
             logging.info("Exited data transformation component of training pipeline")
@@ -124,7 +160,8 @@ class TrainingPipeline:
         try:
             model_evaluation = ModelEvaluation(model_eval_config=self.model_evaluation_config,
                                                 data_ingestion_artifact=data_ingestion_artifact,
-                                                model_trainer_artifact=model_trainer_artifact)
+                                                model_trainer_artifact=model_trainer_artifact,
+                                                transform_cache=self.transform_cache)
             model_evaluation_artifact = model_evaluation.initiate_model_evaluation()
             return model_evaluation_artifact
         except Exception as e:
@@ -150,31 +187,120 @@ class TrainingPipeline:
         except Exception as e:
             raise USVisaException(e, sys)
     
+    def report_stage(self, stage: str, status: str) -> None:
+        if self.stage_listener is not None:
+            self.stage_listener(stage, status)
+
+    def get_stage_key(self, stage: str, config, parent_keys: List[Optional[str]], file_paths: List[str],
+                      **inputs) -> Optional[str]:
+        """
+        Returns the stage cache key of a stage from the keys of the stages it depends on, the files it reads,
+        its config, the source of its component and further inputs, None when the stage cache is disabled
+        """
+        if not self.stage_cache.enabled:
+            return None
+        stage_config = config_fingerprint(config, self.training_pipeline_config.artifact_dir)
+        code = code_fingerprint(STAGE_COMPONENTS[stage].__module__)
+        return self.stage_cache.make_key(stage, parent_keys, file_paths, {"config": stage_config, **inputs},
+                                         code=code)
+
+    def get_data_ingestion_key(self) -> Optional[str]:
+        if not self.stage_cache.enabled:
+            return None
+        try:
+            collection_fingerprint = USVisaData().get_collection_fingerprint(
+                self.data_ingestion_config.collection_name)
+        except Exception as e:
+            logging.info(f"Could not fingerprint the collection, data ingestion is not cached: {e}")
+            return None
+        return self.get_stage_key("data_ingestion", self.data_ingestion_config, [], [SCHEMA_FILE_PATH],
+                                  collection=collection_fingerprint)
+
+    def run_stage(self, stage: str, key: Optional[str], artifact_cls, start_stage: Callable, **kwargs):
+        """
+        Method Name: run_stage
+        Description: Returns the cached artifact of stage for key, or runs start_stage(**kwargs) and records
+                     its artifact in the stage cache.
+        Output: The artifact of the stage
+        On Failure: Raise Exception
+        """
+        self.report_stage(stage, "running")
+        artifact = self.stage_cache.get(stage, key, artifact_cls)
+        if artifact is not None:
+            self.report_stage(stage, "cached")
+            return artifact
+        artifact = start_stage(**kwargs)
+        self.stage_cache.put(stage, key, artifact, artifact_dir=self.training_pipeline_config.artifact_dir)
+        self.report_stage(stage, "completed")
+        return artifact
+
     def run_pipeline(self) -> None:
         """
         Method Name: run_pipeline
-        Description: This method runs the training pipeline.
+        Description: This method runs the training pipeline. With in_memory_handoff the stages pass their
+                     DataFrames and arrays on in memory and the artifact files are written in the background,
+                     the run only ends once they are all on disk. Ingestion, validation, transformation and
+                     training are looked up in the stage cache first, which stages were hits is written to
+                     the stage cache report of the run. The transformation, training and evaluation
+                     stages share a transform cache, so the same fitted transform of the same data is
+                     computed once.
         Output: None
         On Failure: Raise Exception
         """
+        if self.training_pipeline_config.in_memory_handoff:
+            self.artifact_writer = ArtifactWriter(asynchronous=True,
+                                                  threads=self.training_pipeline_config.artifact_writer_threads)
         try:
             logging.info(f"{'='*20} Training Pipeline Started {'='*20}")
-            data_ingestion_artifact = self.start_data_ingestion()
+            data_ingestion_key = self.get_data_ingestion_key()
+            data_ingestion_artifact = self.run_stage("data_ingestion", data_ingestion_key, DataIngestionArtifact,
+                                                     self.start_data_ingestion)
             
-            data_validation_artifact = self.start_data_validation(data_ingestion_artifact=data_ingestion_artifact)
+            data_validation_key = self.get_stage_key("data_validation", self.data_validation_config,
+                                                     [data_ingestion_key], [SCHEMA_FILE_PATH])
+            data_validation_artifact = self.run_stage("data_validation", data_validation_key, DataValidationArtifact,
+                                                      self.start_data_validation,
+                                                      data_ingestion_artifact=data_ingestion_artifact)
       
-            data_transformation_artifact = self.start_data_transformation(
-                                                            data_validation_artifact=data_validation_artifact,
-                                                            data_ingestion_artifact=data_ingestion_artifact)
-            model_trainer_artifact = self.start_model_trainer(data_transformation_artifact=data_transformation_artifact)
+            data_transformation_key = self.get_stage_key("data_transformation", self.data_transformation_config,
+                                                         [data_ingestion_key, data_validation_key],
+                                                         [SCHEMA_FILE_PATH])
+            data_transformation_artifact = self.run_stage("data_transformation", data_transformation_key,
+                                                          DataTransformationArtifact,
+                                                          self.start_data_transformation,
+                                                          data_validation_artifact=data_validation_artifact,
+                                                          data_ingestion_artifact=data_ingestion_artifact)
+
+            model_trainer_key = self.get_stage_key("model_trainer", self.model_trainer_config,
+                                                   [data_transformation_key],
+                                                   [self.model_trainer_config.model_config_file_path])
+            model_trainer_artifact = self.run_stage("model_trainer", model_trainer_key, ModelTrainerArtifact,
+                                                    self.start_model_trainer,
+                                                    data_transformation_artifact=data_transformation_artifact)
+
+            self.report_stage("model_evaluation", "running")
             model_evaluation_artifact = self.start_model_evaluation(model_trainer_artifact=model_trainer_artifact,
                                                                    data_ingestion_artifact=data_ingestion_artifact)
+            self.report_stage("model_evaluation", "completed")
             if not model_evaluation_artifact.is_model_accepted:
                 logging.info("Trained model is not better than the best model present in s3 hence not pushing the model to s3")
+                self.report_stage("model_pusher", "skipped")
 
                 return None
             
+            self.report_stage("model_pusher", "running")
             model_pusher_artifact = self.start_model_pusher(model_evaluation_artifact=model_evaluation_artifact)
+            self.report_stage("model_pusher", "completed")
             logging.info(f"{'='*20} Training Pipeline Completed {'='*20}")
         except Exception as e:
-            raise USVisaException(e, sys)
\ No newline at end of file
+            raise USVisaException(e, sys)
+        finally:
+            if self.artifact_writer is not None:
+                artifact_writer, self.artifact_writer = self.artifact_writer, None
+                artifact_writer.close()
+            # the stages that completed are cached even when a later stage failed
+            self.stage_cache.commit()
+            self.stage_cache.write_report(os.path.join(self.training_pipeline_config.artifact_dir,
+                                                       TRAINING_PIPELINE_STAGE_CACHE_REPORT_FILE_NAME))
+            self.transform_cache.log_stats()
+
@@ -0,0 +1,64 @@
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from us_visa.exception import USVisaException
+from us_visa.logger import logging
+
+
+class ArtifactWriter:
+    """
+    Class Name: ArtifactWriter
+    Description: Writes the artifact files of the training pipeline. Asynchronous writers run the writes on
+                 background threads so the next stage can start on the in memory copy right away, flush waits
+                 for them. Synchronous writers, the default of the components, write before returning.
+    On Failure: flush raises the first failed write
+    """
+
+    def __init__(self, asynchronous: bool = False, threads: int = 2):
+        """
+        :param asynchronous: Whether write returns before the file is written
+        :param threads: Number of background writer threads
+        """
+        self.asynchronous = asynchronous
+        self.executor: Optional[ThreadPoolExecutor] = None
+        if asynchronous:
+            self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="artifact-writer")
+        self.pending: List[Future] = []
+
+    def write(self, write_fn: Callable, *args, **kwargs) -> None:
+        """
+        Calls write_fn(*args, **kwargs) now or on a background thread, the objects passed must not be
+        modified afterwards
+        """
+        if self.executor is None:
+            write_fn(*args, **kwargs)
+        else:
+            self.pending.append(self.executor.submit(write_fn, *args, **kwargs))
+
+    def flush(self) -> None:
+        """
+        Method Name: flush
+        Description: Waits until every write submitted so far is on disk.
+        Output: None
+        On Failure: Raise Exception of the first failed write, after waiting for all of them
+        """
+        pending, self.pending = self.pending, []
+        error = None
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                error = error or e
+        if pending:
+            logging.info(f"Flushed {len(pending)} artifact writes")
+        if error is not None:
+            raise USVisaException(error, sys) from error
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
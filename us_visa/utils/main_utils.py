@@ -3,10 +3,15 @@ import sys
 
 import dill
 import yaml
+import pandas as pd
 from pandas import DataFrame    
+from typing import Iterator, List, Optional
 import numpy as np
+from us_visa.constants import TARGET_COLUMN
 from us_visa.exception import USVisaException
-import us_visa.logger as logging
+from us_visa.logger import logging
+from us_visa.utils.model_artifact import (MODEL_ARTIFACT_MAGIC, dump_model_artifact, is_model_artifact,
+                                          load_model_artifact)
 
 
 def read_yaml_file(file_path: str) -> dict:
@@ -45,7 +50,8 @@ def write_yaml_file(file_path: str, content: object, replace: bool = False) -> N
 
 def save_object(file_path: str, obj: object) -> None:
     """
-    Saves a Python object to a file using dill.
+    Saves a Python object to a file as a model artifact: large numpy arrays are stored as
+    memory mappable segments and the rest of the object is pickled with dill.
 
     Args:
         file_path (str): The path to the file where the object will be saved.
@@ -53,23 +59,31 @@ def save_object(file_path: str, obj: object) -> None:
     """
     try:
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, 'wb') as file_obj:
-            dill.dump(obj, file_obj)
+        # replaced rather than overwritten in place, processes mapping the old file keep a valid mapping
+        tmp_file_path = f"{file_path}.tmp"
+        with open(tmp_file_path, 'wb') as file_obj:
+            dump_model_artifact(obj, file_obj)
+        os.replace(tmp_file_path, file_path)
     except Exception as e:
         raise USVisaException(e, sys)
-def load_object(file_path: str) -> object:
+def load_object(file_path: str, mmap_mode: str = "r") -> object:
     """
-    Loads a Python object from a file using dill.
+    Loads a Python object from a model artifact, or from a dill pickle written before the
+    model artifact format.
 
     Args:
         file_path (str): The path to the file from which the object will be loaded.
+        mmap_mode (str): Mode the array segments of a model artifact are memory mapped with.
 
     Returns:
         object: The loaded Python object.
     """
     try:
         with open(file_path, 'rb') as file_obj:
-            return dill.load(file_obj)
+            if not is_model_artifact(file_obj.read(len(MODEL_ARTIFACT_MAGIC))):
+                file_obj.seek(0)
+                return dill.load(file_obj)
+        return load_model_artifact(file_path, mmap_mode=mmap_mode)
     except Exception as e:
         raise USVisaException(e, sys)
 def save_numpy_array_data(file_path: str, array: np.ndarray) -> None:
@@ -86,17 +100,20 @@ def save_numpy_array_data(file_path: str, array: np.ndarray) -> None:
             np.save(file_obj, array)
     except Exception as e:
         raise USVisaException(e, sys)
-def load_numpy_array_data(file_path: str) -> np.ndarray:
+def load_numpy_array_data(file_path: str, mmap_mode: Optional[str] = None) -> np.ndarray:
     """
     Loads a numpy array from a file.
 
     Args:
         file_path (str): The path to the file from which the array will be loaded.
+        mmap_mode (str): "r" maps the file instead of reading it, rows are then paged in when accessed.
 
     Returns:
         np.ndarray: The loaded numpy array.
     """
     try:
+        if mmap_mode is not None:
+            return np.load(file_path, mmap_mode=mmap_mode)
         with open(file_path, 'rb') as file_obj:
             return np.load(file_obj)
     except Exception as e:
@@ -115,6 +132,318 @@ def drop_columns(dataframe: DataFrame, columns: list) -> DataFrame:
     try:
         return dataframe.drop(columns=columns, axis=1)
     except Exception as e:
-        raise USVisaException(e, sys)   
+        raise USVisaException(e, sys)
+
+
+def get_source_columns(schema_info: dict) -> List[str]:
+    """
+    Returns the raw data columns the model is built from: the columns of the transformers in the schema,
+    yr_of_estab in place of the derived company_age, and the target column.
+
+    Args:
+        schema_info (dict): The content of config/schema.yaml.
+
+    Returns:
+        list: The columns, in the order of the schema.
+    """
+    feature_columns = set(schema_info['num_columns'] + schema_info['oh_columns'] +
+                          schema_info['or_columns'] + schema_info['transform_columns'])
+    if 'company_age' in feature_columns:
+        feature_columns.add('yr_of_estab')
+    return [column for column in schema_info['columns'] if column in feature_columns or column == TARGET_COLUMN]
+
+
+def _import_pyarrow():
+    # pyarrow is only needed when the data files are parquet
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("pyarrow is required to read and write parquet data files, install it with "
+                          "pip install pyarrow") from e
+    return pyarrow, pyarrow.parquet
+
+
+def is_parquet_file(file_path: str) -> bool:
+    return file_path.lower().endswith(".parquet")
+
+
+def write_dataframe(dataframe: DataFrame, file_path: str) -> None:
+    """
+    Writes a DataFrame as parquet or csv depending on the extension of file_path.
+
+    Args:
+        dataframe (DataFrame): The DataFrame to write.
+        file_path (str): A .parquet or .csv path.
+    """
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if is_parquet_file(file_path):
+            _import_pyarrow()
+            dataframe.to_parquet(file_path, index=False)
+        else:
+            dataframe.to_csv(file_path, index=False, header=True)
+    except Exception as e:
+        raise USVisaException(e, sys)
+
+
+def get_schema_dtypes(schema_info: dict) -> dict:
+    """
+    Returns the pandas dtypes of the Category columns of the schema that list their known categories.
+
+    Args:
+        schema_info (dict): The content of config/schema.yaml.
+
+    Returns:
+        dict: Column name to pandas CategoricalDtype.
+    """
+    categories = schema_info.get('categories') or {}
+    return {column: pd.CategoricalDtype(categories[column])
+            for column, column_type in schema_info['columns'].items()
+            if column_type == 'Category' and column in categories}
+
+
+def get_unknown_categories(dataframe: DataFrame, schema_info: dict) -> dict:
+    """
+    Returns the values of the Category columns of a DataFrame that are not among the categories of the schema.
+
+    Args:
+        dataframe (DataFrame): The DataFrame to check.
+        schema_info (dict): The content of config/schema.yaml.
+
+    Returns:
+        dict: Column name to the sorted unknown values, only for the columns having some.
+    """
+    unknown_categories = {}
+    for column, dtype in get_schema_dtypes(schema_info).items():
+        if column in dataframe.columns:
+            values = dataframe[column].dropna().unique()
+            unknown = sorted(set(str(value) for value in values) - set(str(value) for value in dtype.categories))
+            if unknown:
+                unknown_categories[column] = unknown
+    return unknown_categories
+
+
+def apply_schema_dtypes(dataframe: DataFrame, schema_info: dict, downcast: bool = True) -> DataFrame:
+    """
+    Converts the columns of a DataFrame to the compact dtypes of the schema: Category columns with known
+    categories become pandas categories, int columns numbers downcast to the smallest integer type that
+    fits when downcast is set, the na_values of the schema become NaN on the way. Values of a Category
+    column missing from the schema categories are kept as extra categories and logged, data validation
+    rejects them.
+
+    Args:
+        dataframe (DataFrame): The DataFrame, converted in place.
+        schema_info (dict): The content of config/schema.yaml.
+        downcast (bool): Whether to downcast the int columns, chunks appended to one file keep int64.
+
+    Returns:
+        DataFrame: The converted DataFrame.
+    """
+    try:
+        na_values = schema_info.get('na_values') or []
+        category_dtypes = get_schema_dtypes(schema_info)
+        for column, column_type in schema_info['columns'].items():
+            if column not in dataframe.columns:
+                continue
+            if column in category_dtypes:
+                values = dataframe[column]
+                if na_values:
+                    values = values.mask(values.isin(na_values))
+                known = list(category_dtypes[column].categories)
+                unknown = sorted(set(values.dropna().unique()) - set(known), key=str)
+                if unknown:
+                    logging.warning(f"Column {column} has values outside the schema categories: {unknown}")
+                dtype = pd.CategoricalDtype(known + unknown)
+                if values.dtype != dtype:
+                    values = values.astype(dtype)
+                dataframe[column] = values
+            elif column_type == 'int':
+                dataframe[column] = pd.to_numeric(dataframe[column], errors='coerce',
+                                                  downcast='integer' if downcast else None)
+            elif dataframe[column].dtype == object and na_values:
+                dataframe[column] = dataframe[column].mask(dataframe[column].isin(na_values))
+        return dataframe
+    except Exception as e:
+        raise USVisaException(e, sys)
+
+
+def _read_csv_options(schema_info: Optional[dict], columns: Optional[List[str]]) -> dict:
+    if schema_info is None:
+        return {"usecols": columns}
+    return {
+        "usecols": columns,
+        # category columns are parsed straight into codes and the na values into NaN by the csv parser, the
+        # categories of the schema are applied afterwards so values missing from them are not lost
+        "dtype": {column: "category" for column in get_schema_dtypes(schema_info)
+                  if columns is None or column in columns},
+        "na_values": schema_info.get('na_values'),
+    }
+
+
+def read_dataframe(file_path: str, columns: Optional[List[str]] = None,
+                   schema_info: Optional[dict] = None) -> DataFrame:
+    """
+    Reads a parquet or csv file, only the given columns when columns is set.
+
+    Args:
+        file_path (str): A .parquet or .csv path.
+        columns (list): Columns to read, None reads all of them.
+        schema_info (dict): The content of config/schema.yaml, when set the columns get the compact dtypes
+            of apply_schema_dtypes.
+
+    Returns:
+        DataFrame: The DataFrame read, parquet files keep the dtypes they were written with.
+    """
+    try:
+        if is_parquet_file(file_path):
+            _import_pyarrow()
+            dataframe = pd.read_parquet(file_path, columns=columns)
+        else:
+            dataframe = pd.read_csv(file_path, **_read_csv_options(schema_info, columns))
+        if schema_info is not None:
+            dataframe = apply_schema_dtypes(dataframe, schema_info)
+        return dataframe
+    except Exception as e:
+        raise USVisaException(e, sys)
+
+
+def iter_dataframe_chunks(file_path: str, chunksize: int, columns: Optional[List[str]] = None,
+                          schema_info: Optional[dict] = None) -> Iterator[DataFrame]:
+    """
+    Reads a parquet or csv file chunksize rows at a time.
+
+    Args:
+        file_path (str): A .parquet or .csv path.
+        chunksize (int): Rows per chunk.
+        columns (list): Columns to read, None reads all of them.
+        schema_info (dict): The content of config/schema.yaml, when set the categories of the schema are
+            applied to every chunk, int columns are not downcast so all chunks share their dtypes.
+
+    Returns:
+        Iterator[DataFrame]: The chunks of the file.
+    """
+    try:
+        if is_parquet_file(file_path):
+            _, parquet = _import_pyarrow()
+            chunks = (batch.to_pandas() for batch in
+                      parquet.ParquetFile(file_path).iter_batches(batch_size=chunksize, columns=columns))
+        else:
+            chunks = pd.read_csv(file_path, chunksize=chunksize, **_read_csv_options(schema_info, columns))
+        for chunk in chunks:
+            if schema_info is not None:
+                chunk = apply_schema_dtypes(chunk, schema_info, downcast=False)
+            yield chunk
+    except Exception as e:
+        raise USVisaException(e, sys)
+
+
+class DataFrameWriter:
+    """
+    Appends DataFrame chunks to one parquet or csv file, every chunk is cast to the columns and
+    types of the first one.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.columns: Optional[List[str]] = None
+        self.parquet_writer = None
+        self.schema = None
+        self.started = False
+
+    def write(self, chunk: DataFrame) -> None:
+        try:
+            if not self.started:
+                os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+                self.columns = list(chunk.columns)
+            chunk = chunk.reindex(columns=self.columns)
+            if is_parquet_file(self.file_path):
+                pyarrow, parquet = _import_pyarrow()
+                table = pyarrow.Table.from_pandas(chunk, schema=self.schema, preserve_index=False)
+                if self.parquet_writer is None:
+                    self.schema = table.schema
+                    self.parquet_writer = parquet.ParquetWriter(self.file_path, self.schema)
+                self.parquet_writer.write_table(table)
+            else:
+                chunk.to_csv(self.file_path, index=False, header=not self.started, mode="a" if self.started else "w")
+            self.started = True
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def close(self) -> None:
+        """
+        Closes the file, raises when no chunk was written since the file is then never created.
+        """
+        try:
+            if self.parquet_writer is not None:
+                self.parquet_writer.close()
+                self.parquet_writer = None
+            if not self.started:
+                raise ValueError(f"No rows ingested into {self.file_path}")
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def __enter__(self) -> "DataFrameWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        elif self.parquet_writer is not None:
+            # the exception of the with block is the one raised
+            self.parquet_writer.close()
+            self.parquet_writer = None
+
+
+class NumpyArrayWriter:
+    """
+    Appends row chunks to one .npy file without holding the whole array in memory, every chunk is cast to
+    the dtype and width of the first one. Room for the header is kept at the start of the file and the
+    header with the final number of rows is written on close.
+    """
+    HEADER_LENGTH = 128
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.file_obj = None
+        self.dtype: Optional[np.dtype] = None
+        self.columns: Optional[int] = None
+        self.rows = 0
+
+    def write(self, chunk: np.ndarray) -> None:
+        try:
+            if self.file_obj is None:
+                os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+                self.dtype, self.columns = chunk.dtype, chunk.shape[1]
+                self.file_obj = open(self.file_path, 'wb')
+                self.file_obj.write(b'\0' * self.HEADER_LENGTH)
+            self.file_obj.write(np.ascontiguousarray(chunk, dtype=self.dtype).tobytes())
+            self.rows += len(chunk)
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def _header(self) -> bytes:
+        magic = b'\x93NUMPY\x01\x00'
+        header = repr({'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False,
+                       'shape': (self.rows, self.columns)}).encode('latin1')
+        # padded with spaces up to HEADER_LENGTH as the npy format allows
+        header_length = self.HEADER_LENGTH - len(magic) - 2
+        return magic + header_length.to_bytes(2, 'little') + header.ljust(header_length - 1, b' ') + b'\n'
+
+    def close(self) -> None:
+        try:
+            if self.file_obj is None:
+                save_numpy_array_data(self.file_path, np.empty((0, 0)))
+                return
+            self.file_obj.seek(0)
+            self.file_obj.write(self._header())
+            self.file_obj.close()
+            self.file_obj = None
+        except Exception as e:
+            raise USVisaException(e, sys)
+
+    def __enter__(self) -> "NumpyArrayWriter":
+        return self
 
-        
\ No newline at end of file
+    def __exit__(self, *exc_info) -> None:
+        self.close()
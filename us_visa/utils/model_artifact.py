@@ -0,0 +1,160 @@
+import io
+import json
+import struct
+import sys
+from typing import List, Tuple, Union
+
+import dill
+import numpy as np
+
+from us_visa.constants import MODEL_ARTIFACT_MIN_SEGMENT_BYTES
+from us_visa.exception import USVisaException
+
+"""
+Layout of a model artifact, all integers little endian:
+
+    magic              8 bytes   MODEL_ARTIFACT_MAGIC
+    version            uint32    MODEL_ARTIFACT_FORMAT_VERSION
+    header length      uint64    length of the dill pickled object graph
+    table length       uint64    length of the json segment table
+    header                       object graph, large arrays replaced by persistent ids
+    segment table                [{"descr", "shape", "fortran_order", "offset", "nbytes"}], offsets relative to the data start
+    padding                      up to the next MODEL_ARTIFACT_ALIGNMENT boundary, the data start
+    segments                     raw array bytes, every segment aligned to MODEL_ARTIFACT_ALIGNMENT
+"""
+MODEL_ARTIFACT_MAGIC: bytes = b"USVISAMA"
+MODEL_ARTIFACT_FORMAT_VERSION: int = 1
+MODEL_ARTIFACT_ALIGNMENT: int = 64
+PREFIX = struct.Struct("<8sIQQ")
+
+
+def _align(position: int) -> int:
+    return -(-position // MODEL_ARTIFACT_ALIGNMENT) * MODEL_ARTIFACT_ALIGNMENT
+
+
+class _SegmentPickler(dill.Pickler):
+    def __init__(self, file_obj, min_segment_bytes: int):
+        super().__init__(file_obj)
+        self.min_segment_bytes = min_segment_bytes
+        self.segments: List[np.ndarray] = []
+        self.segment_ids = {}
+
+    def persistent_id(self, obj):
+        if (type(obj) in (np.ndarray, np.memmap) and not obj.dtype.hasobject
+                and obj.nbytes >= self.min_segment_bytes):
+            if id(obj) not in self.segment_ids:
+                self.segment_ids[id(obj)] = len(self.segments)
+                self.segments.append(obj)
+            return ("segment", self.segment_ids[id(obj)])
+        return None
+
+
+class _SegmentUnpickler(dill.Unpickler):
+    def __init__(self, file_obj, arrays: List[np.ndarray]):
+        super().__init__(file_obj)
+        self.arrays = arrays
+
+    def persistent_load(self, pid):
+        kind, index = pid
+        if kind != "segment":
+            raise ValueError(f"Unknown persistent id {pid!r} in model artifact")
+        return self.arrays[index]
+
+
+def is_model_artifact(data: bytes) -> bool:
+    """
+    Tells whether the leading bytes of a file are those of a model artifact rather than a dill pickle
+    """
+    return data[:len(MODEL_ARTIFACT_MAGIC)] == MODEL_ARTIFACT_MAGIC
+
+
+def dump_model_artifact(obj: object, file_obj, min_segment_bytes: int = MODEL_ARTIFACT_MIN_SEGMENT_BYTES) -> None:
+    """
+    Writes obj as a model artifact: the numpy arrays of at least min_segment_bytes become aligned raw
+    segments and only the rest of the object graph is pickled.
+
+    Args:
+        obj (object): Object to save, e.g. USvisaModel
+        file_obj: Binary file opened for writing
+        min_segment_bytes (int): Smaller arrays stay inside the pickled header
+    """
+    try:
+        header = io.BytesIO()
+        pickler = _SegmentPickler(header, min_segment_bytes=min_segment_bytes)
+        pickler.dump(obj)
+
+        table, offset = [], 0
+        for array in pickler.segments:
+            fortran_order = bool(array.flags.f_contiguous and not array.flags.c_contiguous)
+            table.append({"descr": np.lib.format.dtype_to_descr(array.dtype), "shape": list(array.shape),
+                          "fortran_order": fortran_order, "offset": offset, "nbytes": int(array.nbytes)})
+            offset = _align(offset + array.nbytes)
+        table_bytes = json.dumps(table).encode("utf-8")
+
+        header_bytes = header.getvalue()
+        file_obj.write(PREFIX.pack(MODEL_ARTIFACT_MAGIC, MODEL_ARTIFACT_FORMAT_VERSION,
+                                   len(header_bytes), len(table_bytes)))
+        file_obj.write(header_bytes)
+        file_obj.write(table_bytes)
+        position = PREFIX.size + len(header_bytes) + len(table_bytes)
+        data_start = _align(position)
+
+        for array, segment in zip(pickler.segments, table):
+            file_obj.write(b"\0" * (data_start + segment["offset"] - position))
+            order = "F" if segment["fortran_order"] else "C"
+            file_obj.write(np.require(array, requirements=order).ravel(order=order).view(np.uint8))
+            position = data_start + segment["offset"] + segment["nbytes"]
+    except Exception as e:
+        raise USVisaException(e, sys) from e
+
+
+def _read_prefix(buffer) -> Tuple[bytes, list, int]:
+    magic, version, header_length, table_length = PREFIX.unpack_from(buffer, 0)
+    if magic != MODEL_ARTIFACT_MAGIC:
+        raise ValueError("Not a model artifact")
+    if version > MODEL_ARTIFACT_FORMAT_VERSION:
+        raise ValueError(f"Model artifact format version {version} is newer than the supported "
+                         f"version {MODEL_ARTIFACT_FORMAT_VERSION}")
+    header_end = PREFIX.size + header_length
+    header_bytes = bytes(buffer[PREFIX.size:header_end])
+    table = json.loads(bytes(buffer[header_end:header_end + table_length]).decode("utf-8"))
+    return header_bytes, table, _align(header_end + table_length)
+
+
+def _load_from_buffer(buffer: Union[bytes, np.ndarray]) -> object:
+    header_bytes, table, data_start = _read_prefix(buffer)
+    arrays = []
+    for segment in table:
+        # views on the buffer, nothing is copied; on a read only mmap the arrays are read only too
+        arrays.append(np.ndarray(shape=tuple(segment["shape"]), dtype=np.lib.format.descr_to_dtype(segment["descr"]),
+                                 buffer=buffer, offset=data_start + segment["offset"],
+                                 order="F" if segment["fortran_order"] else "C"))
+    return _SegmentUnpickler(io.BytesIO(header_bytes), arrays=arrays).load()
+
+
+def load_model_artifact(file_path: str, mmap_mode: str = "r") -> object:
+    """
+    Loads a model artifact with its segments memory mapped from file_path, so only the pickled header is
+    parsed and the array pages are read lazily from the page cache.
+
+    Args:
+        file_path (str): Path of the model artifact
+        mmap_mode (str): "r" for read only arrays, "c" for copy on write arrays
+
+    Returns:
+        object: The loaded object
+    """
+    try:
+        return _load_from_buffer(np.memmap(file_path, dtype=np.uint8, mode=mmap_mode))
+    except Exception as e:
+        raise USVisaException(e, sys) from e
+
+
+def loads_model_artifact(data: bytes) -> object:
+    """
+    Loads a model artifact already held in memory, e.g. downloaded from s3, the arrays are views on data
+    """
+    try:
+        return _load_from_buffer(data)
+    except Exception as e:
+        raise USVisaException(e, sys) from e
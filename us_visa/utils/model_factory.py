@@ -0,0 +1,250 @@
+import math
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+from joblib import Parallel, delayed
+from joblib.parallel import effective_n_jobs
+from neuro_mf import GridSearchedBestModel, InitializedModelDetail, ModelFactory
+from sklearn.base import clone
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import ParameterGrid, ParameterSampler, check_cv
+
+from us_visa.constants import MODEL_TRAINER_SEARCH_KEY
+from us_visa.exception import USVisaException
+from us_visa.logger import logging
+from us_visa.utils.transform_cache import data_hash
+
+SEARCH_STRATEGIES = ("grid", "random", "halving")
+
+
+def _fit_and_score(estimator, parameters: dict, X_train, y_train, X_test, y_test, scoring) -> Tuple[float, float]:
+    # failed fits score nan like GridSearchCV's default error_score, the grid point then ranks last
+    start = time.perf_counter()
+    try:
+        estimator = clone(estimator).set_params(**parameters)
+        estimator.fit(X_train, y_train)
+        score = check_scoring(estimator, scoring=scoring)(estimator, X_test, y_test)
+    except Exception:
+        score = np.nan
+    return score, time.perf_counter() - start
+
+
+def _refit(estimator, parameters: dict, X, y) -> Tuple[object, float]:
+    start = time.perf_counter()
+    estimator = clone(estimator).set_params(**parameters).fit(X, y)
+    return estimator, time.perf_counter() - start
+
+
+class ParallelModelFactory(ModelFactory):
+    """
+    Class Name: ParallelModelFactory
+    Description: ModelFactory running the searches of all the model_selection candidates of model.yaml in one
+                 process pool: every (candidate, grid point, fold) fit is a task, and the refits of the best grid
+                 point of each candidate run in parallel too. The folds and the scoring are those of the
+                 grid_search params, the best grid point of a candidate is the first with the highest mean score
+                 as for GridSearchCV and candidates tie in config order, so the best model does not depend on the
+                 number of workers.
+
+                 The search section of model.yaml picks the strategy: grid evaluates every grid point, random a
+                 sample of n_candidates grid points per model and halving starts every grid point on
+                 min_resources rows, keeping the best 1/factor of each model on factor times more rows per
+                 round. max_fits and max_seconds stop a search early, the best grid points found so far are
+                 then kept. search_report records the fits and seconds spent on every candidate.
+
+                 The train and test arrays of the folds of the last rows evaluated are kept by the factory, so
+                 the batches of candidates evaluated on the same rows share them.
+    """
+
+    def __init__(self, model_config_path: str = None, n_jobs: Optional[int] = None,
+                 class_weight: Optional[dict] = None):
+        """
+        :param model_config_path: Path of model.yaml
+        :param n_jobs: Number of worker processes, from the n_jobs of the grid_search params when None, -1 for all cores
+        :param class_weight: Weights of the target classes, given to the models with a class_weight param
+        """
+        super().__init__(model_config_path=model_config_path)
+        self.folds: Tuple[str, List[tuple]] = ("", [])
+        self.class_weight = class_weight
+        self.n_jobs = self.grid_search_property_data.get("n_jobs", 1) if n_jobs is None else n_jobs
+        self.cv = self.grid_search_property_data.get("cv", 5)
+        self.scoring = self.grid_search_property_data.get("scoring")
+        self.verbose = self.grid_search_property_data.get("verbose", 0)
+
+        search_config = dict(self.config.get(MODEL_TRAINER_SEARCH_KEY) or {})
+        self.strategy: str = search_config.get("strategy", "grid")
+        if self.strategy not in SEARCH_STRATEGIES:
+            raise ValueError(f"Unknown search strategy {self.strategy}, expected one of {SEARCH_STRATEGIES}")
+        self.n_candidates: int = int(search_config.get("n_candidates", 10))
+        self.factor: int = int(search_config.get("factor", 3))
+        self.min_resources: int = int(search_config.get("min_resources", 1000))
+        self.max_fits: Optional[int] = search_config.get("max_fits")
+        self.max_seconds: Optional[float] = search_config.get("max_seconds")
+        self.search_report: dict = {}
+
+    @property
+    def has_budget(self) -> bool:
+        return self.max_fits is not None or self.max_seconds is not None
+
+    def _budget_left(self) -> bool:
+        if self.max_fits is not None and self.fits >= self.max_fits:
+            return False
+        if self.max_seconds is not None and time.perf_counter() - self.started_at >= self.max_seconds:
+            return False
+        return True
+
+    def get_initialized_model_list(self) -> List[InitializedModelDetail]:
+        initialized_model_list = super().get_initialized_model_list()
+        if self.class_weight is not None:
+            for initialized_model in initialized_model_list:
+                if "class_weight" in initialized_model.model.get_params():
+                    initialized_model.model.set_params(class_weight=self.class_weight)
+                else:
+                    logging.info(f"{initialized_model.model_name} has no class_weight param, trained unweighted")
+        return initialized_model_list
+
+    def get_folds(self, input_feature, output_feature) -> List[tuple]:
+        """
+        Returns the (X_train, y_train, X_test, y_test) arrays of every cross validation fold of the rows
+        """
+        key = f"{data_hash(input_feature)}:{data_hash(output_feature)}"
+        if self.folds[0] != key:
+            # only the folds of the last rows are kept, they are as large as the data
+            cv = check_cv(self.cv, output_feature, classifier=True)
+            self.folds = (key, [(input_feature[train], output_feature[train], input_feature[test], output_feature[test])
+                                for train, test in cv.split(input_feature, output_feature)])
+        return self.folds[1]
+
+    def _evaluate(self, parallel: Parallel, initialized_model_list: List[InitializedModelDetail],
+                  candidates: List[Tuple[int, dict]], input_feature, output_feature) -> List[float]:
+        """
+        Returns the mean cross validation score of every (model index, parameters) candidate on the given rows
+        """
+        splits = self.get_folds(input_feature, output_feature)
+        # results come back in task order whatever the order the workers finish in
+        results = iter(parallel(
+            delayed(_fit_and_score)(initialized_model_list[model_index].model, parameters, *fold, self.scoring)
+            for model_index, parameters in candidates
+            for fold in splits))
+
+        mean_scores = []
+        for model_index, _ in candidates:
+            scores, seconds = zip(*(next(results) for _ in splits))
+            report = self.search_report[initialized_model_list[model_index].model_serial_number]
+            report["fits"] += len(splits)
+            report["fit_seconds"] += float(sum(seconds))
+            self.fits += len(splits)
+            mean_scores.append(float(np.mean(scores)))
+        return mean_scores
+
+    def _search_full_data(self, parallel: Parallel, initialized_model_list: List[InitializedModelDetail],
+                          grids: List[List[dict]], input_feature, output_feature) -> List[List[Tuple[dict, float]]]:
+        # the candidates of all the models are interleaved, so a budget cut leaves every model some candidates
+        candidates = [(model_index, grid[position])
+                      for position in range(max(len(grid) for grid in grids))
+                      for model_index, grid in enumerate(grids) if position < len(grid)]
+        batch_size = max(effective_n_jobs(self.n_jobs), len(grids)) if self.has_budget else len(candidates)
+        results = [[] for _ in grids]
+        for start in range(0, len(candidates), batch_size):
+            if start > 0 and not self._budget_left():
+                logging.info(f"Search budget spent after {start} of {len(candidates)} candidates")
+                break
+            batch = candidates[start:start + batch_size]
+            scores = self._evaluate(parallel, initialized_model_list, batch, input_feature, output_feature)
+            for (model_index, parameters), score in zip(batch, scores):
+                results[model_index].append((parameters, score))
+        return results
+
+    def _search_halving(self, parallel: Parallel, initialized_model_list: List[InitializedModelDetail],
+                        grids: List[List[dict]], input_feature, output_feature) -> List[List[Tuple[dict, float]]]:
+        # the rounds use growing prefixes of one shuffle of the rows
+        rows = np.random.RandomState(42).permutation(len(output_feature))
+        survivors = [list(grid) for grid in grids]
+        n_resources = min(self.min_resources, len(rows))
+        while True:
+            candidates = [(model_index, parameters)
+                          for model_index, grid in enumerate(survivors) for parameters in grid]
+            subset = np.sort(rows[:n_resources])
+            scores = self._evaluate(parallel, initialized_model_list, candidates,
+                                    input_feature[subset], output_feature[subset])
+            results = [[] for _ in grids]
+            for (model_index, parameters), score in zip(candidates, scores):
+                results[model_index].append((parameters, score))
+            logging.info(f"Halving round on {n_resources} rows evaluated {len(candidates)} candidates")
+
+            if n_resources >= len(rows) or not self._budget_left():
+                return results
+            # the best 1/factor of each model goes on, ties kept in grid order
+            survivors = []
+            for model_results in results:
+                keep = max(1, math.ceil(len(model_results) / self.factor))
+                ranked = sorted(range(len(model_results)),
+                                key=lambda index: -np.nan_to_num(model_results[index][1], nan=-np.inf))
+                survivors.append([model_results[index][0] for index in sorted(ranked[:keep])])
+            # once every model is down to one grid point it is scored on all the rows
+            if all(len(grid) == 1 for grid in survivors):
+                n_resources = len(rows)
+            else:
+                n_resources = min(n_resources * self.factor, len(rows))
+
+    def initiate_best_parameter_search_for_initialized_models(self,
+                                                              initialized_model_list: List[InitializedModelDetail],
+                                                              input_feature,
+                                                              output_feature) -> List[GridSearchedBestModel]:
+        """
+        Method Name: initiate_best_parameter_search_for_initialized_models
+        Description: Searches all the initialized models at once in the process pool with the configured strategy.
+        Output: GridSearchedBestModel of every model with at least one scored candidate, in config order
+        On Failure: Raise Exception
+        """
+        try:
+            self.started_at, self.fits = time.perf_counter(), 0
+            grids = []
+            for model_index, initialized_model in enumerate(initialized_model_list):
+                grid = list(ParameterGrid(initialized_model.param_grid_search))
+                if self.strategy == "random":
+                    grid = list(ParameterSampler(initialized_model.param_grid_search,
+                                                 n_iter=min(self.n_candidates, len(grid)), random_state=42))
+                grids.append(grid)
+                self.search_report[initialized_model.model_serial_number] = {
+                    "model": initialized_model.model_name, "grid_points": len(grid), "fits": 0, "fit_seconds": 0.0}
+            logging.info(f"Searching {sum(len(grid) for grid in grids)} grid points of {len(grids)} models with "
+                         f"the {self.strategy} strategy and n_jobs={self.n_jobs}")
+
+            with Parallel(n_jobs=self.n_jobs, verbose=self.verbose) as parallel:
+                search = self._search_halving if self.strategy == "halving" else self._search_full_data
+                results = search(parallel, initialized_model_list, grids, input_feature, output_feature)
+
+                best_candidates = []
+                for initialized_model, model_results in zip(initialized_model_list, results):
+                    scores = np.array([score for _, score in model_results])
+                    if len(scores) == 0 or np.isnan(scores).all():
+                        logging.info(f"No candidate of {initialized_model.model_name} was scored, skipping it")
+                        continue
+                    best_index = int(np.nanargmax(scores))
+                    best_candidates.append((initialized_model, *model_results[best_index]))
+                    logging.info(f"Best parameters of {initialized_model.model_name}: {model_results[best_index][0]}, "
+                                 f"score {scores[best_index]}")
+                if not best_candidates:
+                    raise Exception("No model_selection candidate could be scored")
+
+                refits = parallel(
+                    delayed(_refit)(initialized_model.model, parameters, input_feature, output_feature)
+                    for initialized_model, parameters, _ in best_candidates)
+
+            self.grid_searched_best_model_list = []
+            for (initialized_model, parameters, score), (best_model, seconds) in zip(best_candidates, refits):
+                self.search_report[initialized_model.model_serial_number].update(
+                    best_parameters=parameters, best_score=score, refit_seconds=seconds)
+                self.grid_searched_best_model_list.append(
+                    GridSearchedBestModel(model_serial_number=initialized_model.model_serial_number,
+                                          model=initialized_model.model,
+                                          best_model=best_model,
+                                          best_parameters=parameters,
+                                          best_score=score))
+            logging.info(f"Search took {time.perf_counter() - self.started_at:.1f}s and {self.fits} fits: "
+                         f"{self.search_report}")
+            return self.grid_searched_best_model_list
+        except Exception as e:
+            raise USVisaException(e, sys) from e
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import sys
+import weakref
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import dill
+import joblib
+import numpy as np
+import pandas as pd
+
+from us_visa.exception import USVisaException
+from us_visa.logger import logging
+
+
+def data_hash(data) -> str:
+    """
+    Returns a digest of the values of a DataFrame, Series or array, DataFrames hash the same whether their
+    columns are categorical or object as long as the values and the column names are the same
+    """
+    digest = hashlib.sha256()
+    if isinstance(data, pd.DataFrame):
+        digest.update(repr(list(data.columns)).encode("utf-8"))
+        digest.update(pd.util.hash_pandas_object(data, index=False).values.tobytes())
+    elif isinstance(data, pd.Series):
+        digest.update(pd.util.hash_pandas_object(data, index=False).values.tobytes())
+    else:
+        array = np.ascontiguousarray(data)
+        digest.update(f"{array.dtype.str}{array.shape}".encode("utf-8"))
+        digest.update(array.view(np.uint8).reshape(-1) if array.size else b"")
+    return digest.hexdigest()
+
+
+def _nbytes(result) -> int:
+    if isinstance(result, (list, tuple)):
+        return sum(_nbytes(item) for item in result)
+    return int(getattr(result, "nbytes", 0))
+
+
+class TransformCache:
+    """
+    Class Name: TransformCache
+    Description: Cache of the results of applying a fitted transformer to some data, keyed by the fingerprint
+                 of the fitted transformer (a digest of its canonical pickle) and the hash of the data. Results
+                 are kept in memory up to max_bytes, least recently used first out, and the arrays are also written
+                 to cache_dir so later runs transforming the same data with an identical transformer load them.
+                 The files of cache_dir are evicted the same way once they exceed disk_max_bytes.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = 512 * 1024 ** 2,
+                 disk_max_bytes: int = 2 * 1024 ** 3, enabled: bool = True):
+        """
+        :param cache_dir: Directory of the cached arrays, None keeps the results in memory only
+        :param max_bytes: Size of the results kept in memory
+        :param disk_max_bytes: Size of the arrays kept in cache_dir
+        :param enabled: False computes every result
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.enabled = enabled
+        self.entries: "OrderedDict[str, object]" = OrderedDict()
+        self.entry_bytes = 0
+        self.fingerprints = weakref.WeakKeyDictionary()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "disk_evictions": 0}
+
+    def fingerprint(self, transformer) -> str:
+        """
+        Returns the digest of the canonical pickle of a fitted transformer, computed once per object
+        """
+        try:
+            return self.fingerprints[transformer]
+        except (KeyError, TypeError):
+            pass
+        try:
+            # joblib hashes a canonical pickle, plain pickles differ with the sharing of equal strings, e.g.
+            # between a fitted transformer and the same transformer loaded back from a file
+            fingerprint = joblib.hash(transformer, hash_name="sha1")
+        except Exception:
+            fingerprint = hashlib.sha256(dill.dumps(transformer, protocol=4)).hexdigest()
+        try:
+            self.fingerprints[transformer] = fingerprint
+        except TypeError:
+            pass
+        return fingerprint
+
+    def make_key(self, transformer, data) -> str:
+        # only the columns the transformer was fitted on are part of the key, the others do not change the result
+        columns = getattr(transformer, "feature_names_in_", None)
+        if isinstance(data, pd.DataFrame) and columns is not None and set(columns).issubset(data.columns):
+            data = data[list(columns)]
+        return hashlib.sha256(f"{self.fingerprint(transformer)}:{data_hash(data)}".encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    def _keep(self, key: str, result) -> None:
+        nbytes = _nbytes(result)
+        if nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+        self.entries[key] = result
+        self.entry_bytes += nbytes
+        while self.entry_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.entry_bytes -= _nbytes(evicted)
+
+    def get_or_compute(self, key: str, compute: Callable[[], object]):
+        """
+        Method Name: get_or_compute
+        Description: Returns the result cached for key, or compute() which is then cached. Only numpy arrays
+                     are persisted to cache_dir.
+        Output: The cached or computed result
+        On Failure: Raise Exception
+        """
+        try:
+            if not self.enabled:
+                return compute()
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self.entries[key]
+            entry_path = self._entry_path(key) if self.cache_dir else None
+            if entry_path is not None and os.path.exists(entry_path):
+                try:
+                    result = np.load(entry_path, allow_pickle=False)
+                except FileNotFoundError:
+                    # evicted by another run in between
+                    result = None
+                if result is not None:
+                    self._touch(entry_path)
+                    self.stats["disk_hits"] += 1
+                    self._keep(key, result)
+                    return result
+
+            self.stats["misses"] += 1
+            result = compute()
+            self._store(key, result, entry_path)
+            return result
+        except Exception as e:
+            raise USVisaException(e, sys) from e
+
+    def _store(self, key: str, result, entry_path: Optional[str]) -> None:
+        self._keep(key, result)
+        if entry_path is not None and isinstance(result, np.ndarray) and not result.dtype.hasobject:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            # renamed into place so a concurrent run never loads a partial file
+            tmp_file_path = f"{entry_path}.{os.getpid()}.tmp.npy"
+            np.save(tmp_file_path, result, allow_pickle=False)
+            os.replace(tmp_file_path, entry_path)
+            self.evict(keep=entry_path)
+
+    @staticmethod
+    def _touch(entry_path: str) -> None:
+        # the modification time orders the files for eviction
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """
+        Removes the least recently used arrays of cache_dir until it holds at most disk_max_bytes.
+        Returns the number of arrays removed
+        """
+        entries = []
+        for root, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                # the tmp files of runs still writing are left alone
+                if not file_name.endswith(".npy") or ".tmp." in file_name:
+                    continue
+                entry_path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(entry_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry_path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            if entry_path == keep:
+                continue
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            logging.info(f"Evicted {entry_path} from transform cache")
+        self.stats["disk_evictions"] += removed
+        return removed
+
+    def transform(self, transformer, data):
+        """
+        Returns transformer.transform(data), computed once per fitted transformer and data
+        """
+        if not self.enabled:
+            return transformer.transform(data)
+        return self.get_or_compute(self.make_key(transformer, data), lambda: transformer.transform(data))
+
+    def put(self, transformer, data, result) -> None:
+        """
+        Records the result of transforming data with the fitted transformer, e.g. the output of fit_transform
+        """
+        try:
+            if self.enabled:
+                key = self.make_key(transformer, data)
+                entry_path = self._entry_path(key) if self.cache_dir else None
+                if entry_path is not None and os.path.exists(entry_path):
+                    entry_path = None
+                self._store(key, result, entry_path)
+        except Exception as e:
+            raise USVisaException(e, sys) from e
+
+    def log_stats(self) -> None:
+        logging.info(f"Transform cache: {self.stats}, {len(self.entries)} results ({self.entry_bytes} bytes) in memory")